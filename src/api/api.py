@@ -1,5 +1,6 @@
 import io
 import os
+import asyncio
 import sys
 import time
 from loguru import logger
@@ -14,16 +15,17 @@ from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END
 import uvicorn
 from pathlib import Path
-from sentence_transformers import CrossEncoder
 from contextlib import asynccontextmanager
 from fastapi.responses import StreamingResponse
 import json
+import uuid
+from collections import OrderedDict
 
 # Agregar src al path para asegurar imports si se ejecuta directamente
 sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
 load_dotenv()
 
-from utilidades import utils, funciones_db, funciones_evaluacion
+from utilidades import utils, funciones_db, funciones_evaluacion, funciones_inferencia, funciones_cache, funciones_router, funciones_padres, funciones_reranker, funciones_bm25, funciones_vectores
 from utilidades import prompts
 import torch
 from transformers import CLIPModel, CLIPProcessor
@@ -55,8 +57,36 @@ model_clip      = None
 clip_processor  = None
 device          = None
 
+# Micro-batchers de inferencia (se crean en el lifespan)
+batcher_emb     = None
+batcher_rerank  = None
+batcher_clip    = None
+
+# Evaluación de calidad en segundo plano: cola de trabajos y resultados por request_id
+cola_calidad: Optional[asyncio.Queue] = None
+workers_calidad: List[asyncio.Task] = []
+resultados_calidad: "OrderedDict[str, dict]" = OrderedDict()
+
+# Caché semántica de respuestas (se crea en el lifespan)
+cache_semantico: Optional[funciones_cache.CacheSemantico] = None
+# Caché de puntuaciones del reranker por (pregunta, chunk)
+cache_scores: Optional[funciones_cache.CacheScores] = None
+# Router de intención local (prototipos por categoría)
+router_local: Optional[funciones_router.RouterLocal] = None
+# Memoización de HyDE (texto + embedding) compartida entre peticiones
+cache_hyde: Optional[funciones_cache.CacheHyde] = None
+
 # Caché de métricas de retrieval (se rellenan al arranque o al llamar a /metricas-retrieval)
 retrieval_metrics_cache: dict = {"hit_rate": None, "mrr": None, "num_preguntas": None}
+# Vigilancia del alias de colecciones (cambio de versión en caliente)
+tarea_alias: Optional[asyncio.Task] = None
+# Metadatos que usan el router/buscador y faltan en el índice servido (ver /health)
+consistencia_indice: dict = {}
+# Índice léxico BM25 de la versión servida (búsqueda híbrida con RRF)
+indice_bm25: Optional[funciones_bm25.IndiceBM25] = None
+BUSQUEDA_HIBRIDA = os.getenv("BUSQUEDA_HIBRIDA", "true").lower() == "true"
+HIBRIDO_CANDIDATOS = int(os.getenv("HIBRIDO_CANDIDATOS", "10"))
+HIBRIDO_TOP_K = int(os.getenv("HIBRIDO_TOP_K", "8"))
 
 
 def _evaluar_retrieval_y_guardar_en_cache() -> None:
@@ -75,13 +105,19 @@ def _evaluar_retrieval_y_guardar_en_cache() -> None:
                 col_pdfs, llm_fast, os.getenv("MODELO_FAST"), num_preguntas=num
             )
         if golden_set:
+            backend_pdfs = funciones_vectores.obtener_backend("pdfs")
             hit_rate, mrr = funciones_evaluacion.evaluar_retrieval(
-                col_pdfs, model_emb, golden_set, top_k=3
+                backend_pdfs, model_emb, golden_set, top_k=3
             )
             num = int(os.getenv("GOLDEN_SET_DEFAULT_NUM", "20"))
             retrieval_metrics_cache["hit_rate"] = hit_rate
             retrieval_metrics_cache["mrr"] = mrr
             retrieval_metrics_cache["num_preguntas"] = num
+            if indice_bm25 is not None:
+                retrieval_metrics_cache["por_modo"] = funciones_evaluacion.evaluar_retrieval_modos(
+                    backend_pdfs, model_emb, indice_bm25, golden_set, top_k=3, candidatos=HIBRIDO_CANDIDATOS
+                )
+                logger.info(f"[RETRIEVAL] Denso / léxico / híbrido: {retrieval_metrics_cache['por_modo']}")
             logger.info(f"[RETRIEVAL] Métricas en caché: hit_rate={hit_rate:.2%}, mrr={mrr:.3f}, num_preguntas={num}")
         else:
             logger.warning("[RETRIEVAL] No hay golden set; métricas de retrieval quedarán en None.")
@@ -89,17 +125,126 @@ def _evaluar_retrieval_y_guardar_en_cache() -> None:
         logger.error(f"[RETRIEVAL] Error evaluando retrieval al inicio: {e}")
 
 
+def _construir_router_local() -> Optional[funciones_router.RouterLocal]:
+    """Router de intención con los prototipos de la colección de PDFs abierta (None si falla)."""
+    try:
+        return funciones_router.RouterLocal.construir(
+            funciones_db.obtener_coleccion("pdfs"), model_emb, CATEGORIAS_VALIDAS,
+            margen_minimo=float(os.getenv("ROUTER_MARGEN_MINIMO", "0.03"))
+        )
+    except Exception as e:
+        logger.warning(f"[ROUTER] No se pudo construir el router local; se usará el LLM: {e}")
+        return None
+
+
+def _cargar_indice_bm25() -> None:
+    """(Re)carga el índice BM25 de la versión servida; si no existe, se construye desde la colección."""
+    global indice_bm25
+    if not BUSQUEDA_HIBRIDA:
+        return
+    directorio = funciones_db.registro.directorio()
+    funciones_bm25.olvidar_indice(directorio)
+    try:
+        indice_bm25 = funciones_bm25.obtener_indice(directorio, funciones_db.obtener_coleccion("pdfs"))
+    except Exception as e:
+        logger.warning(f"[BM25] No se pudo cargar el índice léxico; solo búsqueda densa: {e}")
+        indice_bm25 = None
+
+
+async def _al_cambiar_version() -> None:
+    """
+    Tras un cambio de versión de las colecciones o una ingesta incremental sobre la servida:
+    vacía las cachés que dependen del retrieval, recarga el BM25 y recalcula, en segundo plano,
+    el router local (centroides) y las métricas de /metricas-retrieval.
+    """
+    global router_local, consistencia_indice
+    if cache_semantico is not None:
+        cache_semantico.invalidar()
+    if cache_scores is not None:
+        cache_scores.invalidar()
+    logger.info(f"[VERSIONES] Cachés invalidadas; sirviendo la versión {funciones_db.registro.version}.")
+    consistencia_indice = await asyncio.to_thread(funciones_db.comprobar_consistencia, CATEGORIAS_VALIDAS)
+    await asyncio.to_thread(_cargar_indice_bm25)
+    if os.getenv("ROUTER_LOCAL", "true").lower() == "true":
+        router_local = await asyncio.to_thread(_construir_router_local)
+    await asyncio.to_thread(_evaluar_retrieval_y_guardar_en_cache)
+
+
+async def _vigilar_alias(intervalo: float) -> None:
+    """
+    Comprueba periódicamente el alias de colecciones y cambia de versión sin reiniciar la API.
+    Aprovecha el mismo bucle para persistir la caché de HyDE cada HYDE_CACHE_GUARDAR_SEGUNDOS
+    (solo si tiene entradas nuevas), para no perderla si el proceso muere sin apagado ordenado.
+    """
+    intervalo_hyde = float(os.getenv("HYDE_CACHE_GUARDAR_SEGUNDOS", "60"))
+    ultimo_guardado_hyde = time.monotonic()
+    while True:
+        await asyncio.sleep(intervalo)
+        if cache_hyde is not None and time.monotonic() - ultimo_guardado_hyde >= intervalo_hyde:
+            ultimo_guardado_hyde = time.monotonic()
+            try:
+                await asyncio.to_thread(cache_hyde.guardar_en_disco, True)
+            except Exception as e:
+                logger.error(f"[HYDE] Error guardando la caché en disco: {e}")
+        try:
+            if await asyncio.to_thread(funciones_db.registro.comprobar_alias):
+                await _al_cambiar_version()
+            elif await asyncio.to_thread(funciones_db.registro.comprobar_cambios):
+                # Ingesta incremental sobre la versión servida (fragmentos ya redescubiertos)
+                await _al_cambiar_version()
+        except Exception as e:
+            logger.error(f"[VERSIONES] Error comprobando el alias de colecciones: {e}")
+
+
+def _encode_textos(textos: List[str]) -> List[List[float]]:
+    """Embeddings de texto (SentenceTransformer) para un lote de textos."""
+    return utils.generar_embeddings(model_emb, textos)
+
+
+def _puntuar_pares(pares: List[list]) -> List[float]:
+    """Puntuaciones del CrossEncoder para un lote de pares (pregunta, documento)."""
+    return [float(s) for s in rerank_model.predict(pares)]
+
+
+def _encode_textos_clip(textos: List[str]) -> List[List[float]]:
+    """Embeddings de texto CLIP normalizados para un lote de textos."""
+    inputs = clip_processor(text=textos, return_tensors="pt", padding=True, truncation=True).to(device)
+    with torch.no_grad():
+        text_features = model_clip.get_text_features(**inputs)
+        
+        # Robustez: verificar si devuelve un objeto en lugar de tensor
+        if not isinstance(text_features, torch.Tensor):
+            if hasattr(text_features, "text_embeds"):
+                text_features = text_features.text_embeds
+            elif hasattr(text_features, "pooler_output"):
+                # Fallback: Extraer pooler_output y proyectar si es necesario
+                # Esto maneja el caso donde get_text_features devuelve el output raw del text_model
+                text_features = text_features.pooler_output
+                if hasattr(model_clip, "text_projection"):
+                    text_features = model_clip.text_projection(text_features)
+        
+        # Normalizar es importante para CLIP si usamos distancia coseno
+        text_features = text_features / text_features.norm(p=2, dim=-1, keepdim=True)
+        return text_features.cpu().numpy().tolist()
+
+
 # Carga todas las herramientas necesarias al iniciar la API
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # El código aquí se ejecuta al INICIAR la API
     global model_emb, rerank_model, llm_fast, llm_heavy, model_clip, clip_processor, device
+    global batcher_emb, batcher_rerank, batcher_clip, cola_calidad, workers_calidad, cache_semantico, cache_hyde, router_local, cache_scores
+    global tarea_alias, consistencia_indice
     device = "cuda" if os.getenv("USE_CUDA") == "true" else "cpu"
+    # La caché de embeddings en disco es para la ingesta; las preguntas de usuario no se guardan
+    utils.usar_cache_embeddings(False)
     
     logger.info(f"Cargando modelos en dispositivo: {device.upper()}")
     
     model_emb = SentenceTransformer(os.getenv("MODELO_EMBEDDINGS"), device=device)
-    rerank_model = CrossEncoder(os.getenv("MODELO_RERANKER", 'BAAI/bge-reranker-v2-m3'), device=device)
+    # CrossEncoder por defecto; RERANKER_BACKEND=onnx usa el modelo int8 exportado (misma interfaz predict)
+    rerank_model = funciones_reranker.cargar_reranker(device)
+    cache_scores = funciones_cache.CacheScores(max_entradas=int(os.getenv("RERANKER_CACHE_MAX_ENTRADAS", "20000")))
     
     # Cargar CLIP
     logger.info("Cargando modelo CLIP...")
@@ -121,17 +266,62 @@ async def lifespan(app: FastAPI):
         streaming=True
     )
 
+    # Agrupar las llamadas concurrentes a los modelos locales en lotes
+    max_batch = int(os.getenv("BATCH_MAX_TAMANO", "32"))
+    max_espera_ms = float(os.getenv("BATCH_MAX_ESPERA_MS", "5"))
+    batcher_emb = funciones_inferencia.MicroBatcher("embeddings", _encode_textos, max_batch, max_espera_ms)
+    batcher_rerank = funciones_inferencia.MicroBatcher("reranker", _puntuar_pares, max_batch, max_espera_ms)
+    batcher_clip = funciones_inferencia.MicroBatcher("clip_texto", _encode_textos_clip, max_batch, max_espera_ms)
+    for batcher in (batcher_emb, batcher_rerank, batcher_clip):
+        batcher.iniciar()
+
+    if os.getenv("CACHE_SEMANTICO", "true").lower() == "true":
+        cache_semantico = funciones_cache.CacheSemantico(
+            umbral=float(os.getenv("CACHE_SEMANTICO_UMBRAL", "0.92")),
+            max_entradas=int(os.getenv("CACHE_SEMANTICO_MAX_ENTRADAS", "500")),
+            ttl_segundos=float(os.getenv("CACHE_SEMANTICO_TTL_SEGUNDOS", "86400"))
+        )
+
+    cache_hyde = funciones_cache.CacheHyde(
+        max_entradas=int(os.getenv("HYDE_CACHE_MAX_ENTRADAS", "1000")),
+        ruta=os.getenv("HYDE_CACHE_PATH") or None,
+        modelo=f"{os.getenv('MODELO_FAST')}|{os.getenv('MODELO_EMBEDDINGS')}"
+    )
+    cache_hyde.cargar()
+
+    # Cola de evaluación de calidad (jueces fuera del camino crítico de /chat)
+    cola_calidad = asyncio.Queue()
+    workers_calidad = [
+        asyncio.create_task(_worker_calidad(i))
+        for i in range(int(os.getenv("CALIDAD_WORKERS", "2")))
+    ]
+
     logger.info("Modelos cargados y listos.")
+    # Abrir una única vez el cliente de ChromaDB compartido por todas las peticiones
+    funciones_db.registro.abrir()
+    consistencia_indice = funciones_db.comprobar_consistencia(CATEGORIAS_VALIDAS)
+    if os.getenv("ROUTER_LOCAL", "true").lower() == "true":
+        router_local = _construir_router_local()
+    _cargar_indice_bm25()
     # Evaluar retrieval una sola vez al arranque (evita hacerlo en cada chat)
     if os.getenv("EVALUAR_RETRIEVAL_AL_INICIO", "true").lower() == "true":
         logger.info("Evaluando retrieval (golden set) al inicio...")
         _evaluar_retrieval_y_guardar_en_cache()
     else:
         logger.info("Evaluación de retrieval al inicio desactivada (EVALUAR_RETRIEVAL_AL_INICIO=false).")
+    # Cambio de versión de las colecciones en caliente (ver funciones_indexado --completo)
+    tarea_alias = asyncio.create_task(_vigilar_alias(float(os.getenv("ALIAS_INTERVALO_SEGUNDOS", "5"))))
     logger.info("Iniciando servicios de RAG...")
     yield
     # El código aquí se ejecuta al CERRAR la API
     logger.info("Cerrando servicios y liberando memoria...")
+    for batcher in (batcher_emb, batcher_rerank, batcher_clip):
+        await batcher.detener()
+    for worker in workers_calidad:
+        worker.cancel()
+    tarea_alias.cancel()
+    cache_hyde.guardar_en_disco()
+    funciones_db.registro.cerrar()
 
 
 class GraphState(TypedDict):
@@ -149,6 +339,9 @@ class GraphState(TypedDict):
     debug_pipeline: List[str]
     destino: Optional[str]
     intento_sin_filtros: bool
+    request_id: str
+    calidad_inline: Optional[bool]
+    embedding_pregunta: Optional[List[float]]
 
 async def generar_hyde(pregunta, client_llm)->str:
     """
@@ -168,12 +361,8 @@ async def generar_hyde(pregunta, client_llm)->str:
     except: 
         return pregunta
 
-async def nodo_router(state: GraphState):
-    """
-    Nodo router que decide si es saludo o pregunta.
-    """
-    pregunta = state["pregunta"]
-    logger.info(f"[ROUTER] Analizando: {pregunta}")
+async def _clasificar_con_llm(pregunta: str) -> str:
+    """Clasificación de la pregunta con el LLM rápido."""
     llm = llm_fast
     
     system_prompt = prompts.obtener_prompt_router(CATEGORIAS_VALIDAS)
@@ -190,7 +379,45 @@ async def nodo_router(state: GraphState):
         logger.error(f"Error Router: {e}")
         clasificacion = "otros"
 
-    clasificacion = clasificacion.strip()
+    return clasificacion.strip()
+
+async def _clasificar_local(state: GraphState) -> Optional[str]:
+    """
+    Clasificación con el router local (embeddings + prototipos).
+    Devuelve None si no está disponible o si el margen de decisión es bajo.
+    """
+    if router_local is None:
+        return None
+    t0 = time.perf_counter()
+    try:
+        embedding = state.get("embedding_pregunta")
+        if embedding is None:
+            embedding = (await batcher_emb.procesar([state["pregunta"]]))[0]
+        etiqueta, margen, puntuaciones = router_local.clasificar(embedding, state["pregunta"])
+    except Exception as e:
+        logger.warning(f"[ROUTER] Error en router local: {e}")
+        return None
+    ms = (time.perf_counter() - t0) * 1000
+    if etiqueta is None:
+        similitud = max(puntuaciones[e] for e in router_local.etiquetas)
+        state["debug_pipeline"].append(
+            f"[ROUTER] Router local sin confianza (margen {margen:.3f}, similitud {similitud:.3f}, {ms:.1f}ms). Consultando LLM..."
+        )
+        return None
+    state["debug_pipeline"].append(f"[ROUTER] Router local: '{etiqueta}' (margen {margen:.3f}, {ms:.1f}ms).")
+    return etiqueta
+
+async def nodo_router(state: GraphState):
+    """
+    Nodo router que decide si es saludo o pregunta.
+    Primero intenta el router local por embeddings; solo si el margen es bajo llama al LLM.
+    """
+    pregunta = state["pregunta"]
+    logger.info(f"[ROUTER] Analizando: {pregunta}")
+
+    clasificacion = await _clasificar_local(state)
+    if clasificacion is None:
+        clasificacion = await _clasificar_con_llm(pregunta)
 
     if clasificacion == "SALUDO":
         logger.info("[ROUTER] Detectado SALUDO.")
@@ -211,10 +438,191 @@ async def nodo_router(state: GraphState):
     state["destino"] = "buscador"
     return state
 
+async def _buscar_hibrido(col_pdfs, q_emb, lexica, filtro: Optional[dict], debug: List[str]):
+    """
+    Búsqueda densa (backend vectorial configurado) fusionada (RRF) con la búsqueda léxica BM25 ya lanzada.
+
+    Args:
+        lexica: Tarea con los resultados de BM25 [(id, score)] o None si la búsqueda híbrida está desactivada.
+
+    Returns:
+        tuple: (ids, documentos, metadatos) en el orden fusionado.
+    """
+    n_densa = HIBRIDO_CANDIDATOS if lexica is not None else 5
+    res_pdfs = await asyncio.to_thread(col_pdfs.query, query_embeddings=q_emb, n_results=n_densa, where=filtro)
+    ids, docs, metas = res_pdfs["ids"][0], res_pdfs["documents"][0], res_pdfs["metadatas"][0]
+    if lexica is None:
+        return ids, docs, metas
+
+    try:
+        ids_lexicos = [id_ for id_, _ in await lexica]
+    except Exception as e:
+        logger.warning(f"[BUSCADOR] Error en la búsqueda léxica: {e}")
+        return ids[:5], docs[:5], metas[:5]
+    fusion = [id_ for id_, _ in funciones_bm25.fusion_rrf([ids, ids_lexicos])][:HIBRIDO_TOP_K]
+
+    por_id = {id_: (doc, meta) for id_, doc, meta in zip(ids, docs, metas)}
+    faltan = [id_ for id_ in fusion if id_ not in por_id]
+    if faltan:
+        extra = await asyncio.to_thread(col_pdfs.get, ids=faltan, include=["documents", "metadatas"])
+        por_id.update({id_: (doc, meta) for id_, doc, meta in zip(extra["ids"], extra["documents"], extra["metadatas"])})
+    fusion = [id_ for id_ in fusion if id_ in por_id]
+    debug.append(
+        f"[BUSCADOR] Híbrido: {len(ids)} densos + {len(ids_lexicos)} léxicos -> {len(fusion)} tras RRF "
+        f"({len(faltan)} solo léxicos)."
+    )
+    return fusion, [por_id[i][0] for i in fusion], [por_id[i][1] for i in fusion]
+
+async def _rama_pdfs(pregunta: str, filtro_pdfs: Optional[dict], debug: List[str], tiempos: dict):
+    """
+    Rama de texto del buscador: HyDE -> embedding -> consulta a la colección de PDFs,
+    en paralelo con la búsqueda léxica BM25 sobre la pregunta original (fusión RRF).
+
+    Returns:
+        tuple: (textos de contexto expandidos a su padre, fuentes).
+    """
+    t0 = time.perf_counter()
+    # Los términos exactos ("RETA", "modelo 140") están en la pregunta, no en el texto de HyDE
+    indice = indice_bm25
+    lexica = (
+        asyncio.ensure_future(asyncio.to_thread(indice.buscar, pregunta, HIBRIDO_CANDIDATOS, filtro_pdfs))
+        if indice is not None else None
+    )
+
+    memo = cache_hyde.obtener(pregunta) if cache_hyde is not None else None
+    if memo is not None:
+        # Reintentos y preguntas repetidas: sin llamada al LLM rápido ni re-codificación
+        doc_hyde, q_emb = memo["texto"], [memo["embedding"]]
+        tiempos["hyde"] = time.perf_counter() - t0
+        debug.append(f"[BUSCADOR] HyDE (caché): '{doc_hyde[:50]}...'")
+    else:
+        doc_hyde = await generar_hyde(pregunta, llm_fast)
+        tiempos["hyde"] = time.perf_counter() - t0
+        debug.append(f"[BUSCADOR] HyDE imaginó: '{doc_hyde[:50]}...'")
+
+        q_emb = await batcher_emb.procesar([doc_hyde])
+        # Si HyDE falla devuelve la propia pregunta: no la memorizamos
+        if cache_hyde is not None and doc_hyde != pregunta:
+            cache_hyde.guardar(pregunta, doc_hyde, q_emb[0])
+    
+    col_pdfs = funciones_vectores.obtener_backend("pdfs")
+    
+    logger.info(f"[BUSCADOR] Buscando documentos de texto por filtro '{filtro_pdfs}'")
+    ids, docs, metas = await _buscar_hibrido(col_pdfs, q_emb, lexica, filtro_pdfs, debug)
+    debug.append(f"[BUSCADOR] Encontrados: {len(docs)} documentos de texto.")
+    logger.info(f"[BUSCADOR] Encontrados: {len(docs)} documentos de texto.")
+    
+    if not docs and filtro_pdfs:
+        debug.append("[BUSCADOR] Nada en esa categoría. Buscando en todo...")
+        lexica = (
+            asyncio.ensure_future(asyncio.to_thread(indice.buscar, pregunta, HIBRIDO_CANDIDATOS, None))
+            if indice is not None else None
+        )
+        ids, docs, metas = await _buscar_hibrido(col_pdfs, q_emb, lexica, None, debug)
+
+    docs, fuentes = await _expandir_padres(ids, docs, metas, debug)
+    tiempos["pdfs"] = time.perf_counter() - t0
+    return docs, fuentes
+
+async def _expandir_padres(ids: List[str], docs: List[str], metas: List[dict], debug: List[str]):
+    """
+    Auto-merging: sustituye cada hijo por su texto padre, deduplicando por (source, parent_id).
+    Solo se leen del almacén los padres realmente necesarios, en una única consulta.
+    Cada fuente conserva el id en ChromaDB del hijo que la trajo (clave de la caché de scores).
+
+    Returns:
+        tuple: (textos de contexto, fuentes) sin duplicados.
+    """
+    claves = [
+        (meta.get("source", "desc"), int(meta["parent_id"]))
+        for meta in metas if meta.get("parent_id") is not None
+    ]
+    try:
+        almacen = funciones_padres.obtener_almacen(funciones_db.registro.directorio())
+        padres = await asyncio.to_thread(almacen.obtener, claves) if claves else {}
+    except Exception as e:
+        logger.warning(f"[BUSCADOR] Error leyendo el almacén de padres: {e}")
+        padres = {}
+
+    contexto, fuentes = [], []
+    vistos = set()
+    for id_, doc, meta in zip(ids, docs, metas):
+        source = meta.get("source", "desc")
+        parent_id = meta.get("parent_id")
+        clave = (source, int(parent_id)) if parent_id is not None else (source, doc)
+        if clave in vistos:
+            continue
+        vistos.add(clave)
+
+        # Índices antiguos todavía llevan la copia del padre en los metadatos
+        texto_final = padres.get(clave) or meta.get("contexto_expandido")
+        if texto_final:
+            debug.append(f"[AUTO-MERGING] Expandido a contexto padre ({len(texto_final)} chars).")
+        else:
+            texto_final = doc
+
+        contexto.append(texto_final)
+        fuentes.append({
+            "archivo": source,
+            "chunk_id": str(parent_id if parent_id is not None else meta.get("chunk_index", 0)),
+            "id": id_,
+            "score": 0.0, 
+            "relevante": True
+        })
+    return contexto, fuentes
+
+async def _rama_imagenes(pregunta: str, filtro_imagenes: Optional[dict], debug: List[str], tiempos: dict) -> List[dict]:
+    """
+    Rama de imágenes del buscador: embedding CLIP de la pregunta original -> consulta de imágenes.
+    No depende de HyDE, así que se ejecuta en paralelo con la rama de texto.
+    """
+    t0 = time.perf_counter()
+    col_imagenes = funciones_vectores.obtener_backend("imagenes")
+    logger.info(f"[BUSCADOR] Buscando imágenes por filtro '{filtro_imagenes}' usando CLIP")
+    
+    # Generar embedding de texto con CLIP para la pregunta
+    # Usamos la pregunta original o una versión corta, ya que CLIP prefiere textos cortos
+    texto_query_clip = pregunta[:77] # CLIP suele tener limite de contexto de 77 tokens
+    
+    q_emb_clip = await batcher_clip.procesar([texto_query_clip])
+
+    res_imagenes = await asyncio.to_thread(
+        col_imagenes.query,
+        query_embeddings=q_emb_clip,
+        n_results=3,
+        where=filtro_imagenes
+    )
+    
+    imagenes = []
+    if res_imagenes['metadatas'][0]:
+        imagenes_dir = utils.project_root() / "data" / "documentos" / "imagenes"
+        for i, meta in enumerate(res_imagenes['metadatas'][0]):
+            score = res_imagenes.get('distances', [[0]*len(res_imagenes['metadatas'][0])])[0][i]
+            nombre_archivo = meta.get("nombre_archivo", "")
+            # Usar siempre ruta local (nombre_archivo) para que funcione en cualquier equipo
+            ruta_local = str(imagenes_dir / nombre_archivo) if nombre_archivo else ""
+            imagenes.append({
+                "ruta_imagen": ruta_local,
+                "nombre_archivo": nombre_archivo,
+                "pdf_origen": meta.get("pdf_origen", ""),
+                "pagina": meta.get("pagina", 0),
+                "score": float(score) if score else 0.0
+            })
+        
+        debug.append(f"[BUSCADOR] Encontradas {len(imagenes)} imágenes relacionadas.")
+        logger.info(f"[BUSCADOR] Encontradas {len(imagenes)} imágenes relacionadas.")
+    else:
+        debug.append("[BUSCADOR] No se encontraron imágenes relacionadas.")
+
+    tiempos["imagenes"] = time.perf_counter() - t0
+    return imagenes
+
 async def nodo_buscador(state: GraphState):
     """
     Nodo buscador que aplica filtro por categoría y HyDE.
-    Ahora busca en AMBAS colecciones: texto (PDFs) e imágenes.
+    Busca en AMBAS colecciones: texto (PDFs) e imágenes.
+    Las dos ramas son independientes y se lanzan en paralelo; un fallo en una
+    no afecta a la otra.
     """
     cat = state.get("categoria_detectada", "otros")
     pregunta = state["pregunta"]
@@ -227,123 +635,52 @@ async def nodo_buscador(state: GraphState):
         filtro_imagenes = None
     else:
         state["debug_pipeline"].append(f"[BUSCADOR] Filtrando por '{cat}' + HyDE.")
-        filtro_pdfs = {"category": cat} if cat != "otros" else None
+        filtro_pdfs = {"categoria": cat} if cat != "otros" else None
         filtro_imagenes = {"categoria": cat} if cat != "otros" else None
-    
-    doc_hyde = await generar_hyde(pregunta, llm_fast)
-    state["debug_pipeline"].append(f"[BUSCADOR] HyDE imaginó: '{doc_hyde[:50]}...'")
 
-    q_emb = utils.generar_embeddings(model_emb, [doc_hyde])
-    
-    # ========== BÚSQUEDA EN COLECCIÓN DE PDFs (TEXTO) ==========
-    col_pdfs = funciones_db.obtener_coleccion("pdfs")
-    
-    logger.info(f"[BUSCADOR] Buscando documentos de texto por filtro '{filtro_pdfs}'")
-    res_pdfs = col_pdfs.query(
-        query_embeddings=q_emb,
-        n_results=5,     
-        where=filtro_pdfs
+    # Cada rama escribe en su propia traza para que no se intercalen los mensajes
+    debug_pdfs, debug_imagenes = [], []
+    tiempos = {}
+    t0 = time.perf_counter()
+    res_pdfs, res_imagenes = await asyncio.gather(
+        _rama_pdfs(pregunta, filtro_pdfs, debug_pdfs, tiempos),
+        _rama_imagenes(pregunta, filtro_imagenes, debug_imagenes, tiempos),
+        return_exceptions=True
     )
-    state["debug_pipeline"].append(f"[BUSCADOR] Encontrados: {len(res_pdfs['documents'][0])} documentos de texto.")
-    logger.info(f"[BUSCADOR] Encontrados: {len(res_pdfs['documents'][0])} documentos de texto.")
-    
-    docs = res_pdfs['documents'][0]
-    metas = res_pdfs['metadatas'][0]
-    
-    if not docs and filtro_pdfs:
-        state["debug_pipeline"].append("[BUSCADOR] Nada en esa categoría. Buscando en todo...")
-        res_pdfs = col_pdfs.query(query_embeddings=q_emb, n_results=5)
-        docs, metas = res_pdfs['documents'][0], res_pdfs['metadatas'][0]
-
-    state["contexto_docs"] = []
-    fuentes = []
-    textos_vistos = set() 
-    
-    for doc, meta in zip(docs, metas):
-        texto_final = meta.get("contexto_expandido")
-        if texto_final:
-            state["debug_pipeline"].append(f"[AUTO-MERGING] Expandido a contexto padre ({len(texto_final)} chars).")
-        else:
-            texto_final = doc
+    tiempo_total = time.perf_counter() - t0
 
-        if texto_final not in textos_vistos:
-            state["contexto_docs"].append(texto_final)
-            textos_vistos.add(texto_final)
-            
-            fuentes.append({
-                "archivo": meta.get("source", "desc"),
-                "chunk_id": str(meta.get("chunk_index", 0)),
-                "score": 0.0, 
-                "relevante": True
-            })
+    # ========== RESULTADOS DE PDFs (TEXTO) ==========
+    state["debug_pipeline"].extend(debug_pdfs)
+    if isinstance(res_pdfs, Exception):
+        logger.error(f"[BUSCADOR] Error buscando documentos: {res_pdfs}")
+        state["debug_pipeline"].append(f"[BUSCADOR] Error buscando documentos: {res_pdfs}")
+        contexto, fuentes = [], []
+    else:
+        contexto, fuentes = res_pdfs
 
+    state["contexto_docs"] = contexto
     state["contexto_fuentes"] = fuentes
     
-    # ========== BÚSQUEDA EN COLECCIÓN DE IMÁGENES (CLIP) ==========
-    try:
-        col_imagenes = funciones_db.obtener_coleccion("imagenes")
-        logger.info(f"[BUSCADOR] Buscando imágenes por filtro '{filtro_imagenes}' Uusando CLIP")
-        
-        # Generar embedding de texto con CLIP para la pregunta
-        # Usamos la pregunta original o una versión corta, ya que CLIP prefiere textos cortos
-        texto_query_clip = pregunta[:77] # CLIP suele tener limite de contexto de 77 tokens
-        
-        inputs = clip_processor(text=texto_query_clip, return_tensors="pt", padding=True).to(device)
-        with torch.no_grad():
-            text_features = model_clip.get_text_features(**inputs)
-            
-            # Robustez: verificar si devuelve un objeto en lugar de tensor
-            if not isinstance(text_features, torch.Tensor):
-                if hasattr(text_features, "text_embeds"):
-                    text_features = text_features.text_embeds
-                elif hasattr(text_features, "pooler_output"):
-                    # Fallback: Extraer pooler_output y proyectar si es necesario
-                    # Esto maneja el caso donde get_text_features devuelve el output raw del text_model
-                    text_features = text_features.pooler_output
-                    if hasattr(model_clip, "text_projection"):
-                        text_features = model_clip.text_projection(text_features)
-            
-            # Normalizar es importante para CLIP si usamos distancia coseno
-            text_features = text_features / text_features.norm(p=2, dim=-1, keepdim=True)
-            q_emb_clip = text_features.cpu().numpy().tolist()
-
-        res_imagenes = col_imagenes.query(
-            query_embeddings=q_emb_clip,
-            n_results=3,
-            where=filtro_imagenes
-        )
-        
-        imagenes = []
-        if res_imagenes['metadatas'][0]:
-            imagenes_dir = utils.project_root() / "data" / "documentos" / "imagenes"
-            for i, meta in enumerate(res_imagenes['metadatas'][0]):
-                score = res_imagenes.get('distances', [[0]*len(res_imagenes['metadatas'][0])])[0][i]
-                nombre_archivo = meta.get("nombre_archivo", "")
-                # Usar siempre ruta local (nombre_archivo) para que funcione en cualquier equipo
-                ruta_local = str(imagenes_dir / nombre_archivo) if nombre_archivo else ""
-                imagenes.append({
-                    "ruta_imagen": ruta_local,
-                    "nombre_archivo": nombre_archivo,
-                    "pdf_origen": meta.get("pdf_origen", ""),
-                    "pagina": meta.get("pagina", 0),
-                    "score": float(score) if score else 0.0
-                })
-            
-            state["debug_pipeline"].append(f"[BUSCADOR] Encontradas {len(imagenes)} imágenes relacionadas.")
-            logger.info(f"[BUSCADOR] Encontradas {len(imagenes)} imágenes relacionadas.")
-        else:
-            state["debug_pipeline"].append("[BUSCADOR] No se encontraron imágenes relacionadas.")
-        
-        state["imagenes_relacionadas"] = imagenes
-        
-    except Exception as e:
-        logger.warning(f"[BUSCADOR] Error buscando imágenes: {e}")
-        state["debug_pipeline"].append(f"[BUSCADOR] Error buscando imágenes: {e}")
+    # ========== RESULTADOS DE IMÁGENES (CLIP) ==========
+    state["debug_pipeline"].extend(debug_imagenes)
+    if isinstance(res_imagenes, Exception):
+        logger.warning(f"[BUSCADOR] Error buscando imágenes: {res_imagenes}")
+        state["debug_pipeline"].append(f"[BUSCADOR] Error buscando imágenes: {res_imagenes}")
         state["imagenes_relacionadas"] = []
+    else:
+        state["imagenes_relacionadas"] = res_imagenes
+
+    # ========== TIEMPOS POR RAMA ==========
+    secuencial = tiempos.get("pdfs", 0.0) + tiempos.get("imagenes", 0.0)
+    detalle = " | ".join(f"{rama}={seg:.2f}s" for rama, seg in tiempos.items())
+    state["debug_pipeline"].append(
+        f"[BUSCADOR] Tiempos: {detalle} | total={tiempo_total:.2f}s (ahorro vs secuencial: {max(secuencial - tiempo_total, 0.0):.2f}s)"
+    )
+    logger.info(f"[BUSCADOR] Tiempos: {detalle} | total={tiempo_total:.2f}s")
     
     return state
 
-def nodo_reranker(state: GraphState):
+async def nodo_reranker(state: GraphState):
     """
     Re-ordena los documentos recuperados para asegurar que los mejores 
     estén al principio y descarta los que tienen baja puntuación.
@@ -358,11 +695,25 @@ def nodo_reranker(state: GraphState):
     state["debug_pipeline"].append("[RE-RANKER] Evaluando relevancia semántica...")
     logger.info(f"[RE-RANKER] Evaluando relevancia semántica...")
 
-    # Preparamos los pares (pregunta, documento) para el modelo
-    pairs = [[pregunta, doc] for doc in docs]
+    # Puntuaciones ya calculadas para esta pregunta (reintentos, preguntas repetidas)
+    # Por id de ChromaDB: (archivo, chunk_id) se repite en hijos sin parent_id (índices antiguos)
+    ids_chunks = [m.get("id") or f"{m.get('archivo')}#{m.get('chunk_id')}" for m in metas]
+    hash_pregunta = funciones_cache.CacheScores.hash_pregunta(pregunta)
+    firma = funciones_db.registro.firma()
+    cacheados = cache_scores.obtener(hash_pregunta, ids_chunks, firma) if cache_scores is not None else {}
+
+    # Preparamos los pares (pregunta, documento) solo para los que faltan
+    pendientes = [i for i, id_chunk in enumerate(ids_chunks) if id_chunk not in cacheados]
+    pairs = [[pregunta, docs[i]] for i in pendientes]
     
     # El modelo devuelve una puntuación para cada par
-    scores = rerank_model.predict(pairs)
+    nuevos = await batcher_rerank.procesar(pairs) if pairs else []
+    nuevos = {ids_chunks[i]: score for i, score in zip(pendientes, nuevos)}
+    if cache_scores is not None and nuevos:
+        cache_scores.guardar(hash_pregunta, nuevos, firma)
+    if cacheados:
+        state["debug_pipeline"].append(f"[RE-RANKER] {len(cacheados)} puntuaciones desde caché, {len(pairs)} calculadas.")
+    scores = [cacheados.get(id_chunk, nuevos.get(id_chunk)) for id_chunk in ids_chunks]
     
     # Combinamos, ordenamos por score y filtramos
     scored_docs = sorted(zip(scores, docs, metas), key=lambda x: x[0], reverse=True)
@@ -484,42 +835,92 @@ async def nodo_generador(state: GraphState):
     state["respuesta_final"] = respuesta.content
     return state
 
+async def _evaluar_calidad(pregunta: str, respuesta: str, contexto: str) -> dict:
+    """
+    Lanza los dos jueces (Fidelidad y Relevancia) en paralelo.
+    Los jueces usan el cliente síncrono, así que cada uno va a un hilo para no bloquear el event loop.
+    """
+    # Usamos llm_fast para rapidez
+    fidelidad, relevancia = await asyncio.gather(
+        # Evaluar Fidelidad (¿Alucinaciones?)
+        asyncio.to_thread(
+            funciones_evaluacion.evaluar_fidelidad,
+            pregunta, respuesta, contexto,
+            llm_fast, os.getenv("MODELO_FAST")
+        ),
+        # Evaluar Relevancia (¿Responde al user?)
+        asyncio.to_thread(
+            funciones_evaluacion.evaluar_relevancia,
+            pregunta, respuesta,
+            llm_fast, os.getenv("MODELO_FAST")
+        )
+    )
+    return {"fidelidad": fidelidad, "relevancia": relevancia}
+
+def _metricas_retrieval() -> dict:
+    """Métricas de retrieval en caché (calculadas al arranque de la API)."""
+    return {
+        "hit_rate": retrieval_metrics_cache.get("hit_rate"),
+        "mrr": retrieval_metrics_cache.get("mrr"),
+        "num_preguntas": retrieval_metrics_cache.get("num_preguntas")
+    }
+
+def _guardar_resultado_calidad(request_id: str, resultado: dict) -> None:
+    """Guarda el resultado de calidad acotando el número de entradas (se descartan las más antiguas)."""
+    resultados_calidad[request_id] = resultado
+    resultados_calidad.move_to_end(request_id)
+    max_resultados = int(os.getenv("CALIDAD_MAX_RESULTADOS", "1000"))
+    while len(resultados_calidad) > max_resultados:
+        resultados_calidad.popitem(last=False)
+
+async def _worker_calidad(num: int):
+    """Consume la cola de evaluaciones de calidad en segundo plano."""
+    while True:
+        request_id, pregunta, respuesta, contexto = await cola_calidad.get()
+        try:
+            jueces = await _evaluar_calidad(pregunta, respuesta, contexto)
+            _guardar_resultado_calidad(request_id, {"estado": "completado", **jueces, **_metricas_retrieval()})
+            logger.info(f"[CALIDAD:{num}] {request_id} -> Fidelidad: {jueces['fidelidad']} | Relevancia: {jueces['relevancia']}")
+        except Exception as e:
+            logger.error(f"[CALIDAD:{num}] Error evaluando {request_id}: {e}")
+            _guardar_resultado_calidad(request_id, {"estado": "error", "detalle": str(e)})
+        finally:
+            cola_calidad.task_done()
+
 async def nodo_calidad(state: GraphState):
     """
     Evalúa la calidad de la respuesta generada (Fidelidad y Relevancia).
+
+    En modo "background" la evaluación se encola y la respuesta se devuelve sin esperar
+    a los jueces; el resultado se consulta luego en `/calidad/{request_id}`.
+    En modo "inline" (evaluaciones offline) se espera a los jueces como antes.
     """
-    state["debug_pipeline"].append("[CALIDAD] Evaluando respuesta generada...")
-    logger.info("[CALIDAD] Evaluando respuesta generada...")
-    
     pregunta = state["pregunta"]
     respuesta = state["respuesta_final"]
     contexto = "\n\n".join(state["contexto_docs"])
+    request_id = state.get("request_id")
+
+    inline = state.get("calidad_inline")
+    if inline is None:
+        inline = os.getenv("CALIDAD_MODO", "background").lower() == "inline"
+
+    if not inline and request_id and cola_calidad is not None:
+        _guardar_resultado_calidad(request_id, {"estado": "pendiente"})
+        cola_calidad.put_nowait((request_id, pregunta, respuesta, contexto))
+        state["metricas"] = {"estado": "pendiente", "request_id": request_id, **_metricas_retrieval()}
+        state["debug_pipeline"].append(f"[CALIDAD] Evaluación encolada en segundo plano ({request_id}).")
+        logger.info(f"[CALIDAD] Evaluación encolada en segundo plano ({request_id}).")
+        return state
+
+    state["debug_pipeline"].append("[CALIDAD] Evaluando respuesta generada...")
+    logger.info("[CALIDAD] Evaluando respuesta generada...")
+
+    jueces = await _evaluar_calidad(pregunta, respuesta, contexto)
+    fidelidad, relevancia = jueces["fidelidad"], jueces["relevancia"]
     
-    # Evaluar Fidelidad (¿Alucinaciones?)
-    # Usamos llm_fast para rapidez
-    fidelidad = funciones_evaluacion.evaluar_fidelidad(
-        pregunta, respuesta, contexto, 
-        llm_fast, os.getenv("MODELO_FAST")
-    )
-    
-    # Evaluar Relevancia (¿Responde al user?)
-    relevancia = funciones_evaluacion.evaluar_relevancia(
-        pregunta, respuesta, 
-        llm_fast, os.getenv("MODELO_FAST")
-    )
-    
-    # Usar métricas de retrieval en caché (calculadas al arranque de la API)
-    hit_rate = retrieval_metrics_cache.get("hit_rate")
-    mrr = retrieval_metrics_cache.get("mrr")
-    num_preguntas = retrieval_metrics_cache.get("num_preguntas")
-    
-    state["metricas"] = {
-        "fidelidad": fidelidad,
-        "relevancia": relevancia,
-        "hit_rate": hit_rate,
-        "mrr": mrr,
-        "num_preguntas": num_preguntas
-    }
+    state["metricas"] = {"estado": "completado", **jueces, **_metricas_retrieval()}
+    if request_id:
+        _guardar_resultado_calidad(request_id, state["metricas"])
     state["debug_pipeline"].append(f"[CALIDAD] Fidelidad: {fidelidad} | Relevancia: {relevancia}")
     logger.info(f"[CALIDAD] Fidelidad: {fidelidad} | Relevancia: {relevancia}")
     
@@ -565,6 +966,8 @@ app = FastAPI(title="API RAG Autonomos Bizkaia", version="1.0", lifespan=lifespa
 class PreguntaRequest(BaseModel):
     pregunta: str
     historial: Optional[List[dict]] = []
+    # None = según CALIDAD_MODO; True fuerza la evaluación inline (evaluaciones offline)
+    calidad_inline: Optional[bool] = None
 
 class Fuente(BaseModel):
     archivo: str
@@ -585,18 +988,48 @@ class RespuestaResponse(BaseModel):
     imagenes: List[Imagen]
     debug_info: dict
     tiempo_segundos: float
+    request_id: Optional[str] = None
 
 @app.get("/health")
-def health(): return {"status": "OK", "version": "1.0"}
+def health():
+    return {"status": "OK", "version": "1.0", "chromadb": funciones_db.registro.estado(), "consistencia": consistencia_indice}
+
+
+@app.post("/colecciones/recargar")
+def recargar_colecciones():
+    """Vuelve a abrir el cliente de ChromaDB (útil tras reconstruir las colecciones)."""
+    funciones_db.registro.recargar()
+    if cache_semantico is not None:
+        cache_semantico.invalidar()
+    return funciones_db.registro.estado()
+
+
+@app.get("/colecciones/versiones")
+def get_versiones_colecciones():
+    """Versión servida y versiones conservadas para volver atrás."""
+    return {"servida": funciones_db.registro.version, **funciones_db.leer_alias()}
+
+
+@app.post("/colecciones/activar/{version}")
+async def activar_version_colecciones(version: str):
+    """Activa una versión ya construida (p. ej. para volver atrás) y cambia a ella sin reiniciar."""
+    try:
+        await asyncio.to_thread(funciones_db.activar_version, version)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=f"No se pudo activar la versión '{version}': {e}")
+    if await asyncio.to_thread(funciones_db.registro.comprobar_alias):
+        await _al_cambiar_version()
+    return get_versiones_colecciones()
 
 
 @app.get("/metricas-retrieval")
 def get_metricas_retrieval():
-    """Devuelve las métricas de retrieval en caché (calculadas al arranque)."""
+    """Devuelve las métricas de retrieval en caché (calculadas al arranque), también por modo de búsqueda."""
     return {
         "hit_rate": retrieval_metrics_cache.get("hit_rate"),
         "mrr": retrieval_metrics_cache.get("mrr"),
-        "num_preguntas": retrieval_metrics_cache.get("num_preguntas")
+        "num_preguntas": retrieval_metrics_cache.get("num_preguntas"),
+        "por_modo": retrieval_metrics_cache.get("por_modo")
     }
 
 
@@ -604,10 +1037,25 @@ def get_metricas_retrieval():
 def refrescar_metricas_retrieval():
     """Vuelve a evaluar el retrieval y actualiza la caché (útil tras añadir documentos)."""
     _evaluar_retrieval_y_guardar_en_cache()
+    return get_metricas_retrieval()
+
+
+@app.get("/metricas-inferencia")
+def get_metricas_inferencia():
+    """Profundidad de cola e histogramas de tamaño de lote de los micro-batchers."""
     return {
-        "hit_rate": retrieval_metrics_cache.get("hit_rate"),
-        "mrr": retrieval_metrics_cache.get("mrr"),
-        "num_preguntas": retrieval_metrics_cache.get("num_preguntas")
+        b.nombre: b.estadisticas()
+        for b in (batcher_emb, batcher_rerank, batcher_clip) if b is not None
+    }
+
+
+@app.get("/metricas-cache")
+def get_metricas_cache():
+    """Estadísticas de las cachés de la API (aciertos, fallos, tamaño)."""
+    return {
+        "semantica": cache_semantico.estadisticas() if cache_semantico is not None else None,
+        "hyde": cache_hyde.estadisticas() if cache_hyde is not None else None,
+        "reranker": cache_scores.estadisticas() if cache_scores is not None else None
     }
 
 
@@ -625,7 +1073,7 @@ async def buscar_imagenes_similares(file: UploadFile = File(...)):
         logger.warning(f"Error leyendo imagen: {e}")
         raise HTTPException(status_code=400, detail="No se pudo procesar la imagen.")
     try:
-        col_imagenes = funciones_db.obtener_coleccion("imagenes")
+        col_imagenes = funciones_vectores.obtener_backend("imagenes")
     except Exception as e:
         logger.warning(f"Error obteniendo colección imágenes: {e}")
         raise HTTPException(status_code=503, detail="Base de datos de imágenes no disponible.")
@@ -657,13 +1105,17 @@ async def buscar_imagenes_similares(file: UploadFile = File(...)):
             ))
     return out
 
-@app.post("/chat", response_model=RespuestaResponse)
-async def chat_endpoint(request: PreguntaRequest):
-    """
-    Endpoint de chat estándar (no-streaming).
-    Llama al grafo, espera el resultado final y devuelve la respuesta formateada.
-    """
-    inputs = {
+@app.get("/calidad/{request_id}")
+def get_calidad(request_id: str):
+    """Devuelve las métricas de calidad (Fidelidad/Relevancia) de una respuesta ya enviada."""
+    resultado = resultados_calidad.get(request_id)
+    if resultado is None:
+        raise HTTPException(status_code=404, detail="request_id desconocido o expirado.")
+    return {"request_id": request_id, **resultado}
+
+def _estado_inicial(request: PreguntaRequest) -> dict:
+    """Construye el estado de entrada del grafo para una petición de chat."""
+    return {
         "pregunta": request.pregunta,
         "historial": request.historial,
         "contexto_docs": [],
@@ -674,30 +1126,157 @@ async def chat_endpoint(request: PreguntaRequest):
         "destino": None,
         "intento_sin_filtros": False,
         "categoria_detectada": "otros",
-        "metricas": {}
+        "metricas": {},
+        "request_id": uuid.uuid4().hex,
+        "calidad_inline": request.calidad_inline,
+        "embedding_pregunta": None
     }
+
+def _formatear_respuesta(resultado: dict, request_id: str, segundos: float) -> RespuestaResponse:
+    """Convierte el estado final del grafo en la respuesta de la API."""
+    return RespuestaResponse(
+        respuesta=resultado.get("respuesta_final", ""),
+        fuentes=resultado.get("contexto_fuentes", []),
+        imagenes=resultado.get("imagenes_relacionadas", []),
+        debug_info={
+            "categoria": resultado.get("categoria_detectada"),
+            "pipeline": resultado.get("debug_pipeline"),
+            "metricas": resultado.get("metricas", {}),
+            "request_id": request_id
+        },
+        tiempo_segundos=round(segundos, 2),
+        request_id=request_id
+    )
+
+async def _consultar_cache(inputs: dict):
+    """
+    Busca la pregunta en la caché semántica.
+
+    Returns:
+        tuple: (embedding de la pregunta, estado final cacheado o None).
+    """
+    if cache_semantico is None:
+        return None, None
+    try:
+        embedding = (await batcher_emb.procesar([inputs["pregunta"]]))[0]
+        acierto = cache_semantico.buscar(embedding, funciones_db.registro.firma())
+    except Exception as e:
+        logger.warning(f"[CACHE] Error consultando caché semántica: {e}")
+        return None, None
+    # El router local reutiliza este embedding
+    inputs["embedding_pregunta"] = embedding
+    if acierto is None:
+        return embedding, None
+
+    estado = {**inputs, **acierto}
+    # Sin trabajo de calidad: la respuesta ya se evaluó (o se está evaluando) con su request_id original.
+    # El id nuevo queda registrado como "cacheado" para que /calidad/{request_id} no devuelva 404.
+    estado["metricas"] = {**acierto.get("metricas", {}), **_metricas_retrieval(), "estado": "cacheado"}
+    _guardar_resultado_calidad(inputs["request_id"], estado["metricas"])
+    estado["debug_pipeline"] = [
+        f"[CACHE] Respuesta servida desde caché semántica (similitud {acierto['similitud']:.3f} con '{acierto['pregunta_cacheada'][:60]}')."
+    ]
+    logger.info(f"[CACHE] Acierto (similitud {acierto['similitud']:.3f}) para: {inputs['pregunta']}")
+    return embedding, estado
+
+def _guardar_en_cache(embedding, resultado: dict) -> None:
+    """Guarda en la caché semántica solo respuestas generadas a partir de documentos."""
+    if cache_semantico is None or embedding is None:
+        return
+    if not resultado.get("contexto_fuentes") or not resultado.get("respuesta_final"):
+        return
+    # El estado y el request_id de la evaluación de calidad son de esta petición, no de las que acierten
+    metricas = {k: v for k, v in resultado.get("metricas", {}).items() if k not in ("estado", "request_id")}
+    cache_semantico.guardar(
+        resultado["pregunta"],
+        embedding,
+        {
+            "respuesta_final": resultado["respuesta_final"],
+            "contexto_fuentes": resultado.get("contexto_fuentes", []),
+            "imagenes_relacionadas": resultado.get("imagenes_relacionadas", []),
+            "categoria_detectada": resultado.get("categoria_detectada"),
+            "metricas": metricas
+        },
+        funciones_db.registro.firma()
+    )
+
+def _evento_sse(evento: str, datos: dict) -> str:
+    """Serializa un evento en formato server-sent events."""
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+@app.post("/chat", response_model=RespuestaResponse)
+async def chat_endpoint(request: PreguntaRequest):
+    """
+    Endpoint de chat estándar (no-streaming).
+    Llama al grafo, espera el resultado final y devuelve la respuesta formateada.
+    """
+    inputs = _estado_inicial(request)
     
     try:
         start_time = time.time()
+        embedding, cacheado = await _consultar_cache(inputs)
+        if cacheado is not None:
+            return _formatear_respuesta(cacheado, inputs["request_id"], time.time() - start_time)
+
         # Ejecutamos el grafo completo synchronously (bueno, con await)
         resultado = await app_graph.ainvoke(inputs)
         end_time = time.time()
+        _guardar_en_cache(embedding, resultado)
         
-        return RespuestaResponse(
-            respuesta=resultado.get("respuesta_final", ""),
-            fuentes=resultado.get("contexto_fuentes", []),
-            imagenes=resultado.get("imagenes_relacionadas", []),
-            debug_info={
-                "categoria": resultado.get("categoria_detectada"),
-                "pipeline": resultado.get("debug_pipeline"),
-                "metricas": resultado.get("metricas", {})
-            },
-            tiempo_segundos=round(end_time - start_time, 2)
-        )
+        return _formatear_respuesta(resultado, inputs["request_id"], end_time - start_time)
     except Exception as e:
         logger.error(f"Error en endpoint de chat: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: PreguntaRequest):
+    """
+    Endpoint de chat en streaming (server-sent events).
+
+    Eventos emitidos:
+        - progreso: al terminar cada nodo del grafo (router, buscador, reranker, evaluador...).
+        - token: fragmentos de texto del generador a medida que llegan de `llm_heavy`.
+        - final: respuesta completa con fuentes, imágenes y debug_info (mismo formato que /chat).
+        - error: si algo falla durante la ejecución.
+    """
+    inputs = _estado_inicial(request)
+
+    async def generar_eventos():
+        start_time = time.time()
+        estado = dict(inputs)
+        try:
+            embedding, cacheado = await _consultar_cache(inputs)
+            if cacheado is not None:
+                final = _formatear_respuesta(cacheado, inputs["request_id"], time.time() - start_time)
+                yield _evento_sse("progreso", {"nodo": "cache", "destino": "fin"})
+                yield _evento_sse("final", final.model_dump())
+                return
+
+            async for modo, chunk in app_graph.astream(inputs, stream_mode=["updates", "messages"]):
+                if modo == "messages":
+                    mensaje, meta = chunk
+                    # Solo reenviamos los tokens del generador (router, HyDE y evaluador también usan LLM)
+                    if meta.get("langgraph_node") == "generador" and mensaje.content:
+                        yield _evento_sse("token", {"texto": mensaje.content})
+                else:
+                    for nodo, actualizacion in chunk.items():
+                        if actualizacion:
+                            estado.update(actualizacion)
+                        yield _evento_sse("progreso", {"nodo": nodo, "destino": estado.get("destino")})
+
+            final = _formatear_respuesta(estado, inputs["request_id"], time.time() - start_time)
+            _guardar_en_cache(embedding, estado)
+            yield _evento_sse("final", final.model_dump())
+        except Exception as e:
+            logger.error(f"Error en endpoint de chat (stream): {e}")
+            yield _evento_sse("error", {"detalle": str(e)})
+
+    return StreamingResponse(
+        generar_eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 def ejecutar_api():
     """Ejecuta la API de RAG para Autónomos Bizkaia"""
     host = "127.0.0.1" 
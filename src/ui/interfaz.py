@@ -437,13 +437,7 @@ def render_message(role, content, sources=None, imagenes=None):
         st.markdown(f'<div class="user-bubble">{content}</div>', unsafe_allow_html=True)
     else:
         # Burbuja de la IA - Texto
-        st.markdown(f'''
-        <div class="ai-bubble">
-            <div class="content">
-                {content.replace("**", "<b>")}
-            </div>
-        </div>
-        ''', unsafe_allow_html=True)
+        st.markdown(_html_burbuja_ia(content), unsafe_allow_html=True)
         
         # Galería de imágenes usando componentes nativos para mayor estabilidad
         if imagenes and len(imagenes) > 0:
@@ -494,32 +488,88 @@ def obtener_metricas_retrieval():
         print(f"Error obteniendo métricas de retrieval: {e}")
     return None, None, None
 
+def obtener_calidad(request_id):
+    """Obtiene las métricas de calidad evaluadas en segundo plano para una respuesta."""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:8000/calidad/{request_id}", timeout=5) as response:
+            if response.getcode() == 200:
+                return json.loads(response.read().decode())
+    except Exception as e:
+        print(f"Error obteniendo métricas de calidad: {e}")
+    return None
+
+# Texto de la burbuja de "Pensando" según el último nodo completado del grafo
+ETAPAS_PIPELINE = {
+    "router": "Buscando en las guías",
+    "buscador": "Ordenando resultados",
+    "reranker": "Comprobando relevancia",
+    "evaluador": "Generando respuesta",
+}
+
+def _html_pensando(texto):
+    return f"""
+            <div class="thinking-bubble">
+                <span>{texto}</span>
+                <div class="thinking-dots"><div class="dot"></div><div class="dot"></div><div class="dot"></div></div>
+            </div>
+        """
+
+def _html_burbuja_ia(content):
+    return f'''
+        <div class="ai-bubble">
+            <div class="content">
+                {content.replace("**", "<b>")}
+            </div>
+        </div>
+        '''
+
 async def ejecutar_chat(prompt, chat_container):
     # Resetear fuentes e imágenes anteriores
     st.session_state.last_sources = []
     st.session_state.last_images = []
     
     with chat_container:
-        # 1. Contenedor para la animación de "Pensando"
+        # 1. Contenedor para la animación de "Pensando" y para la respuesta en streaming
         thinking_placeholder = st.empty()
-        thinking_placeholder.markdown("""
-            <div class="thinking-bubble">
-                <span>Generando respuesta</span>
-                <div class="thinking-dots"><div class="dot"></div><div class="dot"></div><div class="dot"></div></div>
-            </div>
-        """, unsafe_allow_html=True)
+        thinking_placeholder.markdown(_html_pensando("Analizando la pregunta"), unsafe_allow_html=True)
+        respuesta_placeholder = st.empty()
 
     try:
+        resultado = {}
+        texto_parcial = ""
         async with httpx.AsyncClient(timeout=120.0) as client:
-            resp = await client.post(
-                "http://127.0.0.1:8000/chat", 
+            async with client.stream(
+                "POST",
+                "http://127.0.0.1:8000/chat/stream", 
                 json={"pregunta": prompt},
                 timeout=120.0
-            )
-            resp.raise_for_status()
-            resultado = resp.json()
+            ) as resp:
+                resp.raise_for_status()
+                evento = None
+                # Protocolo SSE: líneas "event: ..." seguidas de "data: {...}"
+                async for linea in resp.aiter_lines():
+                    if linea.startswith("event:"):
+                        evento = linea[len("event:"):].strip()
+                        continue
+                    if not linea.startswith("data:"):
+                        continue
+                    datos = json.loads(linea[len("data:"):].strip())
+
+                    if evento == "progreso":
+                        etapa = ETAPAS_PIPELINE.get(datos.get("nodo"))
+                        if etapa and not texto_parcial:
+                            thinking_placeholder.markdown(_html_pensando(etapa), unsafe_allow_html=True)
+                    elif evento == "token":
+                        if not texto_parcial:
+                            thinking_placeholder.empty()
+                        texto_parcial += datos.get("texto", "")
+                        respuesta_placeholder.markdown(_html_burbuja_ia(texto_parcial), unsafe_allow_html=True)
+                    elif evento == "final":
+                        resultado = datos
+                    elif evento == "error":
+                        raise RuntimeError(datos.get("detalle", "Error desconocido"))
             
-            full_response = resultado.get("respuesta", "")
+            full_response = resultado.get("respuesta", "") or texto_parcial
             st.session_state.last_sources = resultado.get("fuentes", [])
             st.session_state.last_images = resultado.get("imagenes", [])
             st.session_state.debug_logs.append(resultado.get("debug_info", {}))
@@ -532,6 +582,7 @@ async def ejecutar_chat(prompt, chat_container):
                         
         # 2. Finalización
         thinking_placeholder.empty()
+        respuesta_placeholder.empty()
         
         if not full_response:
              full_response = "Lo siento, parece que no tengo información suficiente en este momento para responder a tu pregunta."
@@ -552,10 +603,7 @@ async def ejecutar_chat(prompt, chat_container):
 
     except Exception as e:
         thinking_placeholder.empty()
-        st.error(f"Error de comunicación con la API: {e}")
-
-    except Exception as e:
-        thinking_placeholder.empty()
+        respuesta_placeholder.empty()
         st.error(f"Error de comunicación con la API: {e}")
                     
 def main():
@@ -808,6 +856,11 @@ def main():
             
             # --- SECCIÓN DE CALIDAD ---
             metricas = last_log.get("metricas", {})
+            # Los jueces pueden ejecutarse en segundo plano: consultar el resultado si sigue pendiente
+            if metricas.get("estado") == "pendiente" and metricas.get("request_id"):
+                calidad = obtener_calidad(metricas["request_id"])
+                if calidad and calidad.get("estado") != "pendiente":
+                    metricas.update(calidad)
             if metricas:
                 st.divider()
                 st.subheader("Métricas de Calidad")
@@ -822,6 +875,8 @@ def main():
                         st.success("✅ Fiel")
                     elif fidelidad == 0:
                         st.error("⚠️ Alucinación")
+                    elif metricas.get("estado") == "pendiente":
+                        st.info("Evaluando...")
                     else:
                         st.info("N/A")
 
@@ -834,6 +889,8 @@ def main():
                             st.warning(f"({relevancia}/5)")
                         else:
                             st.error(f"({relevancia}/5)")
+                    elif metricas.get("estado") == "pendiente":
+                        st.info("Evaluando...")
                     else:
                         st.info("N/A")
         else:
@@ -0,0 +1,394 @@
+"""
+Índice léxico BM25 en proceso sobre los chunks hijo de la colección de PDFs.
+
+La búsqueda densa sobre el texto de HyDE pierde términos administrativos exactos
+("RETA", "IAE", "modelo 140", "Merkaekin", "3i26"). Este índice invertido los recupera
+y se combina con Chroma por fusión de rangos recíprocos (RRF) antes del reranker.
+
+Postings compactos: por término, un `array("I")` de documentos y un `array("H")` de
+frecuencias; se consultan con numpy sin copiar. Los borrados se marcan y el índice se
+compacta al superar una fracción de documentos borrados. Se persiste en un `.npz` en
+el directorio de cada versión de las colecciones y se actualiza en la ingesta.
+
+Uso:
+    python src/utilidades/funciones_bm25.py --construir   # desde la colección activa
+    python src/utilidades/funciones_bm25.py --evaluar     # golden set: denso / léxico / híbrido
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from loguru import logger
+
+load_dotenv()
+
+DB_PATH = os.getenv("DB_PATH", "chromadb/")
+NOMBRE_FICHERO = "bm25.npz"
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Campos de metadatos que se guardan por documento para poder filtrar como en Chroma
+CAMPOS_FILTRO = ("source", "categoria")
+MAX_BORRADOS = 0.25
+
+_RE_TOKEN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a al algo ante como con contra cual cuando de del desde donde durante e el ella ellas ellos en entre era es esa "
+    "ese eso esta este esto estos fue ha hay la las le les lo los mas me mi muy no nos o os para pero por que se "
+    "si sin sobre su sus te tu un una uno unos y ya yo".split()
+)
+
+
+def tokenizar(texto: str) -> List[str]:
+    """Minúsculas, sin tildes, tokens alfanuméricos ("3i26", "140") sin palabras vacías."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return [t for t in _RE_TOKEN.findall(texto) if t not in STOPWORDS]
+
+
+def fusion_rrf(rankings: Iterable[List[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """
+    Fusión de rangos recíprocos: cada lista aporta 1 / (k + posición) a cada id.
+
+    Returns:
+        list: [(id, puntuación)] de mayor a menor.
+    """
+    puntuaciones: Dict[str, float] = {}
+    for ranking in rankings:
+        for pos, id_ in enumerate(ranking, 1):
+            puntuaciones[id_] = puntuaciones.get(id_, 0.0) + 1.0 / (k + pos)
+    return sorted(puntuaciones.items(), key=lambda x: x[1], reverse=True)
+
+
+class IndiceBM25:
+    """Índice invertido BM25 con altas, bajas por id o por documento origen y acceso seguro entre hilos."""
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1, self.b = k1, b
+        self._lock = threading.RLock()
+        self._vaciar()
+
+    def _vaciar(self) -> None:
+        self._vocabulario: Dict[str, int] = {}
+        self._docs: List[array] = []      # por término: índices de documento (uint32)
+        self._tfs: List[array] = []       # por término: frecuencias (uint16)
+        self._ids: List[str] = []
+        self._posicion: Dict[str, int] = {}
+        self._longitudes = array("I")
+        self._borrado = bytearray()
+        self._n_borrados = 0
+        self._longitud_total = 0
+        self._campos = {c: array("i") for c in CAMPOS_FILTRO}
+        self._valores = {c: {} for c in CAMPOS_FILTRO}  # valor -> código, para no repetir cadenas
+
+    def __len__(self) -> int:
+        return len(self._ids) - self._n_borrados
+
+    # ---------- Altas y bajas ----------
+
+    def _codigo(self, campo: str, valor) -> int:
+        codigos = self._valores[campo]
+        if valor not in codigos:
+            codigos[valor] = len(codigos)
+        return codigos[valor]
+
+    def anadir(self, ids: List[str], textos: List[str], metadatas: Optional[List[dict]] = None) -> None:
+        """Añade (o sustituye, si el id ya existe) documentos al índice."""
+        metadatas = metadatas or [{}] * len(ids)
+        with self._lock:
+            self._borrar_ids([i for i in ids if i in self._posicion])
+            for id_, texto, meta in zip(ids, textos, metadatas):
+                doc = len(self._ids)
+                frecuencias: Dict[str, int] = {}
+                tokens = tokenizar(texto or "")
+                for t in tokens:
+                    frecuencias[t] = frecuencias.get(t, 0) + 1
+                for t, tf in frecuencias.items():
+                    tid = self._vocabulario.get(t)
+                    if tid is None:
+                        tid = self._vocabulario[t] = len(self._docs)
+                        self._docs.append(array("I"))
+                        self._tfs.append(array("H"))
+                    self._docs[tid].append(doc)
+                    self._tfs[tid].append(min(tf, 65535))
+                self._ids.append(id_)
+                self._posicion[id_] = doc
+                self._longitudes.append(len(tokens))
+                self._longitud_total += len(tokens)
+                self._borrado.append(0)
+                for campo in CAMPOS_FILTRO:
+                    self._campos[campo].append(self._codigo(campo, (meta or {}).get(campo)))
+
+    def _borrar_ids(self, ids: Iterable[str]) -> int:
+        n = 0
+        for id_ in ids:
+            doc = self._posicion.pop(id_, None)
+            if doc is None or self._borrado[doc]:
+                continue
+            self._borrado[doc] = 1
+            self._longitud_total -= self._longitudes[doc]
+            n += 1
+        self._n_borrados += n
+        return n
+
+    def eliminar(self, ids: Iterable[str]) -> int:
+        """Borra documentos por id. Devuelve cuántos se han borrado."""
+        with self._lock:
+            n = self._borrar_ids(ids)
+            self._compactar_si_hace_falta()
+            return n
+
+    def eliminar_source(self, source: str) -> int:
+        """Borra todos los chunks de un PDF."""
+        with self._lock:
+            codigo = self._valores["source"].get(source)
+            if codigo is None:
+                return 0
+            docs = np.flatnonzero(np.frombuffer(self._campos["source"], dtype=np.int32) == codigo)
+            n = self._borrar_ids([self._ids[d] for d in docs])
+            self._compactar_si_hace_falta()
+            return n
+
+    def _compactar_si_hace_falta(self) -> None:
+        if self._ids and self._n_borrados / len(self._ids) > MAX_BORRADOS:
+            self.compactar()
+
+    def compactar(self) -> None:
+        """Reescribe los postings sin los documentos borrados."""
+        with self._lock:
+            vivos = np.frombuffer(bytes(self._borrado), dtype=np.uint8) == 0
+            nuevo = np.cumsum(vivos, dtype=np.int64) - 1
+            docs, tfs, vocabulario = [], [], {}
+            for termino, tid in self._vocabulario.items():
+                d = np.frombuffer(self._docs[tid], dtype=np.uint32)
+                mascara = vivos[d]
+                if not mascara.any():
+                    continue
+                vocabulario[termino] = len(docs)
+                docs.append(array("I", nuevo[d[mascara]].astype(np.uint32).tobytes()))
+                tfs.append(array("H", np.frombuffer(self._tfs[tid], dtype=np.uint16)[mascara].tobytes()))
+            indices = np.flatnonzero(vivos)
+            self._vocabulario, self._docs, self._tfs = vocabulario, docs, tfs
+            self._ids = [self._ids[i] for i in indices]
+            self._posicion = {id_: i for i, id_ in enumerate(self._ids)}
+            self._longitudes = array("I", np.frombuffer(self._longitudes, dtype=np.uint32)[indices].tobytes())
+            for campo in CAMPOS_FILTRO:
+                self._campos[campo] = array("i", np.frombuffer(self._campos[campo], dtype=np.int32)[indices].tobytes())
+            self._borrado = bytearray(len(self._ids))
+            self._n_borrados = 0
+
+    # ---------- Búsqueda ----------
+
+    def buscar(self, consulta: str, k: int = 10, filtro: Optional[dict] = None) -> List[Tuple[str, float]]:
+        """
+        Los `k` documentos con mayor puntuación BM25 para la consulta.
+
+        Args:
+            consulta (str): Texto de la consulta (la pregunta original, no HyDE).
+            k (int): Número de resultados.
+            filtro (dict): Igualdad sobre metadatos, como el `where` de Chroma (p. ej. {"categoria": "Fiscal"}).
+
+        Returns:
+            list: [(id, puntuación)] de mayor a menor.
+        """
+        terminos = set(tokenizar(consulta))
+        with self._lock:
+            n_total = len(self._ids)
+            n_vivos = n_total - self._n_borrados
+            if not n_vivos or not terminos:
+                return []
+            longitudes = np.frombuffer(self._longitudes, dtype=np.uint32).astype(np.float32)
+            norma = self.k1 * (1 - self.b + self.b * longitudes / (self._longitud_total / n_vivos or 1.0))
+            puntuaciones = np.zeros(n_total, dtype=np.float32)
+            # Hasta la compactación los postings incluyen documentos borrados: no cuentan en df
+            vivos = np.frombuffer(bytes(self._borrado), dtype=np.uint8) == 0 if self._n_borrados else None
+            for t in terminos:
+                tid = self._vocabulario.get(t)
+                if tid is None:
+                    continue
+                docs = np.frombuffer(self._docs[tid], dtype=np.uint32)
+                tfs = np.frombuffer(self._tfs[tid], dtype=np.uint16).astype(np.float32)
+                if vivos is not None:
+                    mascara = vivos[docs]
+                    docs, tfs = docs[mascara], tfs[mascara]
+                df = len(docs)
+                if not df:
+                    continue
+                idf = math.log(1 + (n_vivos - df + 0.5) / (df + 0.5))
+                # Un término aparece una sola vez por documento en sus postings
+                puntuaciones[docs] += idf * tfs * (self.k1 + 1) / (tfs + norma[docs])
+            for campo, valor in (filtro or {}).items():
+                if campo not in self._campos:
+                    return []  # Chroma tampoco encuentra nada por un campo que no existe
+                codigo = self._valores[campo].get(valor)
+                if codigo is None:
+                    return []
+                puntuaciones[np.frombuffer(self._campos[campo], dtype=np.int32) != codigo] = 0.0
+            candidatos = np.flatnonzero(puntuaciones > 0)
+            if len(candidatos) > k:
+                candidatos = candidatos[np.argpartition(-puntuaciones[candidatos], k - 1)[:k]]
+            orden = candidatos[np.argsort(-puntuaciones[candidatos], kind="stable")]
+            return [(self._ids[i], float(puntuaciones[i])) for i in orden]
+
+    # ---------- Persistencia ----------
+
+    def guardar(self, ruta: Path) -> None:
+        """Guarda el índice (compactado) en un `.npz` con escritura atómica."""
+        ruta = Path(ruta)
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            if self._n_borrados:
+                self.compactar()
+            terminos = sorted(self._vocabulario, key=self._vocabulario.get)
+            tamanos = np.array([len(self._docs[self._vocabulario[t]]) for t in terminos], dtype=np.int64)
+            offsets = np.concatenate([[0], np.cumsum(tamanos)]).astype(np.int64)
+            docs = np.frombuffer(b"".join(self._docs[self._vocabulario[t]].tobytes() for t in terminos), dtype=np.uint32)
+            tfs = np.frombuffer(b"".join(self._tfs[self._vocabulario[t]].tobytes() for t in terminos), dtype=np.uint16)
+            cabecera = {
+                "k1": self.k1, "b": self.b, "terminos": terminos, "ids": self._ids,
+                "valores": {c: list(self._valores[c]) for c in CAMPOS_FILTRO}
+            }
+            tmp = ruta.with_name(ruta.name + ".tmp")
+            with open(tmp, "wb") as f:
+                np.savez(
+                    f, cabecera=np.frombuffer(json.dumps(cabecera, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+                    offsets=offsets, docs=docs, tfs=tfs,
+                    longitudes=np.frombuffer(self._longitudes, dtype=np.uint32),
+                    **{f"campo_{c}": np.frombuffer(self._campos[c], dtype=np.int32) for c in CAMPOS_FILTRO}
+                )
+            os.replace(tmp, ruta)
+
+    @classmethod
+    def cargar(cls, ruta: Path) -> "IndiceBM25":
+        with np.load(ruta) as datos:
+            cabecera = json.loads(datos["cabecera"].tobytes().decode("utf-8"))
+            indice = cls(k1=cabecera["k1"], b=cabecera["b"])
+            offsets, docs, tfs = datos["offsets"], datos["docs"], datos["tfs"]
+            for tid, termino in enumerate(cabecera["terminos"]):
+                a, z = offsets[tid], offsets[tid + 1]
+                indice._vocabulario[termino] = tid
+                indice._docs.append(array("I", docs[a:z].tobytes()))
+                indice._tfs.append(array("H", tfs[a:z].tobytes()))
+            indice._ids = cabecera["ids"]
+            indice._posicion = {id_: i for i, id_ in enumerate(indice._ids)}
+            indice._longitudes = array("I", datos["longitudes"].tobytes())
+            indice._longitud_total = int(datos["longitudes"].sum())
+            indice._borrado = bytearray(len(indice._ids))
+            for campo in CAMPOS_FILTRO:
+                # JSON convierte None en null y lo devuelve como None: los códigos se mantienen
+                indice._valores[campo] = {v: i for i, v in enumerate(cabecera["valores"][campo])}
+                indice._campos[campo] = array("i", datos[f"campo_{campo}"].astype(np.int32).tobytes())
+        return indice
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            postings = sum(len(d) for d in self._docs)
+            return {
+                "documentos": len(self),
+                "terminos": len(self._vocabulario),
+                "postings": postings,
+                "memoria_postings_mb": round(postings * 6 / 2**20, 2)
+            }
+
+
+def construir_desde_coleccion(collection, lote: int = 5000) -> IndiceBM25:
+    """Construye el índice a partir de todos los chunks hijo de una colección de Chroma."""
+    indice = IndiceBM25()
+    total = collection.count()
+    for inicio in range(0, total, lote):
+        datos = collection.get(include=["documents", "metadatas"], limit=lote, offset=inicio)
+        indice.anadir(datos["ids"], datos["documents"], datos["metadatas"])
+    logger.info(f"[BM25] Índice construido: {indice.estadisticas()}")
+    return indice
+
+
+def reindexar_source(indice: IndiceBM25, collection, source: str) -> None:
+    """Vuelve a leer de Chroma los chunks de un PDF (p. ej. al reanudar una ingesta interrumpida)."""
+    indice.eliminar_source(source)
+    datos = collection.get(where={"source": source}, include=["documents", "metadatas"])
+    indice.anadir(datos["ids"], datos["documents"], datos["metadatas"])
+
+
+_indices: Dict[Path, IndiceBM25] = {}
+_indices_lock = threading.Lock()
+
+
+def ruta_indice(directorio: Optional[Path] = None) -> Path:
+    return Path(directorio or DB_PATH) / NOMBRE_FICHERO
+
+
+def obtener_indice(directorio: Optional[Path] = None, collection=None) -> IndiceBM25:
+    """
+    Índice compartido por el proceso para un directorio de versión (por defecto, DB_PATH).
+    Si no hay índice guardado y se pasa la colección, se construye desde ella y se guarda.
+    """
+    ruta = ruta_indice(directorio)
+    with _indices_lock:
+        if ruta not in _indices:
+            if ruta.exists():
+                _indices[ruta] = IndiceBM25.cargar(ruta)
+                logger.info(f"[BM25] Índice cargado de {ruta}: {_indices[ruta].estadisticas()}")
+            elif collection is not None:
+                _indices[ruta] = construir_desde_coleccion(collection)
+                _indices[ruta].guardar(ruta)
+            else:
+                _indices[ruta] = IndiceBM25()
+        return _indices[ruta]
+
+
+def olvidar_indice(directorio: Optional[Path] = None) -> None:
+    """Descarta el índice en memoria (se volverá a leer de disco en el próximo uso)."""
+    with _indices_lock:
+        _indices.pop(ruta_indice(directorio), None)
+
+
+def guardar_indice(directorio: Optional[Path] = None) -> None:
+    ruta = ruta_indice(directorio)
+    with _indices_lock:
+        indice = _indices.get(ruta)
+    if indice is not None:
+        indice.guardar(ruta)
+
+
+def main():
+    import argparse
+    from utilidades import funciones_db
+
+    parser = argparse.ArgumentParser(description="Índice BM25 de los chunks de PDFs")
+    parser.add_argument("--construir", action="store_true", help="Reconstruye el índice desde la colección activa")
+    parser.add_argument("--evaluar", action="store_true", help="Hit rate y MRR en el golden set: denso, léxico e híbrido")
+    parser.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args()
+
+    collection = funciones_db.obtener_coleccion("pdfs")
+    directorio = funciones_db.registro.directorio()
+    if args.construir:
+        indice = construir_desde_coleccion(collection)
+        indice.guardar(ruta_indice(directorio))
+        logger.info(f"[BM25] Guardado en {ruta_indice(directorio)}")
+    if args.evaluar:
+        from sentence_transformers import SentenceTransformer
+        from utilidades import funciones_evaluacion, utils
+
+        golden_file = os.getenv("GOLDEN_SET_FILE", str(utils.project_root() / "src" / "golden_set_automatico.jsonl"))
+        with open(golden_file, "r", encoding="utf-8") as f:
+            golden_set = [json.loads(line) for line in f if line.strip()]
+        model_emb = SentenceTransformer(funciones_db.MODELO_EMBEDDINGS, device="cpu")
+        informe = funciones_evaluacion.evaluar_retrieval_modos(
+            collection, model_emb, obtener_indice(directorio, collection), golden_set, top_k=args.top_k
+        )
+        logger.info("\n EVALUACIÓN DENSO / LÉXICO / HÍBRIDO \n" + json.dumps(informe, indent=2))
+    if not (args.construir or args.evaluar):
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,461 @@
+"""
+Cachés en memoria usadas por la API para evitar trabajo repetido entre peticiones.
+"""
+
+import copy
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+from loguru import logger
+from utilidades import utils
+
+
+class CacheSemantico:
+    """
+    Caché semántica de respuestas delante del grafo.
+
+    Guarda el embedding normalizado de cada pregunta respondida junto a su respuesta,
+    fuentes e imágenes. Una pregunta nueva es un acierto si su vecino más cercano
+    supera el umbral de similitud (producto escalar = coseno con vectores normalizados).
+
+    - Expulsión LRU con tamaño máximo y caducidad (TTL) por entrada.
+    - Invalidación automática cuando cambia la firma del índice (colecciones reconstruidas).
+    """
+
+    def __init__(self, umbral: float = 0.92, max_entradas: int = 500, ttl_segundos: float = 86400):
+        self.umbral = umbral
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # pregunta -> {"embedding", "valor", "creado"}
+        self._matriz = None             # embeddings apilados (se reconstruye solo si cambian las entradas)
+        self._claves = []
+        self._firma = None
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def _comprobar_firma(self, firma: Optional[str]) -> None:
+        if firma is not None and firma != self._firma:
+            if self._entradas:
+                logger.info("[CACHE] El índice ha cambiado; invalidando caché semántica.")
+                self.invalidaciones += 1
+            self._entradas.clear()
+            self._matriz = None
+            self._firma = firma
+
+    def _purgar_expiradas(self) -> None:
+        limite = time.time() - self.ttl_segundos
+        expiradas = [k for k, e in self._entradas.items() if e["creado"] < limite]
+        for k in expiradas:
+            del self._entradas[k]
+        if expiradas:
+            self._matriz = None
+
+    def _indice(self):
+        if self._matriz is None and self._entradas:
+            self._claves = list(self._entradas)
+            self._matriz = np.stack([self._entradas[k]["embedding"] for k in self._claves])
+        return self._matriz
+
+    def buscar(self, embedding: List[float], firma: Optional[str] = None) -> Optional[dict]:
+        """
+        Busca la pregunta almacenada más parecida.
+
+        Args:
+            embedding: Embedding normalizado de la pregunta entrante.
+            firma: Firma actual del índice; si difiere de la almacenada se vacía la caché.
+
+        Returns:
+            dict | None: Copia del valor almacenado más "similitud" y "pregunta_cacheada", o None.
+        """
+        with self._lock:
+            self._comprobar_firma(firma)
+            self._purgar_expiradas()
+            matriz = self._indice()
+            if matriz is None:
+                self.fallos += 1
+                return None
+
+            similitudes = matriz @ np.asarray(embedding, dtype=np.float32)
+            mejor = int(np.argmax(similitudes))
+            similitud = float(similitudes[mejor])
+            if similitud < self.umbral:
+                self.fallos += 1
+                return None
+
+            clave = self._claves[mejor]
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            resultado = copy.deepcopy(self._entradas[clave]["valor"])
+            resultado["similitud"] = similitud
+            resultado["pregunta_cacheada"] = clave
+            return resultado
+
+    def guardar(self, pregunta: str, embedding: List[float], valor: dict, firma: Optional[str] = None) -> None:
+        """Guarda (o refresca) la respuesta de una pregunta, expulsando la menos usada si hace falta."""
+        with self._lock:
+            self._comprobar_firma(firma)
+            self._entradas[pregunta] = {
+                "embedding": np.asarray(embedding, dtype=np.float32),
+                "valor": copy.deepcopy(valor),
+                "creado": time.time()
+            }
+            self._entradas.move_to_end(pregunta)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+            self._matriz = None
+
+    def invalidar(self) -> None:
+        """Vacía la caché."""
+        with self._lock:
+            self._entradas.clear()
+            self._matriz = None
+            self.invalidaciones += 1
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "umbral": self.umbral,
+                "ttl_segundos": self.ttl_segundos,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_acierto": round(self.aciertos / total, 4) if total else 0.0,
+                "invalidaciones": self.invalidaciones
+            }
+
+
+def normalizar_pregunta(pregunta: str) -> str:
+    """Normaliza una pregunta para usarla como clave (minúsculas, espacios y signos de los extremos)."""
+    return " ".join(pregunta.lower().split()).strip("¿?¡!.,;: ")
+
+
+class CacheHyde:
+    """
+    Memoización de HyDE: pregunta normalizada -> (documento hipotético, embedding).
+
+    Compartida entre peticiones, de modo que el reintento del evaluador y las preguntas
+    repetidas no vuelven a llamar al LLM rápido ni a codificar el texto. Opcionalmente
+    se persiste en disco (JSON) para no arrancar en frío tras un reinicio.
+    """
+
+    def __init__(self, max_entradas: int = 1000, ruta: Optional[str] = None, modelo: str = ""):
+        """
+        Args:
+            max_entradas (int): Tamaño máximo (expulsión LRU).
+            ruta (str): Fichero JSON de persistencia; None para no persistir.
+            modelo (str): Identificador de los modelos (LLM + embeddings); forma parte de la clave.
+        """
+        self.max_entradas = max_entradas
+        self.ruta = Path(ruta) if ruta else None
+        self.modelo = modelo
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._cambios = 0
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _clave(self, pregunta: str) -> str:
+        return f"{self.modelo}::{normalizar_pregunta(pregunta)}"
+
+    def obtener(self, pregunta: str) -> Optional[dict]:
+        """Devuelve {"texto", "embedding"} si la pregunta ya se ha visto, o None."""
+        clave = self._clave(pregunta)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada
+
+    def guardar(self, pregunta: str, texto: str, embedding: List[float]) -> None:
+        clave = self._clave(pregunta)
+        with self._lock:
+            self._entradas[clave] = {"texto": texto, "embedding": list(embedding)}
+            self._entradas.move_to_end(clave)
+            self._cambios += 1
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def cargar(self) -> None:
+        """Carga la caché desde disco (si hay ruta configurada y el fichero existe)."""
+        if self.ruta is None or not self.ruta.exists():
+            return
+        try:
+            with open(self.ruta, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"[HYDE] No se pudo cargar la caché de {self.ruta}: {e}")
+            return
+        with self._lock:
+            for clave, entrada in datos.items():
+                # Las entradas de otros modelos no sirven (el embedding no sería comparable)
+                if clave.startswith(f"{self.modelo}::"):
+                    self._entradas[clave] = entrada
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        logger.info(f"[HYDE] Caché cargada con {len(self._entradas)} entradas desde {self.ruta}")
+
+    def guardar_en_disco(self, solo_si_cambios: bool = False) -> None:
+        """
+        Escribe la caché en disco de forma atómica (fichero temporal + rename).
+
+        Args:
+            solo_si_cambios (bool): No escribe nada si no hay entradas nuevas desde la última escritura.
+        """
+        if self.ruta is None:
+            return
+        with self._lock:
+            if solo_si_cambios and not self._cambios:
+                return
+            datos = dict(self._entradas)
+            cambios = self._cambios
+        utils.escribir_json_atomico(self.ruta, datos, indent=None)
+        with self._lock:
+            self._cambios -= cambios
+        logger.info(f"[HYDE] Caché guardada ({len(datos)} entradas) en {self.ruta}")
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_acierto": round(self.aciertos / total, 4) if total else 0.0,
+                "persistente": self.ruta is not None
+            }
+
+
+class CacheScores:
+    """
+    Caché de puntuaciones del reranker por (hash de la pregunta, id del chunk).
+    Los reintentos y las preguntas repetidas no vuelven a pasar por el modelo.
+    Se vacía si cambia la firma del índice (el texto de un chunk puede haber cambiado).
+    """
+
+    def __init__(self, max_entradas: int = 20000):
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._firma = None
+        self.aciertos = 0
+        self.fallos = 0
+
+    @staticmethod
+    def hash_pregunta(pregunta: str) -> str:
+        return hashlib.sha1(normalizar_pregunta(pregunta).encode("utf-8")).hexdigest()
+
+    def _comprobar_firma(self, firma: Optional[str]) -> None:
+        if firma is not None and firma != self._firma:
+            self._entradas.clear()
+            self._firma = firma
+
+    def obtener(self, hash_pregunta: str, ids_chunks: List[str], firma: Optional[str] = None) -> Dict[str, float]:
+        """Devuelve {id_chunk: score} para los chunks ya puntuados con esta pregunta."""
+        encontrados = {}
+        with self._lock:
+            self._comprobar_firma(firma)
+            for id_chunk in ids_chunks:
+                clave = (hash_pregunta, id_chunk)
+                if clave in self._entradas:
+                    self._entradas.move_to_end(clave)
+                    encontrados[id_chunk] = self._entradas[clave]
+                    self.aciertos += 1
+                else:
+                    self.fallos += 1
+        return encontrados
+
+    def guardar(self, hash_pregunta: str, scores: Dict[str, float], firma: Optional[str] = None) -> None:
+        with self._lock:
+            self._comprobar_firma(firma)
+            for id_chunk, score in scores.items():
+                self._entradas[(hash_pregunta, id_chunk)] = float(score)
+                self._entradas.move_to_end((hash_pregunta, id_chunk))
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_acierto": round(self.aciertos / total, 4) if total else 0.0
+            }
+
+
+class CacheEmbeddings:
+    """
+    Caché en disco de embeddings direccionada por contenido, para un modelo concreto.
+
+    - `vectores.f32`: matriz float32 (filas x dim) abierta como memmap.
+    - `indice.json`: hash del texto normalizado -> [fila, último uso], más dim y modelo.
+
+    Al superar `max_mb` se reutilizan las filas de las entradas usadas hace más tiempo (LRU),
+    así el fichero nunca crece por encima del límite. Las entradas expulsadas se quitan del
+    índice en disco antes de reutilizar sus filas. Re-indexar un corpus sin cambios
+    (o re-trocearlo con otros parámetros) solo codifica los textos que no se han visto.
+    """
+
+    def __init__(self, directorio: str, modelo: str, max_mb: float = 1024):
+        self.directorio = Path(directorio)
+        self.modelo = modelo
+        self.max_bytes = int(max_mb * 2**20)
+        self._lock = threading.Lock()
+        self._ruta_vectores = self.directorio / "vectores.f32"
+        self._ruta_indice = self.directorio / "indice.json"
+        self._indice: Dict[str, list] = {}
+        self._libres: List[int] = []
+        self._dim = None
+        self._capacidad = 0
+        self._filas_usadas = 0
+        self._mm = None
+        self._reloj = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self._cargar()
+
+    @staticmethod
+    def clave(texto: str) -> str:
+        """Hash del texto normalizado (NFC y sin espacios en los extremos)."""
+        return hashlib.sha1(unicodedata.normalize("NFC", texto).strip().encode("utf-8")).hexdigest()
+
+    def _cargar(self) -> None:
+        if not (self._ruta_indice.exists() and self._ruta_vectores.exists()):
+            return
+        try:
+            with open(self._ruta_indice, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"[CACHE EMB] Índice ilegible en {self._ruta_indice} ({e}); se empieza vacía.")
+            return
+        if datos.get("modelo") != self.modelo:
+            logger.warning(f"[CACHE EMB] La caché de {self.directorio} es de otro modelo; se empieza vacía.")
+            return
+        self._dim = datos["dim"]
+        self._indice = datos["entradas"]
+        self._filas_usadas = datos["filas_usadas"]
+        self._reloj = max((u for _, u in self._indice.values()), default=0)
+        self._capacidad = self._ruta_vectores.stat().st_size // (4 * self._dim)
+        ocupadas = {fila for fila, _ in self._indice.values()}
+        self._libres = [f for f in range(self._filas_usadas) if f not in ocupadas]
+        self._mm = np.memmap(self._ruta_vectores, dtype=np.float32, mode="r+", shape=(self._capacidad, self._dim))
+        logger.info(f"[CACHE EMB] {len(self._indice)} embeddings en caché ({self.modelo})")
+
+    def _max_filas(self) -> int:
+        return max(1, self.max_bytes // (4 * self._dim))
+
+    def _crecer(self, filas_necesarias: int) -> None:
+        """Amplía el fichero de vectores (duplicando) sin pasar del límite de tamaño."""
+        nueva = min(max(filas_necesarias, 2 * self._capacidad, 1024), self._max_filas())
+        if nueva <= self._capacidad:
+            return
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm = None
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        with open(self._ruta_vectores, "ab") as f:
+            f.truncate(nueva * 4 * self._dim)
+        self._capacidad = nueva
+        self._mm = np.memmap(self._ruta_vectores, dtype=np.float32, mode="r+", shape=(self._capacidad, self._dim))
+
+    def _fila_libre(self) -> int:
+        if self._libres:
+            return self._libres.pop()
+        if self._filas_usadas >= self._capacidad:
+            self._crecer(self._filas_usadas + 1)
+        if self._filas_usadas < self._capacidad:
+            self._filas_usadas += 1
+            return self._filas_usadas - 1
+        # Lleno: expulsar de golpe el 10% de entradas usadas hace más tiempo (LRU)
+        antiguas = sorted(self._indice, key=lambda k: self._indice[k][1])[:max(1, len(self._indice) // 10)]
+        for clave in antiguas:
+            self._libres.append(self._indice.pop(clave)[0])
+        self.expulsiones += len(antiguas)
+        # El índice en disco deja de apuntar a esas filas antes de sobrescribirlas: si el proceso
+        # muere a mitad del lote, ninguna clave queda asociada al vector de otro texto
+        self._mm.flush()
+        self._guardar_indice()
+        return self._libres.pop()
+
+    def obtener(self, textos: List[str]) -> Dict[int, np.ndarray]:
+        """Devuelve {posición en `textos`: embedding} para los textos ya cacheados."""
+        encontrados = {}
+        with self._lock:
+            if self._mm is None:
+                self.fallos += len(textos)
+                return encontrados
+            for i, texto in enumerate(textos):
+                entrada = self._indice.get(self.clave(texto))
+                if entrada is None:
+                    self.fallos += 1
+                    continue
+                self._reloj += 1
+                entrada[1] = self._reloj
+                encontrados[i] = np.array(self._mm[entrada[0]])
+                self.aciertos += 1
+        return encontrados
+
+    def guardar(self, textos: List[str], embeddings: np.ndarray) -> None:
+        """Guarda los embeddings nuevos y persiste el índice (escritura atómica)."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(textos) == 0:
+            return
+        with self._lock:
+            if self._dim != embeddings.shape[1]:
+                if self._dim is not None:
+                    logger.warning("[CACHE EMB] Cambio de dimensión; se vacía la caché.")
+                self._dim = embeddings.shape[1]
+                self._indice, self._libres, self._filas_usadas, self._capacidad, self._mm = {}, [], 0, 0, None
+                self._guardar_indice()
+                self._ruta_vectores.unlink(missing_ok=True)
+            # Nunca se guardan más entradas de las que caben
+            inicio = max(0, len(textos) - self._max_filas())
+            for texto, emb in zip(textos[inicio:], embeddings[inicio:]):
+                clave = self.clave(texto)
+                if clave in self._indice:
+                    continue
+                fila = self._fila_libre()
+                self._mm[fila] = emb
+                self._reloj += 1
+                self._indice[clave] = [fila, self._reloj]
+            self._mm.flush()
+            self._guardar_indice()
+
+    def _guardar_indice(self) -> None:
+        utils.escribir_json_atomico(self._ruta_indice, {"modelo": self.modelo, "dim": self._dim, "filas_usadas": self._filas_usadas,
+                                                        "entradas": self._indice}, indent=None)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "modelo": self.modelo,
+                "entradas": len(self._indice),
+                "mb_en_disco": round(self._capacidad * 4 * (self._dim or 0) / 2**20, 2),
+                "max_mb": round(self.max_bytes / 2**20, 2),
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_acierto": round(self.aciertos / total, 4) if total else 0.0,
+                "expulsiones": self.expulsiones
+            }
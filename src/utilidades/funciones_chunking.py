@@ -0,0 +1,343 @@
+"""
+Chunker padre/hijo propio basado en offsets.
+
+Reproduce el comportamiento de `RecursiveCharacterTextSplitter` (separadores
+["\\n\\n", "\\n", " ", ""], separador al inicio del trozo, fusión con solapamiento y
+`strip` de cada chunk) pero trabajando con posiciones (inicio, fin) sobre el texto
+limpio: no se crea un splitter por padre ni se copian subcadenas para trocear los
+hijos. Los padres y sus hijos salen del mismo recorrido.
+
+Uso:
+    python src/utilidades/funciones_chunking.py            # paridad + benchmark
+    python src/utilidades/funciones_chunking.py --mb 50    # corpus sintético de 50 MB
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from typing import List, Tuple
+
+SEPARADORES = ["\n\n", "\n", " ", ""]
+
+Rango = Tuple[int, int]
+
+
+_PATRONES = {sep: re.compile(re.escape(sep)) for sep in SEPARADORES if sep}
+
+
+def _cortes(texto: str, a: int, b: int, separador: str) -> Tuple[List[int], List[int]]:
+    """
+    Trozos de texto[a:b] separados por `separador`, con el separador al inicio de cada
+    trozo (como `keep_separator="start"`). Los trozos vacíos se descartan.
+
+    Returns:
+        tuple: (inicios, fines) de los trozos, que son contiguos.
+    """
+    if not separador:
+        return list(range(a, b)), list(range(a + 1, b + 1))
+    posiciones = [m.start() for m in _PATRONES[separador].finditer(texto, a, b)]
+    inicios = posiciones if posiciones and posiciones[0] == a else [a] + posiciones
+    if b <= a:
+        return [], []
+    return inicios, inicios[1:] + [b]
+
+
+def _unir(texto: str, a: int, b: int, salida: List[Rango]) -> None:
+    """Añade texto[a:b] sin espacios en los extremos (equivale a `strip`), si no queda vacío."""
+    while a < b and texto[a].isspace():
+        a += 1
+    while b > a and texto[b - 1].isspace():
+        b -= 1
+    if b > a:
+        salida.append((a, b))
+
+
+def _fusionar(texto: str, inicios: List[int], fines: List[int], tam: int, solape: int, salida: List[Rango],
+              cerrar: bool = True) -> int:
+    """
+    Agrupa trozos contiguos en chunks de hasta `tam` caracteres con hasta `solape` de solapamiento.
+
+    Es la misma lógica que `TextSplitter._merge_splits` con separador vacío: como los trozos
+    son contiguos, la longitud de la ventana [ini, j) es inicios[j] - inicios[ini], y tanto el
+    siguiente corte como los trozos a descartar se localizan con búsqueda binaria.
+
+    Con `cerrar=False` no emite la última ventana (más texto podría ampliarla).
+
+    Returns:
+        int: Inicio de la última ventana; volver a trocear desde ahí reproduce el mismo estado.
+    """
+    n = len(inicios)
+    ini, j = 0, 0
+    while True:
+        # Primer trozo que ya no cabe en la ventana actual (que no puede estar vacía)
+        j = bisect_right(fines, inicios[ini] + tam, max(j, ini + 1))
+        if j >= n:
+            break
+        _unir(texto, inicios[ini], fines[j - 1], salida)
+        a, b = inicios[j], fines[j]
+        # Descartar por la izquierda mientras se supere el solape o el trozo nuevo no quepa
+        ini = bisect_left(inicios, max(a - solape, min(b - tam, a)), ini, j)
+        j += 1
+    if n and cerrar:
+        _unir(texto, inicios[ini], fines[n - 1], salida)
+    return inicios[ini] if n else 0
+
+
+def _trocear_rango(texto: str, a: int, b: int, separadores: List[str], tam: int, solape: int,
+                   salida: List[Rango]) -> None:
+    separador, siguientes = separadores[-1], []
+    for i, s in enumerate(separadores):
+        if not s:
+            separador = s
+            break
+        if texto.find(s, a, b) != -1:
+            separador, siguientes = s, separadores[i + 1:]
+            break
+
+    inicios, fines = _cortes(texto, a, b, separador)
+    desde = 0  # primer trozo "bueno" (< tam) pendiente de fusionar
+    for k, (x, y) in enumerate(zip(inicios, fines)):
+        if y - x < tam:
+            continue
+        if k > desde:
+            _fusionar(texto, inicios[desde:k], fines[desde:k], tam, solape, salida)
+        desde = k + 1
+        if not siguientes:
+            salida.append((x, y))
+        else:
+            _trocear_rango(texto, x, y, siguientes, tam, solape, salida)
+    if len(inicios) > desde:
+        _fusionar(texto, inicios[desde:], fines[desde:], tam, solape, salida)
+
+
+def trocear(texto: str, tam: int, solape: int, inicio: int = 0, fin: int = None) -> List[Rango]:
+    """
+    Trocea texto[inicio:fin] y devuelve los chunks como rangos (inicio, fin) sobre `texto`.
+
+    Args:
+        texto (str): Texto completo.
+        tam (int): Tamaño máximo de chunk (caracteres).
+        solape (int): Solapamiento entre chunks consecutivos.
+    """
+    salida = []
+    _trocear_rango(texto, inicio, len(texto) if fin is None else fin, SEPARADORES, tam, solape, salida)
+    return salida
+
+
+def trocear_padre_hijo(texto: str, tam_padre: int = 2000, solape_padre: int = 200,
+                       tam_hijo: int = 400, solape_hijo: int = 50) -> Tuple[List[Rango], List[Tuple[int, int, int]]]:
+    """
+    Padres e hijos en un solo recorrido del texto.
+
+    Returns:
+        tuple: (padres [(inicio, fin)], hijos [(inicio, fin, padre_id)])
+    """
+    padres = trocear(texto, tam_padre, solape_padre)
+    hijos = [
+        (x, y, padre_id)
+        for padre_id, (a, b) in enumerate(padres)
+        for x, y in trocear(texto, tam_hijo, solape_hijo, a, b)
+    ]
+    return padres, hijos
+
+
+def trocear_parcial(texto: str, tam: int, solape: int) -> Tuple[List[Rango], int]:
+    """
+    Trocea el principio de un texto que sigue en otro fragmento aún no leído.
+
+    Solo devuelve los chunks que no pueden cambiar con lo que falta: el último trozo de
+    primer nivel ("\n\n") está incompleto y la última ventana de trozos pequeños aún
+    puede crecer. `trocear(texto[reinicio:] + resto)` continúa exactamente donde lo
+    dejaría `trocear` sobre el documento entero (los trozos empiezan en el separador).
+
+    Returns:
+        tuple: (chunks definitivos [(inicio, fin)], reinicio)
+    """
+    separador = SEPARADORES[0]
+    if texto.find(separador) == -1:
+        return [], 0
+    inicios, fines = _cortes(texto, 0, len(texto), separador)
+    inicios, fines = inicios[:-1], fines[:-1]
+    if not inicios:
+        return [], 0
+
+    salida, desde = [], 0
+    for k, (x, y) in enumerate(zip(inicios, fines)):
+        if y - x < tam:
+            continue
+        if k > desde:
+            _fusionar(texto, inicios[desde:k], fines[desde:k], tam, solape, salida)
+        desde = k + 1
+        _trocear_rango(texto, x, y, SEPARADORES[1:], tam, solape, salida)
+    reinicio = fines[-1]
+    if len(inicios) > desde:
+        reinicio = _fusionar(texto, inicios[desde:], fines[desde:], tam, solape, salida, cerrar=False)
+    return salida, reinicio
+
+
+def trocear_padre_hijo_parcial(texto: str, final: bool, tam_padre: int = 2000, solape_padre: int = 200,
+                               tam_hijo: int = 400, solape_hijo: int = 50) -> Tuple[List[Rango], List[Tuple[int, int, int]], int]:
+    """
+    `trocear_padre_hijo` para texto que llega por fragmentos (ingesta en streaming).
+
+    Returns:
+        tuple: (padres, hijos, reinicio); el texto desde `reinicio` se antepone al siguiente fragmento.
+    """
+    if final:
+        padres, reinicio = trocear(texto, tam_padre, solape_padre), len(texto)
+    else:
+        padres, reinicio = trocear_parcial(texto, tam_padre, solape_padre)
+    hijos = [
+        (x, y, padre_id)
+        for padre_id, (a, b) in enumerate(padres)
+        for x, y in trocear(texto, tam_hijo, solape_hijo, a, b)
+    ]
+    return padres, hijos, reinicio
+
+
+# ==========================================
+# PARIDAD Y BENCHMARK
+# ==========================================
+
+def comprobar_paridad(textos: List[str]) -> dict:
+    """
+    Compara padres e hijos con los de `RecursiveCharacterTextSplitter` (utils.hacer_chunking).
+
+    Returns:
+        dict: {"textos", "padres", "hijos", "diferencias": [...]}
+    """
+    from utilidades import utils
+
+    resultado = {"textos": len(textos), "padres": 0, "hijos": 0, "diferencias": []}
+    for n, texto in enumerate(textos):
+        padres, hijos = trocear_padre_hijo(texto)
+        ref_padres = utils.hacer_chunking(texto, chunk_size=2000, overlap=200)
+        nuevos_padres = [texto[a:b] for a, b in padres]
+        if nuevos_padres != ref_padres:
+            resultado["diferencias"].append({"texto": n, "nivel": "padre"})
+            continue
+        ref_hijos = [(h, i) for i, p in enumerate(ref_padres) for h in utils.hacer_chunking(p, chunk_size=400, overlap=50)]
+        if [(texto[a:b], pid) for a, b, pid in hijos] != ref_hijos:
+            resultado["diferencias"].append({"texto": n, "nivel": "hijo"})
+        resultado["padres"] += len(padres)
+        resultado["hijos"] += len(hijos)
+    return resultado
+
+
+def comprobar_paridad_parcial(textos: List[str], tam_fragmento: int = 5000) -> dict:
+    """
+    Compara el troceo por fragmentos (`trocear_padre_hijo_parcial`, ingesta en streaming)
+    con `trocear_padre_hijo` sobre el texto entero.
+
+    Returns:
+        dict: {"textos", "diferencias": [...]}
+    """
+    resultado = {"textos": len(textos), "diferencias": []}
+    for n, texto in enumerate(textos):
+        esperado = [(texto[a:b], texto[padres[p][0]:padres[p][1]]) for padres, hijos in [trocear_padre_hijo(texto)]
+                    for a, b, p in hijos]
+        obtenido, pendiente = [], ""
+        for desde in range(0, len(texto) + 1, tam_fragmento):
+            final = desde + tam_fragmento > len(texto)
+            bloque = pendiente + texto[desde:desde + tam_fragmento]
+            padres, hijos, reinicio = trocear_padre_hijo_parcial(bloque, final)
+            obtenido.extend((bloque[a:b], bloque[padres[p][0]:padres[p][1]]) for a, b, p in hijos)
+            pendiente = bloque[reinicio:]
+            if final:
+                break
+        if obtenido != esperado:
+            resultado["diferencias"].append({"texto": n})
+    return resultado
+
+
+def corpus_sintetico(caracteres: int, semilla: int = 0) -> str:
+    """Texto pseudo-administrativo con párrafos, saltos de línea, espacios raros y palabras muy largas."""
+    import random
+
+    rng = random.Random(semilla)
+    vocabulario = ("autónomo cuota RETA IAE modelo 140 Hacienda Foral Bizkaia ayuda subvención "
+                   "Seguridad Social alta baja tarifa plana rendimiento actividad económica "
+                   "declaración trimestral IVA IRPF Lanbide Merkaekin 3i26 requisitos plazo").split()
+    partes, n = [], 0
+    while n < caracteres:
+        palabras = [rng.choice(vocabulario) for _ in range(rng.randint(5, 120))]
+        if rng.random() < 0.02:
+            palabras.append("x" * rng.randint(300, 900))  # "palabra" sin espacios (tablas, URLs)
+        frase = " ".join(palabras) + rng.choice([". ", ".\n", ".\n\n", ".  ", ".\n\n\n", ". \n \n"])
+        partes.append(frase)
+        n += len(frase)
+    return "".join(partes)
+
+
+def benchmark(textos: dict, repeticiones: int = 1) -> dict:
+    """Tiempo de limpieza + chunking padre/hijo: LangChain vs. chunker por offsets."""
+    import time
+    from utilidades import utils
+
+    resultados = {}
+    for nombre, texto in textos.items():
+        limpio = utils.limpiar_texto(texto)
+        t0 = time.perf_counter()
+        for _ in range(repeticiones):
+            ref_padres = utils.hacer_chunking(limpio, chunk_size=2000, overlap=200)
+            for p in ref_padres:
+                utils.hacer_chunking(p, chunk_size=400, overlap=50)
+        t_langchain = (time.perf_counter() - t0) / repeticiones
+
+        t0 = time.perf_counter()
+        for _ in range(repeticiones):
+            trocear_padre_hijo(limpio)
+        t_offsets = (time.perf_counter() - t0) / repeticiones
+
+        t0 = time.perf_counter()
+        for _ in range(repeticiones):
+            utils.limpiar_texto(texto)
+        t_limpieza = (time.perf_counter() - t0) / repeticiones
+
+        mb = len(texto) / 2**20
+        resultados[nombre] = {
+            "mb": round(mb, 2),
+            "limpieza_s": round(t_limpieza, 4),
+            "langchain_s": round(t_langchain, 4),
+            "offsets_s": round(t_offsets, 4),
+            "aceleracion": round(t_langchain / t_offsets, 2) if t_offsets else None,
+            "offsets_mb_s": round(mb / t_offsets, 2) if t_offsets else None
+        }
+    return resultados
+
+
+def main():
+    import argparse
+    import json
+    from loguru import logger
+    from utilidades import utils
+
+    parser = argparse.ArgumentParser(description="Paridad y benchmark del chunker por offsets")
+    parser.add_argument("--mb", type=float, default=20, help="Tamaño del corpus sintético (MB)")
+    args = parser.parse_args()
+
+    textos = {}
+    try:
+        from utilidades.funciones_preprocesado import PDF_DIR, leer_pdf
+        for ruta in sorted(PDF_DIR.glob("*.pdf")):
+            textos[ruta.name] = leer_pdf(str(ruta))
+    except ImportError as e:
+        logger.warning(f"No se pueden leer los PDFs ({e}); solo corpus sintético.")
+    textos["sintetico_pequeno"] = corpus_sintetico(200_000, semilla=1)
+
+    paridad = comprobar_paridad([utils.limpiar_texto(t) for t in textos.values()])
+    logger.info("\n PARIDAD CON RecursiveCharacterTextSplitter \n" + json.dumps(paridad, indent=2))
+    if paridad["diferencias"]:
+        raise SystemExit("El chunker por offsets NO coincide con el de LangChain.")
+    parcial = comprobar_paridad_parcial([utils.limpiar_texto(t) for t in textos.values()])
+    logger.info("\n PARIDAD DEL TROCEO POR FRAGMENTOS \n" + json.dumps(parcial, indent=2))
+    if parcial["diferencias"]:
+        raise SystemExit("El troceo por fragmentos NO coincide con el del documento entero.")
+
+    bench = benchmark({"pdfs": "\n".join(t for n, t in textos.items() if n.endswith(".pdf"))} if any(
+        n.endswith(".pdf") for n in textos) else {})
+    bench.update(benchmark({f"sintetico_{args.mb:g}mb": corpus_sintetico(int(args.mb * 2**20))}))
+    logger.info("\n BENCHMARK CHUNKING \n" + json.dumps(bench, indent=2))
+
+
+if __name__ == "__main__":
+    main()
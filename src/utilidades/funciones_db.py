@@ -8,19 +8,23 @@ from pathlib import Path
 from dotenv import load_dotenv
 from tqdm import tqdm
 from PIL import Image
+import numpy as np
 import torch
 from transformers import CLIPModel, CLIPProcessor
 from sentence_transformers import SentenceTransformer, util
-from utilidades import utils
+from utilidades import utils, funciones_padres, funciones_metadatos, funciones_bm25, funciones_fragmentos
 # import utils
 import os
 from loguru import logger
 import json
 from utilidades.funciones_preprocesado import leer_pdf
 # from funciones_preprocesado import leer_pdf
-import traceback
-import uuid
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional
 
 load_dotenv()
 
@@ -31,10 +35,418 @@ COLLECTION_NAME_IMAGENES = os.getenv("COLLECTION_NAME_IMAGENES")
 MODELO_EMBEDDINGS = os.getenv("MODELO_EMBEDDINGS")
 MODELO_CLIP = os.getenv("MODELO_CLIP")
 PDFS_DIR = utils.project_root() /"data"/"documentos"/"pdfs"
+IMAGENES_DIR = utils.project_root() /"data"/"documentos"/"imagenes"
+IMAGENES_BATCH_SIZE = int(os.getenv("IMAGENES_BATCH_SIZE", "32"))
+IMAGENES_WORKERS = int(os.getenv("IMAGENES_WORKERS") or os.cpu_count() or 4)
+NOMBRES_COLECCIONES = {"pdfs": COLLECTION_NAME_PDFS, "imagenes": COLLECTION_NAME_IMAGENES}
+# Versiones de las colecciones (blue/green): el alias indica cuál sirve la API
+ALIAS_FILE = Path(DB_PATH or "chromadb/") / "alias_colecciones.json"
+VERSIONES_DIR = Path(DB_PATH or "chromadb/") / "versiones"
+VERSIONES_RETENIDAS = int(os.getenv("VERSIONES_RETENIDAS", "2"))
+# Segundos sin cambios en el manifiesto/BM25 antes de dar por terminada una ingesta incremental
+CAMBIOS_ESTABLES_SEGUNDOS = float(os.getenv("ALIAS_CAMBIOS_ESTABLES_SEGUNDOS", "30"))
+# Manifiesto de la ingesta incremental (uno por versión, ver funciones_indexado)
+NOMBRE_MANIFIESTO = "manifiesto_ingesta.json"
+# Parámetros HNSW de Chroma (metadatos `hnsw:*` de la colección): M y construction_ef se fijan al
+# crear la colección; search_ef se aplica también a las existentes al abrirlas (funciones_hnsw los ajusta)
+CLAVES_HNSW = {"HNSW_M": "hnsw:M", "HNSW_CONSTRUCTION_EF": "hnsw:construction_ef", "HNSW_SEARCH_EF": "hnsw:search_ef"}
+# Metadatos de los que dependen el router, los filtros del buscador y la ingesta incremental
+CLAVES_REQUERIDAS = {"pdfs": ("categoria", "source", "parent_id"), "imagenes": ("categoria", "nombre_archivo")}
+
+
+# ==========================================
+# VERSIONES DE LAS COLECCIONES
+# ==========================================
+
+def leer_alias() -> dict:
+    """
+    Lee el alias de colecciones: {"activa": version | None, "versiones": [...], "activada_en": iso}.
+    Sin fichero de alias se sirven las colecciones sin versionar (COLLECTION_NAME_*).
+    """
+    try:
+        with open(ALIAS_FILE, "r", encoding="utf-8") as f:
+            alias = json.load(f)
+    except FileNotFoundError:
+        alias = {}
+    except json.JSONDecodeError:
+        logger.error(f"[VERSIONES] Alias corrupto en {ALIAS_FILE}; se usan las colecciones sin versionar.")
+        alias = {}
+    alias.setdefault("activa", None)
+    alias.setdefault("versiones", [])
+    return alias
+
+def _escribir_alias(alias: dict) -> None:
+    """Escritura atómica (temporal + rename): los lectores ven el alias anterior o el nuevo, nunca uno a medias."""
+    utils.escribir_json_atomico(ALIAS_FILE, alias)
+
+def version_activa() -> Optional[str]:
+    return leer_alias()["activa"]
+
+def nueva_version() -> str:
+    """Nombre para una versión nueva (marca de tiempo, ordenable)."""
+    return datetime.now().strftime("v%Y%m%d_%H%M%S")
+
+def nombres_colecciones(version: Optional[str] = None) -> dict:
+    """Nombres de las colecciones de una versión ({"pdfs": ..., "imagenes": ...}); None = sin versionar."""
+    if not version:
+        return dict(NOMBRES_COLECCIONES)
+    return {tipo: f"{nombre}__{version}" for tipo, nombre in NOMBRES_COLECCIONES.items()}
+
+def directorio_version(version: Optional[str] = None) -> Path:
+    """Directorio con los ficheros auxiliares de una versión (padres, manifiesto, checkpoints)."""
+    return VERSIONES_DIR / version if version else Path(DB_PATH or "chromadb/")
+
+def activar_version(version: str) -> None:
+    """
+    Cambia el alias a `version` de forma atómica (temporal + rename).
+    Las APIs en marcha lo detectan y cambian de colecciones sin reiniciar.
+    """
+    client = chromadb.PersistentClient(path=DB_PATH)
+    for nombre in nombres_colecciones(version).values():
+        client.get_collection(nombre)  # Falla si la versión no está construida
+    alias = leer_alias()
+    if version not in alias["versiones"]:
+        alias["versiones"].append(version)
+    alias["activa"] = version
+    alias["activada_en"] = datetime.now().isoformat()
+    _escribir_alias(alias)
+    logger.info(f"[VERSIONES] Versión activa: {version}")
+
+def purgar_versiones(conservar: int = VERSIONES_RETENIDAS) -> List[str]:
+    """
+    Borra las colecciones y ficheros de las versiones antiguas, conservando la activa
+    y las `conservar` anteriores para poder volver atrás.
+
+    Returns:
+        list: Versiones borradas.
+    """
+    import shutil
+
+    alias = leer_alias()
+    if alias["activa"] not in alias["versiones"]:
+        return []
+    anteriores = alias["versiones"][:alias["versiones"].index(alias["activa"])]
+    borrar = anteriores[:max(len(anteriores) - conservar, 0)]
+    if not borrar:
+        return []
+    client = chromadb.PersistentClient(path=DB_PATH)
+    for version in borrar:
+        for nombre in nombres_colecciones(version).values():
+            funciones_fragmentos.borrar_coleccion(client, nombre)
+        funciones_padres.cerrar_almacen(directorio_version(version))
+        shutil.rmtree(directorio_version(version), ignore_errors=True)
+        alias["versiones"].remove(version)
+        logger.info(f"[VERSIONES] Versión {version} borrada.")
+    _escribir_alias(alias)
+    return borrar
+
+
+def parametros_hnsw(**valores) -> dict:
+    """
+    Metadatos `hnsw:*` para crear una colección a partir de la configuración (HNSW_M,
+    HNSW_CONSTRUCTION_EF, HNSW_SEARCH_EF). Los no configurados quedan con el valor por defecto de Chroma.
+
+    Args:
+        **valores: Sustituyen a la configuración, p. ej. parametros_hnsw(HNSW_SEARCH_EF=50).
+    """
+    parametros = {}
+    for variable, clave in CLAVES_HNSW.items():
+        valor = valores.get(variable, os.getenv(variable))
+        if valor not in (None, ""):
+            parametros[clave] = int(valor)
+    return parametros
+
+def search_ef_actual(coleccion) -> Optional[int]:
+    """`ef_search` de la configuración HNSW de una colección de Chroma (None si no es HNSW)."""
+    configuracion = getattr(coleccion, "configuration", None) or {}
+    return (configuracion.get("hnsw") or {}).get("ef_search")
+
+def aplicar_search_ef(coleccion, search_ef: Optional[int] = None) -> None:
+    """
+    Fija `ef_search` (esfuerzo de búsqueda) en una colección ya creada y, si está fragmentada,
+    en todos sus fragmentos, con la API de configuración de Chroma 1.x. Sin valor configurado
+    no hace nada. Lo aplican la ingesta (`crear_db`) y `funciones_hnsw.py --aplicar`; el
+    registro no lo toca al abrir.
+
+    Raises:
+        Exception: Si Chroma rechaza el cambio en alguna de las colecciones.
+    """
+    search_ef = search_ef or os.getenv("HNSW_SEARCH_EF")
+    if not search_ef:
+        return
+    search_ef = int(search_ef)
+    fragmentada = isinstance(coleccion, funciones_fragmentos.ColeccionFragmentada)
+    for col in (coleccion.partes if fragmentada else [coleccion]):
+        if search_ef_actual(col) == search_ef:
+            continue
+        try:
+            col.modify(configuration={"hnsw": {"ef_search": search_ef}})
+        except Exception as e:
+            logger.error(f"[HNSW] No se pudo fijar ef_search={search_ef} en '{col.name}': {e}")
+            raise
+        logger.info(f"[HNSW] ef_search={search_ef} en '{col.name}'")
+    if fragmentada:
+        # Los fragmentos que se creen después heredan el valor de los metadatos del ancla
+        coleccion.metadata = {**(coleccion.metadata or {}), "hnsw:search_ef": search_ef}
+
+
+class RegistroColecciones:
+    """
+    Registro de proceso con un único cliente de ChromaDB y sus colecciones abiertas.
+
+    La API lo abre una vez en el `lifespan` y todas las peticiones concurrentes
+    comparten el mismo cliente, evitando crear un `PersistentClient` por consulta.
+    Sirve la versión de las colecciones indicada por el alias y, con `comprobar_alias`,
+    cambia a una versión nueva sin cerrar el cliente (las peticiones en curso terminan
+    con las colecciones que ya tenían).
+    """
+
+    def __init__(self, db_path: str = None):
+        self._db_path = db_path or DB_PATH
+        self._lock = threading.RLock()
+        self._client = None
+        self._colecciones = {}
+        self._abierto_en = None
+        self._segundos_apertura = None
+        self._firma = None
+        self._marca_firma = None
+        self._marca_cambios = None
+        self._marca_pendiente = None
+        self._pendiente_desde = None
+        self._version = None
+        self._marca_alias = None
+
+    @property
+    def abierto(self) -> bool:
+        return self._client is not None
+
+    @property
+    def version(self) -> Optional[str]:
+        """Versión de las colecciones abiertas (None = colecciones sin versionar)."""
+        return self._version
+
+    def directorio(self) -> Path:
+        """Directorio de la versión abierta (almacén de padres, manifiesto...)."""
+        return directorio_version(self._version)
+
+    @staticmethod
+    def _leer_marca_alias():
+        try:
+            st = ALIAS_FILE.stat()
+            return (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _abrir_colecciones(self, version: Optional[str]) -> dict:
+        colecciones = {}
+        for tipo, nombre in nombres_colecciones(version).items():
+            try:
+                colecciones[tipo] = funciones_fragmentos.abrir_coleccion(self._client, nombre)
+            except Exception as e:
+                logger.warning(f"[REGISTRO] No se pudo abrir la colección '{nombre}': {e}")
+        return colecciones
+
+    def abrir(self):
+        """Abre el cliente y carga las colecciones conocidas (idempotente)."""
+        with self._lock:
+            if self._client is not None:
+                return self
+            inicio = time.perf_counter()
+            self._client = chromadb.PersistentClient(path=self._db_path)
+            self._marca_alias = self._leer_marca_alias()
+            self._version = version_activa()
+            self._colecciones = self._abrir_colecciones(self._version)
+            self._abierto_en = time.time()
+            self._segundos_apertura = time.perf_counter() - inicio
+            self._actualizar_firma()
+            self._marca_cambios = self._marca_firma
+            logger.info(
+                f"[REGISTRO] ChromaDB abierto en {self._segundos_apertura:.3f}s con colecciones: "
+                f"{list(self._colecciones)} (versión {self._version or 'sin versionar'})"
+            )
+            return self
+
+    def comprobar_alias(self) -> bool:
+        """
+        Cambia a la versión activa del alias si ha cambiado desde la última comprobación.
+        Las colecciones nuevas se abren antes del cambio, que es una sola asignación bajo el lock;
+        si la versión nueva no se puede abrir entera, se sigue sirviendo la anterior.
+
+        Returns:
+            bool: True si se ha cambiado de versión.
+        """
+        marca = self._leer_marca_alias()
+        with self._lock:
+            if self._client is None or marca == self._marca_alias:
+                return False
+            self._marca_alias = marca
+            version = version_activa()
+            if version == self._version:
+                return False
+            colecciones = self._abrir_colecciones(version)
+            if set(colecciones) != set(NOMBRES_COLECCIONES):
+                logger.error(f"[REGISTRO] La versión {version} está incompleta; se mantiene {self._version}.")
+                return False
+            anterior, self._version, self._colecciones = self._version, version, colecciones
+            self._actualizar_firma()
+            self._marca_cambios = self._marca_firma
+            logger.info(f"[REGISTRO] Cambio de versión: {anterior or 'sin versionar'} -> {version}")
+            return True
+
+    def comprobar_cambios(self, estable: float = CAMBIOS_ESTABLES_SEGUNDOS) -> bool:
+        """
+        Detecta una ingesta incremental (otro proceso) sobre la versión servida por la marca de
+        su manifiesto y su índice BM25. La ingesta reescribe el manifiesto tras cada fichero, así
+        que el cambio solo se da por bueno cuando la marca lleva `estable` segundos sin moverse.
+        Entonces vuelve a descubrir los fragmentos (la ingesta puede haber creado categorías
+        nuevas) y recalcula la firma.
+
+        Returns:
+            bool: True si la versión servida se ha modificado desde la última comprobación.
+        """
+        with self._lock:
+            if self._client is None:
+                return False
+            marca = self.marca_indice()
+            if marca == self._marca_cambios:
+                self._marca_pendiente = None
+                return False
+            if marca != self._marca_pendiente:
+                self._marca_pendiente, self._pendiente_desde = marca, time.monotonic()
+                return False
+            if time.monotonic() - self._pendiente_desde < estable:
+                return False
+            self._marca_cambios, self._marca_pendiente = marca, None
+            for coleccion in self._colecciones.values():
+                if isinstance(coleccion, funciones_fragmentos.ColeccionFragmentada):
+                    coleccion.descubrir()
+            self._actualizar_firma()
+            logger.info(f"[REGISTRO] Cambios en la versión {self._version or 'sin versionar'}; firma {self._firma}")
+            return True
+
+    def cerrar(self):
+        """Libera el cliente y las colecciones abiertas."""
+        with self._lock:
+            if self._client is None:
+                return
+            try:
+                self._client.clear_system_cache()
+            except Exception as e:
+                logger.warning(f"[REGISTRO] Error liberando el cliente de ChromaDB: {e}")
+            self._client = None
+            self._colecciones = {}
+            self._abierto_en = None
+            self._segundos_apertura = None
+            self._firma = None
+            self._marca_firma = None
+            self._marca_cambios = None
+            self._marca_pendiente = None
+            self._version = None
+            self._marca_alias = None
+            logger.info("[REGISTRO] ChromaDB cerrado.")
+
+    def recargar(self):
+        """Cierra y vuelve a abrir el cliente (útil tras reconstruir las colecciones)."""
+        with self._lock:
+            self.cerrar()
+            return self.abrir()
+
+    def obtener(self, tipo: str = "pdfs"):
+        """
+        Devuelve una colección abierta, abriendo el registro si hace falta.
+
+        Args:
+            tipo (str): Tipo de colección. Puede ser "pdfs" o "imagenes".
+
+        Returns:
+            chromadb.Collection: La colección solicitada.
+        """
+        tipo = tipo.lower()
+        if tipo not in NOMBRES_COLECCIONES:
+            raise ValueError(f"Tipo de colección no válido: {tipo}. Use 'pdfs' o 'imagenes'")
+        with self._lock:
+            if self._client is None:
+                self.abrir()
+            coleccion = self._colecciones.get(tipo)
+            if coleccion is None:
+                # Puede haberse creado después de abrir el registro
+                coleccion = funciones_fragmentos.abrir_coleccion(self._client, nombres_colecciones(self._version)[tipo])
+                self._colecciones[tipo] = coleccion
+            elif isinstance(coleccion, funciones_fragmentos.ColeccionFragmentada) and not coleccion.fragmentos:
+                coleccion.descubrir()  # La ingesta puede haber creado los fragmentos después de abrir
+            return coleccion
+
+    def marca_indice(self) -> tuple:
+        """
+        (mtime, tamaño) del manifiesto y del índice BM25 de la versión servida. La ingesta
+        reescribe al menos uno de los dos tras cada escritura o borrado en las colecciones.
+        """
+        marcas = []
+        directorio = self.directorio()
+        for ruta in (directorio / NOMBRE_MANIFIESTO, funciones_bm25.ruta_indice(directorio)):
+            try:
+                st = ruta.stat()
+                marcas.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                marcas.append(None)
+        return tuple(marcas)
+
+    def _actualizar_firma(self) -> None:
+        self._marca_firma = self.marca_indice()
+        partes = []
+        for tipo, coleccion in sorted(self._colecciones.items()):
+            try:
+                count = coleccion.count()
+            except Exception:
+                count = None
+            partes.append(f"{tipo}:{coleccion.id}:{count}")
+        partes.append(f"ficheros:{self._marca_firma}")
+        self._firma = "|".join(partes)
+
+    def firma(self) -> Optional[str]:
+        """
+        Identifica la versión del índice abierto (id y tamaño de cada colección y marca de los
+        ficheros de la ingesta). Cambia al reconstruir las colecciones, al cambiar de versión y
+        con cada ingesta incremental sobre la versión servida, y sirve para invalidar las cachés
+        que dependen del retrieval. Solo se vuelven a contar las colecciones si la marca de los
+        ficheros ha cambiado (comprobarlo son dos `stat`).
+        """
+        with self._lock:
+            if self._client is None:
+                self.abrir()
+            if self.marca_indice() != self._marca_firma:
+                self._actualizar_firma()
+            return self._firma
+
+    def estado(self) -> dict:
+        """Resumen del registro para `/health`: conteos por colección y tiempo de apertura."""
+        with self._lock:
+            colecciones = {}
+            for tipo, coleccion in self._colecciones.items():
+                try:
+                    count = coleccion.count()
+                except Exception as e:
+                    logger.warning(f"[REGISTRO] Error contando '{coleccion.name}': {e}")
+                    count = None
+                colecciones[tipo] = {"nombre": coleccion.name, "count": count}
+                if isinstance(coleccion, funciones_fragmentos.ColeccionFragmentada):
+                    colecciones[tipo]["fragmentos"] = coleccion.contar_por_fragmento()
+            return {
+                "abierto": self._client is not None,
+                "abierto_en": datetime.fromtimestamp(self._abierto_en).isoformat() if self._abierto_en else None,
+                "segundos_apertura": round(self._segundos_apertura, 4) if self._segundos_apertura is not None else None,
+                "version": self._version,
+                "colecciones": colecciones
+            }
+
+
+# Registro compartido por todo el proceso
+registro = RegistroColecciones()
 
 def obtener_coleccion(tipo="pdfs"):
     """
     Obtiene una colección de la base de datos (sin resetear).
+    Usa el registro de proceso, de modo que el cliente solo se crea una vez.
     
     Args:
         tipo (str): Tipo de colección. Puede ser "pdfs" o "imagenes".
@@ -42,14 +454,44 @@ def obtener_coleccion(tipo="pdfs"):
     Returns:
         chromadb.Collection: La colección solicitada.
     """
-    client = chromadb.PersistentClient(path=DB_PATH)
-    
-    if tipo.lower() == "pdfs":
-        return client.get_collection(COLLECTION_NAME_PDFS)
-    elif tipo.lower() == "imagenes":
-        return client.get_collection(COLLECTION_NAME_IMAGENES)
-    else:
-        raise ValueError(f"Tipo de colección no válido: {tipo}. Use 'pdfs' o 'imagenes'")
+    return registro.obtener(tipo)
+
+def comprobar_consistencia(categorias: List[str], muestra: int = 200) -> dict:
+    """
+    Comprueba que el índice servido tiene los metadatos de los que dependen el router y los
+    filtros del buscador: claves de CLAVES_REQUERIDAS ausentes en una muestra de cada
+    colección (o de cada fragmento) y categorías del router sin ningún registro.
+
+    Args:
+        categorias (list): Categorías que puede devolver el router.
+        muestra (int): Registros revisados por colección o fragmento.
+
+    Returns:
+        dict: {tipo: {"claves_ausentes": {clave: fracción}, "categorias_sin_datos": [...], "fragmentada": bool}}
+    """
+    informe = {}
+    for tipo, claves in CLAVES_REQUERIDAS.items():
+        try:
+            coleccion = obtener_coleccion(tipo)
+        except Exception as e:
+            informe[tipo] = {"error": str(e)}
+            logger.warning(f"[CONSISTENCIA] No se pudo abrir la colección '{tipo}': {e}")
+            continue
+        fragmentada = isinstance(coleccion, funciones_fragmentos.ColeccionFragmentada)
+        partes = list(coleccion.fragmentos.values()) if fragmentada else [coleccion]
+        metadatos = [m or {} for col in partes for m in col.get(include=["metadatas"], limit=muestra)["metadatas"]]
+        ausentes = {
+            clave: round(sum(clave not in m for m in metadatos) / len(metadatos), 3)
+            for clave in claves if metadatos and any(clave not in m for m in metadatos)
+        }
+        # Con fragmentos, cada comprobación solo mira el fragmento de la categoría
+        sin_datos = [c for c in categorias if not coleccion.get(where={"categoria": c}, limit=1, include=[])["ids"]]
+        informe[tipo] = {"claves_ausentes": ausentes, "categorias_sin_datos": sin_datos, "fragmentada": fragmentada}
+        if ausentes:
+            logger.warning(f"[CONSISTENCIA] '{tipo}': metadatos que usa el router/buscador ausentes del índice: {ausentes}")
+        if sin_datos:
+            logger.warning(f"[CONSISTENCIA] '{tipo}': categorías del router sin datos en el índice: {sin_datos}")
+    return informe
 
 def cargar_modelos():
     """Carga todos los modelos de IA necesarios."""
@@ -71,277 +513,262 @@ def cargar_modelos():
     
     return model_emb, model_clip, processor_clip
 
-def crear_db(reset=False):
+def crear_db(reset=False, version=None, hnsw=None):
     """
-    Crea la base de datos de Chroma con dos colecciones (PDFs e imágenes).
+    Crea la base de datos de Chroma con dos colecciones (PDFs e imágenes), fragmentadas
+    por categoría si FRAGMENTAR_POR_CATEGORIA está activo y con los parámetros HNSW de la configuración.
     
     Args:
         reset (bool): Si es True, borra las colecciones existentes.
+        version (str): Versión de las colecciones (por defecto, la activa según el alias).
+        hnsw (dict): Metadatos `hnsw:*` (por defecto, `parametros_hnsw()`). M y construction_ef
+            solo se aplican a las colecciones que se crean; search_ef también a las existentes.
     
     Returns:
         dict: Diccionario con ambas colecciones {'pdfs': collection, 'imagenes': collection}
     """
     client = chromadb.PersistentClient(path=DB_PATH)
+    nombres = nombres_colecciones(version or version_activa())
     
     if reset:
-        try:
-            client.delete_collection(COLLECTION_NAME_PDFS)
-            logger.info(f"Reset activado. Borrando colección '{COLLECTION_NAME_PDFS}'.")
-        except:
-            logger.warning(f"No se encontraba la colección '{COLLECTION_NAME_PDFS}'.")
-        
-        try:
-            client.delete_collection(COLLECTION_NAME_IMAGENES)
-            logger.info(f"Reset activado. Borrando colección '{COLLECTION_NAME_IMAGENES}'.")
-        except:
-            logger.warning(f"No se encontraba la colección '{COLLECTION_NAME_IMAGENES}'.")
-        
-        collection_pdfs = client.create_collection(COLLECTION_NAME_PDFS)
-        collection_imagenes = client.create_collection(COLLECTION_NAME_IMAGENES)
-    else:
-        collection_pdfs = client.get_or_create_collection(COLLECTION_NAME_PDFS)
-        collection_imagenes = client.get_or_create_collection(COLLECTION_NAME_IMAGENES)
+        for nombre in nombres.values():
+            logger.info(f"Reset activado. Borrando colección '{nombre}'.")
+            funciones_fragmentos.borrar_coleccion(client, nombre)
+
+    hnsw = parametros_hnsw() if hnsw is None else hnsw
+    collection_pdfs = funciones_fragmentos.abrir_coleccion(client, nombres["pdfs"], crear=True, metadata=hnsw)
+    collection_imagenes = funciones_fragmentos.abrir_coleccion(client, nombres["imagenes"], crear=True, metadata=hnsw)
+    for collection in (collection_pdfs, collection_imagenes):
+        aplicar_search_ef(collection, hnsw.get("hnsw:search_ef"))
     
-    logger.info(f"Base de datos lista con colecciones: '{COLLECTION_NAME_PDFS}' e '{COLLECTION_NAME_IMAGENES}'")
+    logger.info(f"Base de datos lista con colecciones: '{nombres['pdfs']}' e '{nombres['imagenes']}'")
     
     return {"pdfs": collection_pdfs, "imagenes": collection_imagenes}
 
-def insertar_texto(texto, nombre_pdf, modelo_embeddings, collection, metadatos_json=None):
-    """
-    Inserta un texto en la base de datos con metadatos del PDF.
-    
-    Args:
-        texto (str): El texto a insertar.
-        nombre_pdf (str): El nombre del PDF.
-        modelo_embeddings (SentenceTransformer): El modelo de embeddings.
-        collection (chromadb.Collection): La colección de la base de datos.
-        metadatos_json (dict): Metadatos del JSON de metadata_pdf.json
-    """
-    if not texto:
-        return
-    
-    texto = utils.limpiar_texto(texto)
-    chunks = utils.chunk_padre_hijo(texto)
-    
-    if not chunks:
-        logger.warning(f"No se generaron chunks para {nombre_pdf}")
-        return
-    
-    categoria = "sin_categoria"  # valor por defecto
-    if metadatos_json:
-        try:
-            for doc in metadatos_json:
-                if doc.get("archivo") == nombre_pdf:
-                    categoria = doc.get("categoria", "sin_categoria")
-                    break
-        except Exception:
-            logger.warning("Error leyendo metadatos de PDF proporcionados; usando categoria por defecto")
-
-    textos_hijos = [item["texto_vectorizable"] for item in chunks]
-    metadatas = []
-    ids = []
-
-    # Preparar metadatos para cada chunk (combinando JSON + chunk info)
-    for idx, item in enumerate(chunks):
-        metadatas.append({
-            "source": nombre_pdf,
-            "categoria": categoria,
-            "type": "child",
-            "parent_id": item["padre_id"],
-            "contexto_expandido": item["texto_completo_padre"]
-        })
-        ids.append(f"{nombre_pdf}_child_{idx}")
-            
-    # Generar Embeddings (Solo de los HIJOS)
-    embeddings = utils.generar_embeddings(modelo_embeddings, textos_hijos, batch_size=64)
-        
-    # Guardar en DB
-    try:
-        logger.info(f"  Insertando {len(ids)} chunks en ChromaDB...")
-        collection.add(
-            documents=textos_hijos,
-            embeddings=embeddings,
-            metadatas=metadatas,
-            ids=ids
-        )
-        logger.info(f"Insertados {len(ids)} chunks de {nombre_pdf}")
-    except Exception as e:
-        logger.error(f"Error al insertar en ChromaDB: {str(e)}")
-        logger.error(traceback.format_exc())
-
-def insertar_imagen(model_clip, processor_clip, collection, metadata_imagenes=None):
-    if not metadata_imagenes:
-        logger.warning("No se proporcionaron metadatos de imágenes; nada que procesar")
-        return
+def id_imagen(nombre_archivo: str) -> str:
+    """Id determinista de una imagen en ChromaDB (derivado del nombre de archivo)."""
+    return f"img_{nombre_archivo}"
 
-    logger.info(f"Procesando {len(metadata_imagenes)} imágenes desde metadatos")
+def ruta_imagen_local(meta: dict) -> Path:
+    """Ruta de la imagen en este equipo (los metadatos pueden traer rutas absolutas de otro PC)."""
+    ruta = Path(meta.get("ruta_imagen", ""))
+    if meta.get("ruta_imagen") and ruta.exists():
+        return ruta
+    return IMAGENES_DIR / meta["nombre_archivo"]
 
-    for meta in metadata_imagenes:
+def _tensor_caracteristicas(features) -> torch.Tensor:
+    """
+    Extrae el tensor proyectado de la salida de `get_image_features`.
+    Según la versión de transformers puede devolver un tensor o un objeto con el tensor dentro.
+    """
+    if hasattr(features, "pooler_output"):
+        features = features.pooler_output
+    elif hasattr(features, "image_embeds"):
+        features = features.image_embeds
+    elif isinstance(features, (list, tuple)):
+        features = features[0]
+
+    if not isinstance(features, torch.Tensor):
+        raise ValueError(f"No se pudo extraer el tensor de características. Tipo recibido: {type(features)}")
+    return features
+
+def _preprocesar_imagen(ruta: Path, processor_clip):
+    """Decodifica una imagen y devuelve su `pixel_values` (3, H, W) listo para CLIP."""
+    with Image.open(ruta) as imagen:
+        imagen = imagen.convert("RGB")
+    return processor_clip(images=imagen, return_tensors="np")["pixel_values"][0]
+
+def _lotes_preprocesados(metas: list, processor_clip, batch_size: int, pool: ThreadPoolExecutor, tiempos: dict):
+    """
+    Genera lotes (metas, pixel_values) decodificados en el pool de hilos.
+    El lote siguiente se decodifica mientras el modelo procesa el actual.
+    """
+    def preparar(meta):
+        t0 = time.perf_counter()
         try:
-            ruta = Path(meta["ruta_imagen"])
-
-            if not ruta.exists():
-                logger.warning(f"Imagen no encontrada: {ruta}")
-                continue
-
-            image = Image.open(ruta).convert("RGB")
-
-            # Procesar con CLIPProcessor
-            inputs = processor_clip(images=image, return_tensors="pt").to(model_clip.device)
-            
-            with torch.no_grad():
-                # get_image_features ya devuelve el tensor proyectado
-                features = model_clip.get_image_features(**inputs)
-                
-                # Nos aseguramos de tener un vector (tensor) de PyTorch
-                # get_image_features suele devolver el tensor proyectado, 
-                # pero en algunas versiones devuelve un objeto BaseModelOutputWithPooling
-                if hasattr(features, "pooler_output"):
-                    features = features.pooler_output
-                elif hasattr(features, "image_embeds"):
-                    features = features.image_embeds
-                elif isinstance(features, (list, tuple)):
-                    features = features[0]
-                
-                # Si a pesar de todo no es un tensor (caso raro), forzamos conversión si es posible
-                if not isinstance(features, torch.Tensor) and hasattr(features, "__getitem__"):
-                    try:
-                        features = features[0]
-                    except:
-                        pass
-
-                # Normalizar embeddings (crucial para CLIP)
-                # Si llega aquí y no es tensor, fallará con un error descriptivo
-                if not isinstance(features, torch.Tensor):
-                    raise ValueError(f"No se pudo extraer el tensor de características. Tipo recibido: {type(features)}")
-
-                features = features / features.norm(p=2, dim=-1, keepdim=True)
-                embedding = features.cpu().numpy().tolist()[0] 
-
-            collection.add(
-                ids=[str(uuid.uuid4())],
-                embeddings=[embedding], # Embeddings debe ser una lista de listas [[...]]
-                documents=[meta["nombre_archivo"]],
-                metadatas=[{
-                    "pdf_origen": meta["pdf_origen"],
-                    "categoria": meta.get("categoria", "sin_categoria"),
-                    "pagina": meta.get("pagina"),
-                    "nombre_archivo": meta["nombre_archivo"],
-                    "ruta_imagen": meta["ruta_imagen"],
-                    "tipo": "imagen"
-                }]
-            )
-
+            return meta, _preprocesar_imagen(ruta_imagen_local(meta), processor_clip), time.perf_counter() - t0
         except Exception as e:
-            logger.error(
-                f"Error procesando imagen {meta.get('nombre_archivo')}: {e}"
-            )
-
-def main():
+            logger.error(f"Error decodificando imagen {meta.get('nombre_archivo')}: {e}")
+            return meta, None, time.perf_counter() - t0
+
+    lotes = [metas[i:i + batch_size] for i in range(0, len(metas), batch_size)]
+    pendiente = [pool.submit(preparar, m) for m in lotes[0]] if lotes else []
+    for i in range(len(lotes)):
+        t0 = time.perf_counter()
+        resultados = [f.result() for f in pendiente]
+        tiempos["espera_decodificacion"] += time.perf_counter() - t0
+        # Lanzar el siguiente lote antes de devolver el actual
+        pendiente = [pool.submit(preparar, m) for m in lotes[i + 1]] if i + 1 < len(lotes) else []
+
+        validos = [(m, px) for m, px, _ in resultados if px is not None]
+        tiempos["decodificacion"] += sum(s for _, _, s in resultados)
+        if validos:
+            yield [m for m, _ in validos], np.stack([px for _, px in validos])
+
+def insertar_imagen(model_clip, processor_clip, collection, metadata_imagenes=None,
+                    batch_size: int = None, workers: int = None, estadisticas: dict = None):
     """
-    logger.info("\n RAG MULTIMODAL - CREANDO LA BASE DE DATOS \n")
+    Inserta (upsert) las imágenes de los metadatos en la colección de imágenes.
 
-    #Preguntar si borramos BD --> para ir haciendo pruebas
-    resp = input("¿Borrar base de datos y empezar de cero? (s/n): ").lower()
-    reset_db = (resp == 's')
-    
-    # Cargar modelos y crear db
-    model_emb, model_clip, processor_clip = cargar_modelos()
-    collections = crear_db(reset_db)
-    
-    # Cargar metadatos de PDFs una sola vez
-    metadatos_pdf = []
-    try:
-        with open("data/metadata_pdf.json", "r", encoding="utf-8") as f:
-            metadatos_pdf = json.load(f)
-    except FileNotFoundError:
-        logger.warning("No se encontró data/metadata_pdf.json; se usará categoria por defecto para todos los PDFs")
-    except json.JSONDecodeError:
-        logger.error("Error al parsear data/metadata_pdf.json; se usará categoria por defecto para todos los PDFs")
+    La decodificación y el preprocesado se hacen en un pool de hilos, `get_image_features`
+    se ejecuta por lotes y cada lote se escribe en ChromaDB con un único upsert.
 
-    # Procesar pdfs
-    pdfs = list(PDFS_DIR.glob("*.pdf"))
-    if not pdfs:
-        logger.error(f"Error: No hay PDFs en {PDFS_DIR}")
-        return
-    
-    for pdf in pdfs:
-        nombrePDF = pdf.name
-        logger.info(f"Procesando: {nombrePDF}...")
-        try:
-            # Usar función de preprocesado
-            texto_completo = leer_pdf(str(pdf))
-            # Insertar texto (usar metadatos cargados en main)
-            insertar_texto(texto_completo, nombrePDF, model_emb, collections["pdfs"], metadatos_pdf)
-        except Exception as e:
-            logger.error(f"Error procesando {nombrePDF}: {e}")
-            continue
+    Args:
+        model_clip (CLIPModel): Modelo CLIP.
+        processor_clip (CLIPProcessor): Procesador de CLIP.
+        collection (chromadb.Collection): Colección de imágenes.
+        metadata_imagenes (list): Metadatos de las imágenes (metadata_imagenes.json).
+        batch_size (int): Imágenes por lote (IMAGENES_BATCH_SIZE por defecto).
+        workers (int): Hilos de decodificación (IMAGENES_WORKERS por defecto).
+        estadisticas (dict): Si se pasa, se rellena con los tiempos e imágenes/s de cada etapa.
 
-    
-    # Cargar metadatos de imágenes una sola vez
-    metadata_imagenes = []
-    try:
-        with open("data/metadata_imagenes.json", "r", encoding="utf-8") as f:
-            metadata_imagenes = json.load(f)
-    except FileNotFoundError:
-        logger.warning("No se encontró data/metadata_imagenes.json; no se procesarán imágenes")
-    except json.JSONDecodeError:
-        logger.error("Error al parsear data/metadata_imagenes.json; no se procesarán imágenes")
-    
-    # Procesar imágenes
-    logger.info("\nProcesando imágenes...")
-    insertar_imagen(
-        model_clip=model_clip,
-        processor_clip=processor_clip,
-        collection=collections["imagenes"],
-        metadata_imagenes=metadata_imagenes
-    )
-    logger.info("\n PROCESAMIENTO TERMINADO")
-    logger.info(f"Base de datos guardada en: {DB_PATH}")"""
-    
-    logger.info("\n RAG MULTIMODAL - ACTUALIZANDO COLECCIÓN DE IMÁGENES \n")
+    Returns:
+        int: Número de imágenes escritas.
+    """
+    if not metadata_imagenes:
+        logger.warning("No se proporcionaron metadatos de imágenes; nada que procesar")
+        return 0
 
-    # Cargar modelos
-    # Cargar modelos
-    _, model_clip, processor_clip = cargar_modelos()  # Ignoramos embeddings de texto porque no tocamos PDFs
+    batch_size = batch_size or IMAGENES_BATCH_SIZE
+    workers = workers or IMAGENES_WORKERS
+    logger.info(f"Procesando {len(metadata_imagenes)} imágenes desde metadatos (lotes de {batch_size}, {workers} hilos)")
 
-    # Conectar con la base de datos
-    client = chromadb.PersistentClient(path=DB_PATH)
+    existentes = []
+    for meta in metadata_imagenes:
+        if ruta_imagen_local(meta).exists():
+            existentes.append(meta)
+        else:
+            logger.warning(f"Imagen no encontrada: {ruta_imagen_local(meta)}")
+
+    tiempos = {"decodificacion": 0.0, "espera_decodificacion": 0.0, "embeddings": 0.0, "escritura": 0.0}
+    insertadas = 0
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for metas, pixel_values in _lotes_preprocesados(existentes, processor_clip, batch_size, pool, tiempos):
+            try:
+                t0 = time.perf_counter()
+                with torch.no_grad():
+                    pixeles = torch.from_numpy(pixel_values).to(model_clip.device)
+                    features = _tensor_caracteristicas(model_clip.get_image_features(pixel_values=pixeles))
+                    # Normalizar embeddings (crucial para CLIP)
+                    features = features / features.norm(p=2, dim=-1, keepdim=True)
+                    embeddings = features.cpu().numpy().tolist()
+                tiempos["embeddings"] += time.perf_counter() - t0
+
+                t0 = time.perf_counter()
+                collection.upsert(
+                    ids=[id_imagen(m["nombre_archivo"]) for m in metas],
+                    embeddings=embeddings,
+                    documents=[m["nombre_archivo"] for m in metas],
+                    metadatas=[{
+                        "pdf_origen": m["pdf_origen"],
+                        "categoria": m.get("categoria", "sin_categoria"),
+                        "pagina": m.get("pagina"),
+                        "nombre_archivo": m["nombre_archivo"],
+                        "ruta_imagen": m["ruta_imagen"],
+                        "paginas": ",".join(str(p) for p in m.get("paginas") or [m.get("pagina")]),
+                        "num_apariciones": len(m.get("apariciones") or [None]),
+                        "tipo": "imagen"
+                    } for m in metas]
+                )
+                tiempos["escritura"] += time.perf_counter() - t0
+                insertadas += len(metas)
+            except Exception as e:
+                logger.error(f"Error procesando lote de imágenes ({metas[0].get('nombre_archivo')}...): {e}")
+
+    total = time.perf_counter() - inicio
+    resumen = {
+        "imagenes": insertadas,
+        "batch_size": batch_size,
+        "workers": workers,
+        "segundos_total": round(total, 3),
+        **{f"segundos_{k}": round(v, 3) for k, v in tiempos.items()},
+        "imagenes_por_segundo": {
+            "decodificacion": round(insertadas / tiempos["decodificacion"], 1) if tiempos["decodificacion"] else None,
+            "embeddings": round(insertadas / tiempos["embeddings"], 1) if tiempos["embeddings"] else None,
+            "escritura": round(insertadas / tiempos["escritura"], 1) if tiempos["escritura"] else None,
+            "total": round(insertadas / total, 1) if total else None
+        }
+    }
+    logger.info(f"[IMAGENES] {insertadas} imágenes en {total:.2f}s ({resumen['imagenes_por_segundo']['total']} img/s)")
+    if estadisticas is not None:
+        estadisticas.update(resumen)
+    return insertadas
+
+def _imagenes_sinteticas(directorio: Path, n: int, lado: int = 256) -> list:
+    """Genera `n` JPEG sintéticos (ruido suave) y sus metadatos con el formato de metadata_imagenes.json."""
+    rng = np.random.default_rng(0)
+    metas = []
+    for i in range(n):
+        nombre = f"sintetica_{i:05d}.jpg"
+        ruta = directorio / nombre
+        base = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        Image.fromarray(base).resize((lado, lado), Image.BILINEAR).save(ruta, quality=85)
+        metas.append({"nombre_archivo": nombre, "ruta_imagen": str(ruta), "pdf_origen": "sintetico.pdf",
+                      "pagina": i, "categoria": "sin_categoria"})
+    return metas
+
+def benchmark_imagenes(n_sinteticas: int = 10000, batch_size: int = None, workers: int = None) -> dict:
+    """
+    Compara el indexado de imágenes uno a uno (lote 1, un hilo) con el indexado por lotes,
+    sobre las imágenes del proyecto y sobre un conjunto sintético. Escribe en colecciones
+    efímeras en memoria, sin tocar la base de datos.
 
-    # Borrar colección de imágenes si existe
-    try:
-        client.delete_collection(COLLECTION_NAME_IMAGENES)
-        logger.info(f"Colección '{COLLECTION_NAME_IMAGENES}' eliminada.")
-    except Exception as e:
-        logger.warning(f"No se pudo eliminar '{COLLECTION_NAME_IMAGENES}': {e}")
+    Returns:
+        dict: {conjunto: {"secuencial": {...}, "lotes": {...}, "aceleracion": float}}
+    """
+    import tempfile
+
+    _, model_clip, processor_clip = cargar_modelos()
+    cliente = chromadb.EphemeralClient()
+    metas_proyecto = funciones_metadatos.obtener_almacen().imagenes()
+
+    resultados = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        conjuntos = {"proyecto": metas_proyecto}
+        if n_sinteticas:
+            logger.info(f"[BENCHMARK] Generando {n_sinteticas} imágenes sintéticas...")
+            conjuntos[f"sintetico_{n_sinteticas}"] = _imagenes_sinteticas(Path(tmp), n_sinteticas)
+
+        for nombre, metas in conjuntos.items():
+            resultados[nombre] = {}
+            for modo, bs, nw in (("secuencial", 1, 1), ("lotes", batch_size, workers)):
+                coleccion = cliente.get_or_create_collection(f"bench_{nombre}_{modo}")
+                stats = {}
+                insertar_imagen(model_clip, processor_clip, coleccion, metas, batch_size=bs, workers=nw, estadisticas=stats)
+                cliente.delete_collection(coleccion.name)
+                resultados[nombre][modo] = stats
+            seq, lot = resultados[nombre]["secuencial"]["segundos_total"], resultados[nombre]["lotes"]["segundos_total"]
+            resultados[nombre]["aceleracion"] = round(seq / lot, 2) if lot else None
+
+    logger.info("\n BENCHMARK INDEXADO DE IMÁGENES \n" + json.dumps(resultados, indent=2, ensure_ascii=False))
+    return resultados
 
-    # Crear nueva colección de imágenes
-    collection_imagenes = client.create_collection(COLLECTION_NAME_IMAGENES)
-    logger.info(f"Colección '{COLLECTION_NAME_IMAGENES}' creada de nuevo.")
+def main():
+    """
+    Indexa los PDFs e imágenes en ChromaDB.
 
-    # Cargar metadatos de imágenes
-    metadata_imagenes = []
-    try:
-        with open("data/metadata_imagenes.json", "r", encoding="utf-8") as f:
-            metadata_imagenes = json.load(f)
-    except FileNotFoundError:
-        logger.warning("No se encontró data/metadata_imagenes.json; no se procesarán imágenes")
-        return
-    except json.JSONDecodeError:
-        logger.error("Error al parsear data/metadata_imagenes.json; no se procesarán imágenes")
+    Por defecto la ingesta es incremental (solo ficheros nuevos, modificados o eliminados
+    según el manifiesto). Con --completo se reconstruye todo en una versión nueva de las
+    colecciones, que se activa al terminar sin interrumpir a la API.
+    """
+    import argparse
+    from utilidades import funciones_indexado
+
+    parser = argparse.ArgumentParser(description="Ingesta de PDFs e imágenes en ChromaDB")
+    parser.add_argument("--dry-run", action="store_true", help="Solo muestra qué cambiaría")
+    parser.add_argument("--completo", action="store_true", help="Reconstruye todo en una versión nueva y la activa al terminar")
+    parser.add_argument("--benchmark-imagenes", type=int, metavar="N", default=None,
+                        help="Mide img/s por etapa (uno a uno vs. por lotes) con las imágenes del proyecto y N sintéticas")
+    args = parser.parse_args()
+
+    if args.benchmark_imagenes is not None:
+        benchmark_imagenes(n_sinteticas=args.benchmark_imagenes)
         return
 
-    # Procesar e insertar imágenes usando CLIP
-    logger.info("\nProcesando imágenes...")
-    insertar_imagen(
-        model_clip=model_clip,
-        processor_clip=processor_clip,
-        collection=collection_imagenes,
-        metadata_imagenes=metadata_imagenes
-    )
-
-    logger.info("\nPROCESAMIENTO TERMINADO")
+    logger.info("\n RAG MULTIMODAL - INDEXANDO LA BASE DE DATOS \n")
+    funciones_indexado.indexar(dry_run=args.dry_run, completo=args.completo)
     logger.info(f"Base de datos guardada en: {DB_PATH}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -4,7 +4,7 @@ import logging
 import random
 import time
 import json
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from utilidades import prompts, utils
 
 logger = logging.getLogger("evaluacion_rag")
@@ -142,7 +142,7 @@ def crear_golden_set_automatico(collection, client_llm, model_name: str, num_pre
                 "texto_original": texto[:200],
                 "metadata": {
                     "source": meta.get('source', 'unknown'),
-                    "category": meta.get('category', 'General')
+                    "category": meta.get('categoria') or meta.get('category', 'General')
                 }
             }
             golden_set.append(entry)
@@ -226,4 +226,90 @@ def evaluar_retrieval(collection, model_emb, golden_set, top_k: int = 3):
     hit_rate = aciertos / total if total > 0 else 0
     mrr = mrr_sum / total if total > 0 else 0
     
-    return hit_rate, mrr
\ No newline at end of file
+    return hit_rate, mrr
+
+
+def _acierto_y_rr(recuperados_ids: List[str], target_ids: List[str]) -> Tuple[bool, float]:
+    """(acierto, rango recíproco del primer acierto) de una consulta."""
+    for rank, rid in enumerate(recuperados_ids):
+        if rid in target_ids:
+            return True, 1.0 / (rank + 1)
+    return False, 0.0
+
+
+def evaluar_retrieval_modos(collection, model_emb, indice_bm25, golden_set, top_k: int = 3,
+                            candidatos: int = 10) -> dict:
+    """
+    Hit rate y MRR del golden set con búsqueda densa, léxica (BM25) e híbrida (RRF de ambas).
+
+    Args:
+        collection: Colección de PDFs de ChromaDB.
+        model_emb: Modelo de embeddings.
+        indice_bm25: Índice léxico (funciones_bm25.IndiceBM25).
+        golden_set: Lista de casos de prueba {query, relevant_ids}.
+        top_k (int): Documentos que se evalúan por consulta.
+        candidatos (int): Candidatos de cada buscador que entran en la fusión.
+
+    Returns:
+        dict: {"denso": {...}, "lexico": {...}, "hibrido": {...}} con hit_rate y mrr.
+    """
+    from utilidades.funciones_bm25 import fusion_rrf
+
+    sumas = {modo: [0, 0.0] for modo in ("denso", "lexico", "hibrido")}
+    for item in golden_set:
+        pregunta, target_ids = item.get("query"), item.get("relevant_ids", [])
+        denso = collection.query(
+            query_embeddings=utils.generar_embeddings(model_emb, [pregunta]), n_results=candidatos
+        )["ids"][0]
+        lexico = [id_ for id_, _ in indice_bm25.buscar(pregunta, k=candidatos)]
+        rankings = {
+            "denso": denso[:top_k],
+            "lexico": lexico[:top_k],
+            "hibrido": [id_ for id_, _ in fusion_rrf([denso, lexico])][:top_k]
+        }
+        for modo, ids in rankings.items():
+            acierto, rr = _acierto_y_rr(ids, target_ids)
+            sumas[modo][0] += acierto
+            sumas[modo][1] += rr
+
+    total = len(golden_set)
+    return {
+        modo: {"hit_rate": aciertos / total if total else 0, "mrr": rr / total if total else 0}
+        for modo, (aciertos, rr) in sumas.items()
+    }
+
+
+def evaluar_retrieval_backends(backends: dict, model_emb, golden_set, top_k: int = 3) -> dict:
+    """
+    Hit rate, MRR y latencia de búsqueda (sin contar el embedding) del golden set con varios
+    backends vectoriales sobre los mismos datos (p. ej. exacto, int8 y binario).
+
+    Args:
+        backends (dict): {nombre: backend con `query` como una colección de Chroma}.
+        model_emb: Modelo de embeddings.
+        golden_set: Lista de casos de prueba {query, relevant_ids}.
+        top_k (int): Documentos que se evalúan por consulta.
+
+    Returns:
+        dict: {nombre: {"hit_rate", "mrr", "p50_ms", "p95_ms"}}
+    """
+    import numpy as np
+
+    embeddings = utils.generar_embeddings(model_emb, [item.get("query") for item in golden_set])
+    total, informe = len(golden_set), {}
+    for nombre, backend in backends.items():
+        aciertos, rr_total, latencias = 0, 0.0, []
+        for item, emb in zip(golden_set, embeddings):
+            t0 = time.perf_counter()
+            ids = backend.query(query_embeddings=[emb], n_results=top_k, include=[])["ids"][0]
+            latencias.append(time.perf_counter() - t0)
+            acierto, rr = _acierto_y_rr(ids, item.get("relevant_ids", []))
+            aciertos += acierto
+            rr_total += rr
+        informe[nombre] = {
+            "hit_rate": aciertos / total if total else 0,
+            "mrr": rr_total / total if total else 0,
+            "p50_ms": round(1000 * float(np.percentile(latencias, 50)), 3) if latencias else None,
+            "p95_ms": round(1000 * float(np.percentile(latencias, 95)), 3) if latencias else None
+        }
+    return informe
@@ -0,0 +1,262 @@
+"""
+Colecciones fragmentadas por categoría.
+
+Con FRAGMENTAR_POR_CATEGORIA=true cada colección (PDFs e imágenes) es una colección
+"ancla" vacía más un fragmento por categoría (`<nombre>__cat_<categoria>`). La ingesta
+escribe cada registro en el fragmento de su metadato `categoria`; una consulta con
+`where={"categoria": X}` solo recorre el HNSW de ese fragmento, en lugar de filtrar a
+posteriori un grafo con todas las categorías. Sin categoría ("otros", reintentos) se hace
+scatter-gather: se consulta cada fragmento en paralelo y se fusiona por distancia.
+
+`ColeccionFragmentada` expone los métodos de `chromadb.Collection` que usa el proyecto,
+así que ingesta, BM25, router, evaluación y exportación no cambian. Una colección ancla
+con datos (versiones anteriores a la fragmentación) se sigue usando tal cual.
+"""
+
+import os
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from loguru import logger
+
+load_dotenv()
+
+FRAGMENTAR_POR_CATEGORIA = os.getenv("FRAGMENTAR_POR_CATEGORIA", "true").lower() == "true"
+FRAGMENTOS_WORKERS = int(os.getenv("FRAGMENTOS_WORKERS", "8"))
+CLAVE_CATEGORIA = "categoria"
+SIN_CATEGORIA = "sin_categoria"
+SUFIJO = "__cat_"
+
+_pool = ThreadPoolExecutor(max_workers=FRAGMENTOS_WORKERS, thread_name_prefix="fragmentos")
+
+
+def nombre_fragmento(base: str, categoria: str) -> str:
+    """Nombre de la colección de una categoría (solo caracteres válidos para Chroma)."""
+    ascii_ = unicodedata.normalize("NFKD", categoria).encode("ascii", "ignore").decode()
+    return f"{base}{SUFIJO}{re.sub(r'[^A-Za-z0-9_-]', '_', ascii_) or SIN_CATEGORIA}"
+
+
+def _nombres(client) -> List[str]:
+    # Según la versión de chromadb, list_collections devuelve nombres u objetos Collection
+    return [getattr(c, "name", c) for c in client.list_collections()]
+
+
+def nombres_fragmentos(client, base: str) -> List[str]:
+    return sorted(n for n in _nombres(client) if n.startswith(base + SUFIJO))
+
+
+def borrar_coleccion(client, nombre: str) -> None:
+    """Borra una colección y sus fragmentos (los que no existan se ignoran)."""
+    for n in [nombre] + nombres_fragmentos(client, nombre):
+        try:
+            client.delete_collection(n)
+        except Exception as e:
+            logger.warning(f"[FRAGMENTOS] No se encontraba la colección '{n}': {e}")
+
+
+def abrir_coleccion(client, nombre: str, crear: bool = False, metadata: Optional[dict] = None):
+    """
+    Colección de un tipo: fragmentada por categoría o, si la fragmentación está desactivada
+    o el ancla tiene datos (colección sin fragmentar), la propia colección.
+    Los fragmentos se crean con los metadatos del ancla (parámetros HNSW incluidos).
+    """
+    ancla = client.get_or_create_collection(nombre, metadata=metadata or None) if crear else client.get_collection(nombre)
+    if not FRAGMENTAR_POR_CATEGORIA or ancla.count() > 0:
+        return ancla
+    return ColeccionFragmentada(client, ancla)
+
+
+def _concatenar(partes: List[dict]) -> dict:
+    """Une resultados de `get` de varios fragmentos."""
+    if not partes:
+        return {"ids": [], "documents": [], "metadatas": [], "embeddings": None}
+    res = dict(partes[0])
+    for clave, valor in partes[0].items():
+        if isinstance(valor, np.ndarray):
+            res[clave] = np.concatenate([p[clave] for p in partes if len(p[clave])]) if any(len(p[clave]) for p in partes) else valor
+        elif isinstance(valor, list) and clave != "included":
+            res[clave] = [x for p in partes for x in (p.get(clave) or [])]
+    return res
+
+
+class ColeccionFragmentada:
+    """Un fragmento (colección de Chroma) por categoría detrás de la interfaz de una sola colección."""
+
+    def __init__(self, client, ancla):
+        self._client = client
+        self._ancla = ancla
+        self.name = ancla.name
+        self.metadata = ancla.metadata
+        self._lock = threading.Lock()
+        self._fragmentos: Dict[str, object] = {}
+        self.descubrir()
+
+    def descubrir(self) -> None:
+        """Abre los fragmentos existentes (p. ej. creados por otro proceso de ingesta)."""
+        prefijo = self.name + SUFIJO
+        for nombre in nombres_fragmentos(self._client, self.name):
+            col = self._client.get_collection(nombre)
+            categoria = (col.metadata or {}).get(CLAVE_CATEGORIA, nombre[len(prefijo):])
+            with self._lock:
+                self._fragmentos.setdefault(categoria, col)
+
+    @property
+    def id(self) -> str:
+        with self._lock:
+            return "+".join(str(c.id) for _, c in sorted(self._fragmentos.items())) or str(self._ancla.id)
+
+    @property
+    def partes(self) -> list:
+        """El ancla y todos los fragmentos."""
+        return [self._ancla] + list(self.fragmentos.values())
+
+    @property
+    def fragmentos(self) -> Dict[str, object]:
+        """{categoria: colección} en orden estable."""
+        with self._lock:
+            return dict(sorted(self._fragmentos.items()))
+
+    def _fragmento(self, categoria: str):
+        with self._lock:
+            col = self._fragmentos.get(categoria)
+            if col is None:
+                col = self._client.get_or_create_collection(
+                    nombre_fragmento(self.name, categoria), metadata={**(self.metadata or {}), CLAVE_CATEGORIA: categoria}
+                )
+                self._fragmentos[categoria] = col
+                logger.info(f"[FRAGMENTOS] Creado el fragmento '{col.name}'")
+            return col
+
+    # ---------- Escritura ----------
+
+    def _escribir(self, metodo: str, ids: List[str], metadatas: Optional[List[dict]] = None, **columnas) -> None:
+        grupos = defaultdict(list)
+        for i in range(len(ids)):
+            meta = metadatas[i] if metadatas else None
+            grupos[(meta or {}).get(CLAVE_CATEGORIA) or SIN_CATEGORIA].append(i)
+        for categoria, pos in grupos.items():
+            kwargs = {k: [v[i] for i in pos] for k, v in columnas.items() if v is not None}
+            if metadatas:
+                kwargs["metadatas"] = [metadatas[i] for i in pos]
+            getattr(self._fragmento(categoria), metodo)(ids=[ids[i] for i in pos], **kwargs)
+
+    def upsert(self, ids, embeddings=None, metadatas=None, documents=None, **kwargs) -> None:
+        """
+        Upsert en el fragmento de la categoría de cada registro. Un registro que cambia de
+        categoría no se borra del fragmento anterior: la ingesta borra por `source` antes.
+        """
+        self._escribir("upsert", ids, metadatas, embeddings=embeddings, documents=documents, **kwargs)
+
+    def add(self, ids, embeddings=None, metadatas=None, documents=None, **kwargs) -> None:
+        self._escribir("add", ids, metadatas, embeddings=embeddings, documents=documents, **kwargs)
+
+    def update(self, ids, embeddings=None, metadatas=None, documents=None) -> None:
+        """Actualiza cada id en el fragmento que lo contiene (la categoría no se mueve)."""
+        posicion = {id_: i for i, id_ in enumerate(ids)}
+        for col in self.fragmentos.values():
+            pos = [posicion[i] for i in col.get(ids=list(ids), include=[])["ids"]]
+            if not pos:
+                continue
+            kwargs = {k: [v[i] for i in pos] for k, v in
+                      (("embeddings", embeddings), ("metadatas", metadatas), ("documents", documents)) if v is not None}
+            col.update(ids=[ids[i] for i in pos], **kwargs)
+
+    def delete(self, ids=None, where=None) -> None:
+        destinos, resto = self._destinos(where)
+        if where and resto is None and ids is None:
+            # Borrar una categoría entera
+            for col in destinos:
+                ids_col = col.get(include=[])["ids"]
+                if ids_col:
+                    col.delete(ids=ids_col)
+            return
+        for col in destinos:
+            col.delete(ids=ids, where=resto)
+
+    # ---------- Lectura ----------
+
+    def _destinos(self, where: Optional[dict]) -> Tuple[list, Optional[dict]]:
+        """Fragmentos que pueden cumplir `where` y el resto del filtro, sin la condición de categoría."""
+        fragmentos = self.fragmentos
+        if not where:
+            return list(fragmentos.values()), None
+        condiciones = list(where["$and"]) if "$and" in where else [where]
+        for i, cond in enumerate(condiciones):
+            if set(cond) != {CLAVE_CATEGORIA}:
+                continue
+            valor = cond[CLAVE_CATEGORIA]
+            if not isinstance(valor, dict):
+                categorias = [valor]
+            elif "$eq" in valor:
+                categorias = [valor["$eq"]]
+            elif "$in" in valor:
+                categorias = list(valor["$in"])
+            else:
+                continue  # $ne / $nin: se filtra dentro de cada fragmento
+            resto = condiciones[:i] + condiciones[i + 1:]
+            resto = None if not resto else resto[0] if len(resto) == 1 else {"$and": resto}
+            return [fragmentos[c] for c in categorias if c in fragmentos], resto
+        return list(fragmentos.values()), where
+
+    def count(self) -> int:
+        return sum(col.count() for col in self.fragmentos.values())
+
+    def contar_por_fragmento(self) -> Dict[str, int]:
+        return {cat: col.count() for cat, col in self.fragmentos.items()}
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=None) -> dict:
+        destinos, resto = self._destinos(where)
+        kwargs = {"include": include} if include is not None else {}
+        if ids is None and (limit is not None or offset):
+            # Paginación sobre los fragmentos en orden estable
+            partes, saltar, quedan = [], offset or 0, limit
+            for col in destinos:
+                n = col.count() if resto is None else len(col.get(where=resto, include=[])["ids"])
+                if saltar >= n:
+                    saltar -= n
+                    continue
+                parte = col.get(where=resto, limit=quedan, offset=saltar, **kwargs)
+                partes.append(parte)
+                saltar = 0
+                if quedan is not None:
+                    quedan -= len(parte["ids"])
+                    if quedan <= 0:
+                        break
+            return _concatenar(partes)
+        return _concatenar(list(_pool.map(lambda col: col.get(ids=ids, where=resto, **kwargs), destinos)))
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[dict] = None,
+              include: Optional[List[str]] = None, **kwargs) -> dict:
+        """Consulta el fragmento de la categoría filtrada o, si no hay una, todos en paralelo (scatter-gather)."""
+        destinos, resto = self._destinos(where)
+        include = list(include) if include is not None else ["metadatas", "documents", "distances"]
+        if len(destinos) == 1:
+            return destinos[0].query(query_embeddings=query_embeddings, n_results=n_results, where=resto,
+                                     include=include, **kwargs)
+
+        n_consultas = len(query_embeddings)
+        claves = [c for c in ("documents", "metadatas", "embeddings", "distances") if c in include]
+        destinos = [col for col in destinos if col.count()]
+        if not destinos:
+            return {"ids": [[] for _ in range(n_consultas)], **{c: [[] for _ in range(n_consultas)] for c in claves}}
+        con_distancias = include if "distances" in include else include + ["distances"]
+        parciales = list(_pool.map(
+            lambda col: col.query(query_embeddings=query_embeddings, n_results=min(n_results, col.count()),
+                                  where=resto, include=con_distancias, **kwargs),
+            destinos
+        ))
+
+        res = {"ids": [], **{c: [] for c in claves}}
+        for j in range(n_consultas):
+            candidatos = sorted(
+                (dist, f, i) for f, p in enumerate(parciales) for i, dist in enumerate(p["distances"][j])
+            )[:n_results]
+            res["ids"].append([parciales[f]["ids"][j][i] for _, f, i in candidatos])
+            for c in claves:
+                res[c].append([parciales[f][c][j][i] for _, f, i in candidatos])
+        return res
@@ -0,0 +1,216 @@
+"""
+Ajuste automático de los parámetros HNSW de Chroma (M, construction_ef, search_ef).
+
+Copia los embeddings de la colección de PDFs servida a colecciones temporales, una por
+combinación de parámetros, y mide sobre el golden set: hit rate, MRR, recall@k frente a
+la búsqueda exacta, latencia p50/p95 de `query` y tamaño en disco del índice. Elige la
+combinación más rápida (p95) cuyo hit rate y MRR no bajan más de una tolerancia respecto a
+la mejor, guarda el informe y escribe los valores elegidos en el .env (HNSW_M,
+HNSW_CONSTRUCTION_EF, HNSW_SEARCH_EF), que usan `crear_db` y el registro de colecciones.
+
+M y construction_ef solo afectan a colecciones nuevas (funciones_indexado.py --completo);
+search_ef se aplica a las existentes en la siguiente ingesta o, sin esperar, con --aplicar
+(requiere chromadb 1.x, que admite cambiar `ef_search` con `modify(configuration=...)`).
+
+Uso:
+    python src/utilidades/funciones_hnsw.py
+    python src/utilidades/funciones_hnsw.py --aplicar
+    python src/utilidades/funciones_hnsw.py --m 8 16 32 --construction-ef 100 200 --search-ef 10 50 100 --no-escribir
+"""
+
+import itertools
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+import numpy as np
+from dotenv import load_dotenv, set_key
+from loguru import logger
+from utilidades import utils
+
+load_dotenv()
+
+INFORME_FILE = utils.project_root() / "data" / "ajuste_hnsw.json"
+ENV_FILE = utils.project_root() / ".env"
+LOTE = 5000
+
+
+def _tamano_directorio(ruta: Path) -> int:
+    return sum(f.stat().st_size for f in Path(ruta).rglob("*") if f.is_file())
+
+
+def cargar_vectores(collection) -> tuple:
+    """(ids, matriz float32) de una colección, leída por lotes."""
+    ids, partes = [], []
+    for desde in range(0, collection.count(), LOTE):
+        datos = collection.get(include=["embeddings"], limit=LOTE, offset=desde)
+        ids.extend(datos["ids"])
+        partes.append(np.asarray(datos["embeddings"], dtype=np.float32))
+    dim = partes[0].shape[1] if partes else 0
+    return ids, (np.concatenate(partes) if partes else np.zeros((0, dim), dtype=np.float32))
+
+
+def evaluar_combinacion(ids: List[str], matriz: np.ndarray, consultas: np.ndarray, relevantes: List[List[str]],
+                        m: int, construction_ef: int, search_ef: int, top_k: int = 3, espacio: str = "l2") -> dict:
+    """
+    Construye un índice temporal con (M, construction_ef, search_ef) y lo mide con las consultas del golden set.
+
+    Returns:
+        dict: Parámetros, hit_rate, mrr, recall@top_k (frente a la búsqueda exacta),
+            p50_ms, p95_ms, tamano_mb y construccion_s.
+    """
+    import chromadb
+
+    # Vecinos exactos de referencia para el recall (mismo espacio que la colección)
+    if espacio == "l2":
+        distancias = (matriz ** 2).sum(axis=1)[None, :] - 2 * consultas @ matriz.T
+    else:
+        normas = np.linalg.norm(matriz, axis=1) if espacio == "cosine" else 1.0
+        distancias = -(consultas @ matriz.T) / normas
+    exactos = [set(ids[i] for i in np.argsort(fila, kind="stable")[:top_k]) for fila in distancias]
+
+    directorio = Path(tempfile.mkdtemp(prefix="hnsw_"))
+    try:
+        cliente = chromadb.PersistentClient(path=str(directorio))
+        col = cliente.create_collection("ajuste", metadata={
+            "hnsw:space": espacio, "hnsw:M": m, "hnsw:construction_ef": construction_ef, "hnsw:search_ef": search_ef
+        })
+        t0 = time.perf_counter()
+        for desde in range(0, len(ids), LOTE):
+            col.add(ids=ids[desde:desde + LOTE], embeddings=matriz[desde:desde + LOTE])
+        construccion = time.perf_counter() - t0
+
+        aciertos, rr_total, recall, latencias = 0, 0.0, 0, []
+        for q, objetivo, exacto in zip(consultas, relevantes, exactos):
+            t0 = time.perf_counter()
+            recuperados = col.query(query_embeddings=q[None, :], n_results=top_k, include=[])["ids"][0]
+            latencias.append(time.perf_counter() - t0)
+            rangos = [r for r, id_ in enumerate(recuperados) if id_ in objetivo]
+            aciertos += bool(rangos)
+            rr_total += 1.0 / (rangos[0] + 1) if rangos else 0.0
+            recall += len(exacto & set(recuperados))
+        cliente.clear_system_cache()
+        total = max(len(consultas), 1)
+        return {
+            "M": m, "construction_ef": construction_ef, "search_ef": search_ef,
+            "hit_rate": round(aciertos / total, 4),
+            "mrr": round(rr_total / total, 4),
+            f"recall@{top_k}": round(recall / (total * top_k), 4),
+            "p50_ms": round(1000 * float(np.percentile(latencias, 50)), 3) if latencias else None,
+            "p95_ms": round(1000 * float(np.percentile(latencias, 95)), 3) if latencias else None,
+            "tamano_mb": round(_tamano_directorio(directorio) / 2**20, 2),
+            "construccion_s": round(construccion, 2)
+        }
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def elegir(resultados: List[dict], tolerancia: float = 0.01) -> Optional[dict]:
+    """
+    La combinación con menor p95 entre las que no pierden más de `tolerancia` de hit rate
+    ni de MRR respecto a la mejor (a igualdad, la de índice más pequeño).
+    """
+    if not resultados:
+        return None
+    mejor_hit = max(r["hit_rate"] for r in resultados)
+    mejor_mrr = max(r["mrr"] for r in resultados)
+    validos = [r for r in resultados if r["hit_rate"] >= mejor_hit - tolerancia and r["mrr"] >= mejor_mrr - tolerancia]
+    return min(validos, key=lambda r: (r["p95_ms"], r["tamano_mb"]))
+
+
+def ajustar(rejilla_m: List[int], rejilla_construction: List[int], rejilla_search: List[int],
+            top_k: int = 3, tolerancia: float = 0.01, escribir: bool = True) -> dict:
+    """
+    Barrido de parámetros sobre el golden set con los embeddings de la colección de PDFs servida.
+
+    Returns:
+        dict: {"resultados": [...], "elegida": {...}, "vectores", "consultas", "fecha"}
+    """
+    from datetime import datetime
+    from sentence_transformers import SentenceTransformer
+    from utilidades import funciones_db, funciones_evaluacion
+
+    with open(funciones_evaluacion.GOLDEN_SET_FILE, "r", encoding="utf-8") as f:
+        golden_set = [json.loads(line) for line in f if line.strip()]
+    if not golden_set:
+        raise ValueError("El golden set está vacío.")
+
+    collection = funciones_db.obtener_coleccion("pdfs")
+    espacio = (collection.metadata or {}).get("hnsw:space", "l2")
+    ids, matriz = cargar_vectores(collection)
+    model_emb = SentenceTransformer(funciones_db.MODELO_EMBEDDINGS, device="cpu")
+    consultas = np.asarray(
+        utils.generar_embeddings(model_emb, [item["query"] for item in golden_set], usar_cache=False), dtype=np.float32
+    )
+    relevantes = [item.get("relevant_ids", []) for item in golden_set]
+    logger.info(f"[HNSW] {len(ids)} vectores, {len(consultas)} preguntas del golden set, espacio '{espacio}'")
+
+    resultados = []
+    for m, construction_ef, search_ef in itertools.product(rejilla_m, rejilla_construction, rejilla_search):
+        resultado = evaluar_combinacion(ids, matriz, consultas, relevantes, m, construction_ef, search_ef,
+                                        top_k=top_k, espacio=espacio)
+        logger.info(f"[HNSW] {resultado}")
+        resultados.append(resultado)
+
+    elegida = elegir(resultados, tolerancia)
+    informe = {
+        "fecha": datetime.now().isoformat(), "vectores": len(ids), "consultas": len(consultas),
+        "tolerancia": tolerancia, "resultados": resultados, "elegida": elegida
+    }
+    utils.escribir_json_atomico(INFORME_FILE, informe)
+
+    if escribir and elegida:
+        ENV_FILE.touch(exist_ok=True)
+        for variable, clave in (("HNSW_M", "M"), ("HNSW_CONSTRUCTION_EF", "construction_ef"),
+                                ("HNSW_SEARCH_EF", "search_ef")):
+            set_key(str(ENV_FILE), variable, str(elegida[clave]), quote_mode="never")
+        logger.info(f"[HNSW] Configuración escrita en {ENV_FILE}: {elegida}")
+    return informe
+
+
+def aplicar(search_ef: Optional[int] = None) -> dict:
+    """
+    Fija search_ef (por defecto, HNSW_SEARCH_EF) en las colecciones de la versión activa.
+
+    Returns:
+        dict: {tipo: ef_search de cada parte de la colección tras el cambio}
+    """
+    from utilidades import funciones_db, funciones_fragmentos
+
+    aplicado = {}
+    for tipo in funciones_db.NOMBRES_COLECCIONES:
+        coleccion = funciones_db.obtener_coleccion(tipo)
+        funciones_db.aplicar_search_ef(coleccion, search_ef)
+        partes = coleccion.partes if isinstance(coleccion, funciones_fragmentos.ColeccionFragmentada) else [coleccion]
+        aplicado[tipo] = {col.name: funciones_db.search_ef_actual(col) for col in partes}
+    return aplicado
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Ajuste de parámetros HNSW con el golden set")
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--construction-ef", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--search-ef", type=int, nargs="+", default=[10, 25, 50, 100])
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--tolerancia", type=float, default=0.01, help="Pérdida máxima de hit rate y MRR frente a la mejor")
+    parser.add_argument("--no-escribir", action="store_true", help="Solo mide; no toca el .env")
+    parser.add_argument("--aplicar", action="store_true",
+                        help="No mide: fija HNSW_SEARCH_EF (o el único --search-ef indicado) en las colecciones servidas")
+    args = parser.parse_args()
+
+    if args.aplicar:
+        search_ef = args.search_ef[0] if len(args.search_ef) == 1 else None
+        logger.info("\n SEARCH_EF APLICADO \n" + json.dumps(aplicar(search_ef), indent=2))
+        return
+
+    informe = ajustar(args.m, args.construction_ef, args.search_ef, top_k=args.top_k,
+                      tolerancia=args.tolerancia, escribir=not args.no_escribir)
+    logger.info("\n AJUSTE HNSW \n" + json.dumps({k: v for k, v in informe.items() if k != "resultados"}, indent=2))
+    logger.info(f"Informe completo en {INFORME_FILE}")
+
+
+if __name__ == "__main__":
+    main()
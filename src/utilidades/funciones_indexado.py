@@ -0,0 +1,264 @@
+"""
+Ingesta incremental basada en hashes.
+
+Un manifiesto guarda, para cada PDF e imagen indexados, el hash de su contenido y la
+versión del chunker/modelo con la que se indexó. En cada ejecución solo se procesan
+los ficheros nuevos o modificados y se borran los chunks de los eliminados.
+
+La reconstrucción completa (--completo) no toca las colecciones que sirve la API:
+construye una versión nueva (colecciones `<nombre>__<version>` con su propio almacén de
+padres y manifiesto) y al terminar cambia el alias de forma atómica. Las versiones
+anteriores se conservan para volver atrás (--activar / --rollback).
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+from loguru import logger
+from utilidades import utils, funciones_db, funciones_padres, funciones_ingesta, funciones_metadatos, funciones_bm25, funciones_vectores
+from utilidades import funciones_preprocesado
+
+NOMBRE_MANIFIESTO = funciones_db.NOMBRE_MANIFIESTO
+RUTA_MANIFIESTO = Path(funciones_db.DB_PATH or "chromadb/") / NOMBRE_MANIFIESTO
+LOTE_BORRADO = 500
+
+
+def ruta_manifiesto(version: Optional[str] = None) -> Path:
+    """Manifiesto de una versión de las colecciones (None = colecciones sin versionar)."""
+    return funciones_db.directorio_version(version) / NOMBRE_MANIFIESTO
+
+
+def cargar_manifiesto(ruta: Path = RUTA_MANIFIESTO) -> dict:
+    if not ruta.exists():
+        return {"pdfs": {}, "imagenes": {}}
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            manifiesto = json.load(f)
+    except json.JSONDecodeError:
+        logger.error(f"Manifiesto corrupto en {ruta}; se tratará todo como nuevo.")
+        return {"pdfs": {}, "imagenes": {}}
+    manifiesto.setdefault("pdfs", {})
+    manifiesto.setdefault("imagenes", {})
+    return manifiesto
+
+
+def guardar_manifiesto(manifiesto: dict, ruta: Path = RUTA_MANIFIESTO) -> None:
+    """Escritura atómica (temporal + rename) para no dejar un manifiesto a medias."""
+    utils.escribir_json_atomico(ruta, manifiesto)
+
+
+def _version_pdfs() -> dict:
+    return {"version_chunker": funciones_ingesta.version_ingesta(), "modelo": funciones_db.MODELO_EMBEDDINGS}
+
+
+def _version_imagenes() -> dict:
+    return {"modelo": funciones_db.MODELO_CLIP}
+
+
+def _clasificar(actuales: Dict[str, str], anteriores: dict, version: dict) -> dict:
+    """Compara {nombre: hash} actual con el manifiesto y agrupa los cambios."""
+    plan = {"nuevos": [], "modificados": [], "eliminados": [], "sin_cambios": []}
+    for nombre, h in sorted(actuales.items()):
+        previo = anteriores.get(nombre)
+        if previo is None:
+            plan["nuevos"].append(nombre)
+        elif previo.get("hash") != h or any(previo.get(k) != v for k, v in version.items()):
+            plan["modificados"].append(nombre)
+        else:
+            plan["sin_cambios"].append(nombre)
+    plan["eliminados"] = sorted(set(anteriores) - set(actuales))
+    return plan
+
+
+def planificar(manifiesto: dict, metadata_imagenes: List[dict]) -> dict:
+    """
+    Calcula qué PDFs e imágenes hay que indexar o borrar.
+
+    Returns:
+        dict: {"pdfs": plan, "imagenes": plan, "hashes": {...}}
+    """
+    hashes_pdfs = {p.name: utils.hash_fichero(p) for p in funciones_db.PDFS_DIR.glob("*.pdf")}
+
+    hashes_imagenes = {}
+    for meta in metadata_imagenes:
+        ruta = funciones_db.ruta_imagen_local(meta)
+        if ruta.exists():
+            hashes_imagenes[meta["nombre_archivo"]] = utils.hash_fichero(ruta)
+
+    return {
+        "pdfs": _clasificar(hashes_pdfs, manifiesto["pdfs"], _version_pdfs()),
+        "imagenes": _clasificar(hashes_imagenes, manifiesto["imagenes"], _version_imagenes()),
+        "hashes": {"pdfs": hashes_pdfs, "imagenes": hashes_imagenes}
+    }
+
+
+def informe(plan: dict) -> str:
+    """Resumen legible de los cambios planificados."""
+    lineas = []
+    for tipo in ("pdfs", "imagenes"):
+        p = plan[tipo]
+        lineas.append(
+            f"[{tipo.upper()}] nuevos={len(p['nuevos'])} modificados={len(p['modificados'])} "
+            f"eliminados={len(p['eliminados'])} sin_cambios={len(p['sin_cambios'])}"
+        )
+        for clave, signo in (("nuevos", "+"), ("modificados", "~"), ("eliminados", "-")):
+            lineas.extend(f"   {signo} {nombre}" for nombre in p[clave])
+    return "\n".join(lineas)
+
+
+def indexar(dry_run: bool = False, completo: bool = False, activar: bool = True) -> dict:
+    """
+    Ejecuta la ingesta incremental sobre la versión activa o, con `completo`, construye
+    una versión nueva desde cero.
+
+    Args:
+        dry_run (bool): Solo calcula y muestra el plan, sin tocar la base de datos.
+        completo (bool): Reconstruye todo en una versión nueva de las colecciones.
+        activar (bool): Con `completo`, activa la versión nueva al terminar y purga las antiguas.
+
+    Returns:
+        dict: El plan calculado (con la versión sobre la que se ha trabajado).
+    """
+    version = funciones_db.nueva_version() if completo else funciones_db.version_activa()
+    directorio = funciones_db.directorio_version(version)
+    manifiesto = {"pdfs": {}, "imagenes": {}} if completo else cargar_manifiesto(ruta_manifiesto(version))
+    metadatos = funciones_metadatos.obtener_almacen()
+    metadata_imagenes = metadatos.imagenes()
+
+    plan = planificar(manifiesto, metadata_imagenes)
+    plan["version"] = version
+    logger.info(f"[VERSIONES] {'Nueva versión' if completo else 'Versión activa'}: {version or 'sin versionar'}")
+    logger.info("\n" + informe(plan))
+    if dry_run:
+        logger.info("Dry-run: no se ha modificado nada.")
+        return plan
+
+    # La caché de extracción va por hash de contenido: solo sirve la de los PDFs actuales
+    funciones_preprocesado.podar_cache_extraccion(plan["hashes"]["pdfs"].values())
+
+    trabajo_pdfs = plan["pdfs"]["nuevos"] + plan["pdfs"]["modificados"]
+    trabajo_imagenes = plan["imagenes"]["nuevos"] + plan["imagenes"]["modificados"]
+    # Los "nuevos" también se borran: la colección puede tener filas suyas que el manifiesto no
+    # conoce (índices anteriores al manifiesto, con ids uuid4 en las imágenes o metadatos que
+    # ya no se usan, o una ejecución interrumpida antes de guardarlo). Si no hay nada, no cuesta.
+    borrar_pdfs = plan["pdfs"]["nuevos"] + plan["pdfs"]["modificados"] + plan["pdfs"]["eliminados"]
+    borrar_imagenes = plan["imagenes"]["nuevos"] + plan["imagenes"]["modificados"] + plan["imagenes"]["eliminados"]
+    if not (trabajo_pdfs or trabajo_imagenes or borrar_pdfs or borrar_imagenes):
+        logger.info("Índice al día; nada que hacer.")
+        return plan
+
+    # Una versión nueva empieza con colecciones, padres y manifiesto propios y vacíos
+    collections = funciones_db.crear_db(version=version)
+    almacen = funciones_padres.obtener_almacen(directorio)
+    indice_bm25 = funciones_bm25.obtener_indice(directorio, collections["pdfs"])
+    ruta = ruta_manifiesto(version)
+
+    # 1. Borrar chunks de ficheros eliminados, modificados (pueden tener menos chunks) o nuevos
+    for nombre in borrar_pdfs:
+        if nombre in trabajo_pdfs and funciones_ingesta.leer_checkpoint(nombre, plan["hashes"]["pdfs"][nombre], directorio):
+            continue  # Ingesta interrumpida del mismo contenido: ya se borró y se reanuda
+        collections["pdfs"].delete(where={"source": nombre})
+        almacen.eliminar(nombre)
+        indice_bm25.eliminar_source(nombre)
+        if nombre in plan["pdfs"]["eliminados"]:
+            manifiesto["pdfs"].pop(nombre, None)
+            guardar_manifiesto(manifiesto, ruta)
+    if borrar_pdfs:
+        funciones_bm25.guardar_indice(directorio)
+    # Por nombre de archivo y no por id: así caen también las filas con ids antiguos (uuid4)
+    for desde in range(0, len(borrar_imagenes), LOTE_BORRADO):
+        lote = borrar_imagenes[desde:desde + LOTE_BORRADO]
+        collections["imagenes"].delete(where={"nombre_archivo": {"$in": lote}})
+    for nombre in plan["imagenes"]["eliminados"]:
+        manifiesto["imagenes"].pop(nombre, None)
+    if plan["imagenes"]["eliminados"]:
+        guardar_manifiesto(manifiesto, ruta)
+
+    # 2. Indexar solo lo nuevo o modificado (los modelos se cargan solo si hace falta)
+    fallidos = []
+    if trabajo_pdfs or trabajo_imagenes:
+        model_emb, model_clip, processor_clip = funciones_db.cargar_modelos()
+
+        for nombre in trabajo_pdfs:
+            logger.info(f"Procesando: {nombre}...")
+            try:
+                n = funciones_ingesta.ingerir_pdf(
+                    str(funciones_db.PDFS_DIR / nombre), model_emb, collections["pdfs"],
+                    metadatos.categoria_pdf(nombre, "sin_categoria"), hash_pdf=plan["hashes"]["pdfs"][nombre],
+                    directorio=directorio
+                )["chunks"]
+            except Exception as e:
+                logger.error(f"Error procesando {nombre}: {e}")
+                fallidos.append(nombre)
+                continue
+            if n:
+                manifiesto["pdfs"][nombre] = {"hash": plan["hashes"]["pdfs"][nombre], "num_chunks": n, **_version_pdfs()}
+                guardar_manifiesto(manifiesto, ruta)
+
+        metas = metadatos.imagenes(nombres=trabajo_imagenes)
+        if metas:
+            funciones_db.insertar_imagen(model_clip, processor_clip, collections["imagenes"], metas)
+            escritas = set(collections["imagenes"].get(ids=[funciones_db.id_imagen(m["nombre_archivo"]) for m in metas])["ids"])
+            for meta in metas:
+                if funciones_db.id_imagen(meta["nombre_archivo"]) in escritas:
+                    manifiesto["imagenes"][meta["nombre_archivo"]] = {
+                        "hash": plan["hashes"]["imagenes"][meta["nombre_archivo"]], **_version_imagenes()
+                    }
+            guardar_manifiesto(manifiesto, ruta)
+
+        cache_emb = utils.cache_embeddings(model_emb)
+        if cache_emb is not None:
+            logger.info(f"[CACHE EMB] {cache_emb.estadisticas()}")
+
+    # 3. Exportación para el backend vectorial numpy (si está configurado)
+    funciones_vectores.exportar_version(directorio, collections)
+
+    # 4. Versión nueva: cambio atómico del alias (las APIs en marcha lo recogen solas)
+    if completo:
+        if fallidos:
+            logger.error(f"[VERSIONES] Versión {version} incompleta ({len(fallidos)} PDFs con error); no se activa.")
+        elif activar:
+            funciones_db.activar_version(version)
+            funciones_db.purgar_versiones()
+        else:
+            logger.info(f"[VERSIONES] Versión {version} construida sin activar (--activar {version} para servirla).")
+
+    logger.info("\n INGESTA INCREMENTAL TERMINADA")
+    return plan
+
+
+def rollback() -> Optional[str]:
+    """Vuelve a activar la versión anterior a la activa (si se conserva)."""
+    alias = funciones_db.leer_alias()
+    versiones, activa = alias["versiones"], alias["activa"]
+    if activa not in versiones or versiones.index(activa) == 0:
+        logger.error("[VERSIONES] No hay una versión anterior a la que volver.")
+        return None
+    anterior = versiones[versiones.index(activa) - 1]
+    funciones_db.activar_version(anterior)
+    return anterior
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Ingesta incremental de PDFs e imágenes")
+    parser.add_argument("--dry-run", action="store_true", help="Solo muestra qué cambiaría")
+    parser.add_argument("--completo", action="store_true", help="Reconstruye todo en una versión nueva y la activa al terminar")
+    parser.add_argument("--sin-activar", action="store_true", help="Con --completo, construye la versión nueva sin activarla")
+    parser.add_argument("--activar", metavar="VERSION", help="Activa una versión ya construida")
+    parser.add_argument("--rollback", action="store_true", help="Vuelve a la versión anterior")
+    parser.add_argument("--versiones", action="store_true", help="Lista las versiones conservadas")
+    args = parser.parse_args()
+
+    if args.versiones:
+        logger.info("\n" + json.dumps(funciones_db.leer_alias(), indent=2, ensure_ascii=False))
+    elif args.activar:
+        funciones_db.activar_version(args.activar)
+    elif args.rollback:
+        rollback()
+    else:
+        indexar(dry_run=args.dry_run, completo=args.completo, activar=not args.sin_activar)
+
+
+if __name__ == "__main__":
+    main()
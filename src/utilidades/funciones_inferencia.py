@@ -0,0 +1,156 @@
+"""
+Planificador de inferencia para la API.
+Agrupa en lotes las llamadas concurrentes a los modelos locales (embeddings, reranker y CLIP)
+y las ejecuta en un hilo dedicado, fuera del event loop de asyncio.
+"""
+
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+from loguru import logger
+
+# Límites de los cubos del histograma de tamaño de lote (potencias de dos)
+CUBOS_HISTOGRAMA = [1, 2, 4, 8, 16, 32, 64, 128]
+
+
+def _cubo(tamano: int) -> str:
+    """Devuelve la etiqueta del cubo del histograma para un tamaño de lote."""
+    for limite in CUBOS_HISTOGRAMA:
+        if tamano <= limite:
+            return f"<={limite}"
+    return f">{CUBOS_HISTOGRAMA[-1]}"
+
+
+class MicroBatcher:
+    """
+    Micro-batcher dinámico entre peticiones.
+
+    Cada llamada a `procesar` encola una lista de entradas y devuelve un awaitable.
+    Un bucle de fondo recoge las llamadas que llegan dentro de una ventana de espera
+    (o hasta llenar `max_batch` entradas), ejecuta `funcion` una sola vez con todas
+    ellas en un hilo dedicado y reparte los resultados a cada llamador.
+    """
+
+    def __init__(self, nombre: str, funcion: Callable[[list], list], max_batch: int = 32, max_espera_ms: float = 5.0):
+        """
+        Args:
+            nombre (str): Nombre del batcher (para logs y métricas).
+            funcion (Callable): Función síncrona que recibe una lista de entradas y
+                devuelve una lista de resultados del mismo tamaño y orden.
+            max_batch (int): Número máximo de entradas por lote.
+            max_espera_ms (float): Ventana máxima de espera para completar un lote.
+        """
+        self.nombre = nombre
+        self._funcion = funcion
+        self.max_batch = max_batch
+        self.max_espera = max_espera_ms / 1000.0
+        self._cola = None
+        self._tarea = None
+        self._executor = None
+        self._histograma = Counter()
+        self._lotes = 0
+        self._entradas = 0
+
+    @property
+    def activo(self) -> bool:
+        return self._tarea is not None and not self._tarea.done()
+
+    def iniciar(self):
+        """Crea la cola y el bucle de fondo en el event loop actual."""
+        if self.activo:
+            return
+        self._cola = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"batcher-{self.nombre}")
+        self._tarea = asyncio.get_running_loop().create_task(self._bucle())
+        logger.info(f"[BATCHER:{self.nombre}] Iniciado (max_batch={self.max_batch}, max_espera={self.max_espera * 1000:.1f}ms)")
+
+    async def detener(self):
+        """Cancela el bucle de fondo y libera el hilo de trabajo."""
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def procesar(self, entradas: list) -> list:
+        """
+        Encola las entradas y espera a que su lote se procese.
+
+        Args:
+            entradas (list): Entradas a procesar (textos, pares, ...).
+
+        Returns:
+            list: Resultados en el mismo orden que las entradas.
+        """
+        if not entradas:
+            return []
+        if not self.activo:
+            # Sin bucle de fondo (scripts, tests): ejecutar en un hilo sin agrupar
+            return list(await asyncio.to_thread(self._funcion, list(entradas)))
+        futuro = asyncio.get_running_loop().create_future()
+        await self._cola.put((list(entradas), futuro))
+        return await futuro
+
+    async def _recoger_lote(self) -> list:
+        """Espera la primera llamada y agrupa las que lleguen dentro de la ventana."""
+        loop = asyncio.get_running_loop()
+        pendientes = [await self._cola.get()]
+        total = len(pendientes[0][0])
+        limite = loop.time() + self.max_espera
+        while total < self.max_batch:
+            restante = limite - loop.time()
+            if restante <= 0:
+                break
+            try:
+                siguiente = await asyncio.wait_for(self._cola.get(), timeout=restante)
+            except asyncio.TimeoutError:
+                break
+            pendientes.append(siguiente)
+            total += len(siguiente[0])
+        return pendientes
+
+    async def _bucle(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pendientes = await self._recoger_lote()
+            entradas = [e for lote, _ in pendientes for e in lote]
+
+            self._lotes += 1
+            self._entradas += len(entradas)
+            self._histograma[_cubo(len(entradas))] += 1
+
+            try:
+                resultados = list(await loop.run_in_executor(self._executor, self._funcion, entradas))
+            except Exception as e:
+                logger.error(f"[BATCHER:{self.nombre}] Error procesando lote de {len(entradas)}: {e}")
+                for _, futuro in pendientes:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                continue
+
+            inicio = 0
+            for lote, futuro in pendientes:
+                fin = inicio + len(lote)
+                if not futuro.done():
+                    futuro.set_result(resultados[inicio:fin])
+                inicio = fin
+
+    def estadisticas(self) -> dict:
+        """Profundidad de cola e histograma de tamaños de lote."""
+        return {
+            "nombre": self.nombre,
+            "activo": self.activo,
+            "profundidad_cola": self._cola.qsize() if self._cola is not None else 0,
+            "lotes": self._lotes,
+            "entradas": self._entradas,
+            "media_lote": round(self._entradas / self._lotes, 2) if self._lotes else 0.0,
+            "histograma_tamano_lote": {c: self._histograma.get(c, 0) for c in [_cubo(l) for l in CUBOS_HISTOGRAMA] + [_cubo(CUBOS_HISTOGRAMA[-1] + 1)]},
+            "max_batch": self.max_batch,
+            "max_espera_ms": self.max_espera * 1000
+        }
@@ -0,0 +1,364 @@
+"""
+Ingesta de PDFs en streaming: lectura → limpieza → chunking → embeddings → escritura.
+
+Cada etapa corre en su propio hilo y se comunica con la siguiente mediante colas
+acotadas, de modo que las etapas se solapan (la CPU no espera a la E/S y viceversa)
+y la memoria máxima no depende del tamaño del documento.
+
+El texto se lee por segmentos de ~INGESTA_SEGMENTO_CARACTERES cortados en un salto de
+párrafo ("\\n\\n"). La limpieza y el chunking arrastran de un segmento al siguiente el
+texto que aún puede cambiar (la última ventana de padres), así que padres, hijos e ids
+`<pdf>_child_<n>` son los mismos que al trocear el documento entero.
+Tras cada lote escrito se guarda un checkpoint; si la ingesta se interrumpe, la
+siguiente ejecución sobre el mismo fichero (mismo hash) continúa donde se quedó.
+"""
+
+import json
+import os
+import queue
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+from dotenv import load_dotenv
+from loguru import logger
+from utilidades import utils, funciones_padres, funciones_metadatos, funciones_bm25
+from utilidades import funciones_preprocesado, funciones_chunking
+
+load_dotenv()
+
+DB_PATH = os.getenv("DB_PATH", "chromadb/")
+SEGMENTO_CARACTERES = int(os.getenv("INGESTA_SEGMENTO_CARACTERES", "20000"))
+COLA_MAX = int(os.getenv("INGESTA_COLA_MAX", "4"))
+BATCH_EMBEDDINGS = int(os.getenv("INGESTA_BATCH_EMBEDDINGS", "64"))
+CHECKPOINTS_DIR = Path(DB_PATH) / "checkpoints_ingesta"
+
+_FIN = object()
+_RE_PARRAFO = re.compile(r"\n{2,}")
+
+
+def version_ingesta() -> str:
+    """
+    Identifica cómo se trocea el texto; si cambia, los ids de los chunks no son comparables.
+    No depende del tamaño de segmento: el resultado es el mismo que troceando el documento entero.
+    """
+    return utils.VERSION_CHUNKER
+
+
+# ==========================================
+# CHECKPOINTS
+# ==========================================
+
+def _ruta_checkpoint(nombre_pdf: str, directorio: Optional[Path] = None) -> Path:
+    """Checkpoints en DB_PATH o, si se indica, en el directorio de la versión de las colecciones."""
+    base = Path(directorio) / CHECKPOINTS_DIR.name if directorio else CHECKPOINTS_DIR
+    return base / f"{nombre_pdf}.json"
+
+
+def leer_checkpoint(nombre_pdf: str, hash_pdf: str, directorio: Optional[Path] = None) -> Optional[dict]:
+    """Devuelve el checkpoint del PDF si corresponde al mismo contenido y versión de ingesta."""
+    ruta = _ruta_checkpoint(nombre_pdf, directorio)
+    if not ruta.exists():
+        return None
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if checkpoint.get("hash") != hash_pdf or checkpoint.get("version") != version_ingesta():
+        return None
+    return checkpoint
+
+
+def _guardar_checkpoint(nombre_pdf: str, checkpoint: dict, directorio: Optional[Path] = None) -> None:
+    utils.escribir_json_atomico(_ruta_checkpoint(nombre_pdf, directorio), checkpoint, indent=None)
+
+
+def borrar_checkpoint(nombre_pdf: str, directorio: Optional[Path] = None) -> None:
+    _ruta_checkpoint(nombre_pdf, directorio).unlink(missing_ok=True)
+
+
+# ==========================================
+# FUENTE DE TEXTO Y SEGMENTACIÓN
+# ==========================================
+
+def _fuente_texto(ruta_pdf: str, hash_pdf: str, bloque: int = 1 << 16) -> Iterator[str]:
+    """
+    Texto bruto del PDF en trozos: desde la caché de extracción si existe (lectura por
+    bloques) o página a página con PyMuPDF, sin cargar nunca el documento entero.
+    """
+    cache = funciones_preprocesado._dir_cache(hash_pdf)
+    if (cache / "indice.json").exists() and (cache / "texto.txt").exists():
+        with open(cache / "texto.txt", "r", encoding="utf-8") as f:
+            for trozo in iter(lambda: f.read(bloque), ""):
+                yield trozo
+        return
+    for _, texto in funciones_preprocesado.iterar_textos(ruta_pdf):
+        yield texto + "\n"
+
+
+def segmentar(fuente: Iterator[str], tam: int = SEGMENTO_CARACTERES) -> Iterator[str]:
+    """
+    Agrupa el texto en segmentos de al menos `tam` caracteres cortados tras un salto
+    de párrafo. Si no aparece ninguno en 4 × `tam` caracteres, corta en el último espacio.
+    """
+    partes, n = [], 0
+    for trozo in fuente:
+        partes.append(trozo)
+        n += len(trozo)
+        if n < tam:
+            continue
+        texto = "".join(partes)
+        corte = 0
+        for m in _RE_PARRAFO.finditer(texto, tam // 2):
+            if m.end() < len(texto):
+                corte = m.end()
+        if not corte and n >= 4 * tam:
+            corte = texto.rfind(" ") + 1
+        if corte:
+            yield texto[:corte]
+            texto = texto[corte:]
+        partes, n = [texto], len(texto)
+    resto = "".join(partes)
+    if resto.strip():
+        yield resto
+
+
+# ==========================================
+# EJECUCIÓN DE ETAPAS
+# ==========================================
+
+def _poner(cola: queue.Queue, item, parar: threading.Event) -> bool:
+    while not parar.is_set():
+        try:
+            cola.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _iterar_cola(cola: queue.Queue, parar: threading.Event):
+    while not parar.is_set():
+        try:
+            item = cola.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _FIN:
+            return
+        yield item
+
+
+def _etapa(nombre, trabajo, entrada, salida, stats, errores, parar):
+    """
+    Hilo de una etapa: aplica `trabajo` (generador) a cada elemento de `entrada` y pasa
+    los resultados a `salida`. Solo cuenta como tiempo de la etapa el de `trabajo`,
+    no el de espera en las colas.
+    """
+    try:
+        elementos = _iterar_cola(entrada, parar) if entrada is not None else [None]
+        for item in elementos:
+            iterador = iter(trabajo(item))
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    resultado = next(iterador)
+                except StopIteration:
+                    stats[nombre]["segundos"] += time.perf_counter() - t0
+                    break
+                stats[nombre]["segundos"] += time.perf_counter() - t0
+                if salida is not None and not _poner(salida, resultado, parar):
+                    return
+    except Exception as e:
+        logger.error(f"[INGESTA] Error en la etapa '{nombre}': {e}")
+        errores.append(e)
+        parar.set()
+    finally:
+        if salida is not None:
+            _poner(salida, _FIN, parar)
+
+
+def ingerir_pdf(ruta_pdf: str, model_emb, collection, categoria: str = "sin_categoria",
+                hash_pdf: Optional[str] = None, directorio: Optional[Path] = None) -> dict:
+    """
+    Indexa un PDF con el pipeline en streaming (ids `<pdf>_child_<n>`, upsert).
+
+    Args:
+        ruta_pdf (str): Ruta del PDF.
+        model_emb (SentenceTransformer): Modelo de embeddings.
+        collection (chromadb.Collection): Colección de PDFs.
+        categoria (str): Categoría del documento (almacén de metadatos).
+        hash_pdf (str): Hash del fichero si ya se conoce.
+        directorio (Path): Directorio de la versión de las colecciones (padres, índice BM25 y checkpoints).
+
+    Returns:
+        dict: {"chunks", "padres", "reanudado_desde", "segundos", "etapas": {...}}
+    """
+    nombre_pdf = os.path.basename(ruta_pdf)
+    hash_pdf = hash_pdf or utils.hash_fichero(ruta_pdf)
+    almacen = funciones_padres.obtener_almacen(directorio)
+    indice_bm25 = funciones_bm25.obtener_indice(directorio, collection)
+
+    checkpoint = leer_checkpoint(nombre_pdf, hash_pdf, directorio)
+    reanudar_desde = checkpoint["chunks_escritos"] if checkpoint else 0
+    if checkpoint:
+        logger.info(f"[INGESTA] Reanudando {nombre_pdf} desde el chunk {reanudar_desde}")
+        # El índice léxico guardado puede no tener los chunks escritos antes de la interrupción
+        funciones_bm25.reindexar_source(indice_bm25, collection, nombre_pdf)
+    else:
+        almacen.eliminar(nombre_pdf)
+        indice_bm25.eliminar_source(nombre_pdf)
+        checkpoint = {"archivo": nombre_pdf, "hash": hash_pdf, "version": version_ingesta(), "chunks_escritos": 0}
+        _guardar_checkpoint(nombre_pdf, checkpoint, directorio)
+
+    stats = {e: {"segundos": 0.0, "elementos": 0} for e in ("lectura", "limpieza_chunking", "embeddings", "escritura")}
+    stats["lectura"]["unidad"] = "caracteres"
+    for e in ("limpieza_chunking", "embeddings", "escritura"):
+        stats[e]["unidad"] = "chunks"
+    contadores = {"hijos": 0, "padres": 0}
+    # Texto sin limpiar aún y texto limpio aún sin trocear del todo, arrastrados al siguiente segmento
+    pendiente = {"crudo": "", "limpio": "", "inicio": True}
+
+    def lectura(_):
+        anterior = None
+        for segmento in segmentar(_fuente_texto(ruta_pdf, hash_pdf)):
+            stats["lectura"]["elementos"] += len(segmento)
+            if anterior is not None:
+                yield anterior, False
+            anterior = segmento
+        yield anterior or "", True
+
+    def limpieza_chunking(item):
+        segmento, ultimo = item
+        # Limpieza por partes sin cambiar el resultado: se corta tras un salto de párrafo
+        crudo = pendiente["crudo"] + segmento
+        corte = len(crudo) if ultimo else utils.corte_limpieza(crudo)
+        pendiente["crudo"] = crudo[corte:]
+        limpio = utils.limpiar_texto(crudo[:corte], recortar=False)
+        if not limpio and not ultimo:
+            return
+        texto = pendiente["limpio"] + limpio
+        if pendiente["inicio"]:
+            texto = texto.lstrip()
+            pendiente["inicio"] = not texto
+        if ultimo:
+            texto = texto.rstrip()
+        rangos_padres, hijos, reinicio = funciones_chunking.trocear_padre_hijo_parcial(texto, final=ultimo)
+        pendiente["limpio"] = texto[reinicio:]
+
+        base_padre = contadores["padres"]
+        padres = {base_padre + i: texto[a:b] for i, (a, b) in enumerate(rangos_padres)}
+        lote = []
+        for inicio, fin, padre_id in hijos:
+            idx = contadores["hijos"]
+            contadores["hijos"] += 1
+            if idx < reanudar_desde:
+                continue
+            lote.append((idx, texto[inicio:fin], base_padre + padre_id))
+            if len(lote) == BATCH_EMBEDDINGS:
+                stats["limpieza_chunking"]["elementos"] += len(lote)
+                yield lote
+                lote = []
+        contadores["padres"] = base_padre + len(rangos_padres)
+        if padres:
+            almacen.anadir(nombre_pdf, padres)
+        if lote:
+            stats["limpieza_chunking"]["elementos"] += len(lote)
+            yield lote
+
+    def embeddings(lote):
+        embs = utils.generar_embeddings(model_emb, [texto for _, texto, _ in lote], batch_size=BATCH_EMBEDDINGS)
+        stats["embeddings"]["elementos"] += len(lote)
+        yield lote, embs
+
+    def escritura(lote_embs):
+        lote, embs = lote_embs
+        ids = [f"{nombre_pdf}_child_{idx}" for idx, _, _ in lote]
+        documentos = [texto for _, texto, _ in lote]
+        metadatas = [{"source": nombre_pdf, "categoria": categoria, "type": "child", "parent_id": pid}
+                     for _, _, pid in lote]
+        collection.upsert(ids=ids, documents=documentos, embeddings=embs, metadatas=metadatas)
+        indice_bm25.anadir(ids, documentos, metadatas)
+        stats["escritura"]["elementos"] += len(lote)
+        # Los lotes llegan en orden: todo lo anterior a este índice ya está escrito
+        checkpoint["chunks_escritos"] = lote[-1][0] + 1
+        _guardar_checkpoint(nombre_pdf, checkpoint, directorio)
+        return ()
+
+    colas = [queue.Queue(maxsize=COLA_MAX) for _ in range(3)]
+    errores, parar = [], threading.Event()
+    definicion = [
+        ("lectura", lectura, None, colas[0]),
+        ("limpieza_chunking", limpieza_chunking, colas[0], colas[1]),
+        ("embeddings", embeddings, colas[1], colas[2]),
+        ("escritura", escritura, colas[2], None),
+    ]
+    inicio = time.perf_counter()
+    hilos = [
+        threading.Thread(target=_etapa, args=(n, t, e, s, stats, errores, parar), name=f"ingesta-{n}", daemon=True)
+        for n, t, e, s in definicion
+    ]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    total = time.perf_counter() - inicio
+
+    if errores:
+        raise RuntimeError(f"Ingesta de {nombre_pdf} interrumpida (checkpoint en el chunk {checkpoint['chunks_escritos']})") from errores[0]
+
+    funciones_bm25.guardar_indice(directorio)
+    borrar_checkpoint(nombre_pdf, directorio)
+    for datos in stats.values():
+        datos["por_segundo"] = round(datos["elementos"] / datos["segundos"], 1) if datos["segundos"] else None
+        datos["segundos"] = round(datos["segundos"], 3)
+    resumen = {
+        "chunks": contadores["hijos"],
+        "padres": contadores["padres"],
+        "reanudado_desde": reanudar_desde,
+        "segundos": round(total, 3),
+        "etapas": stats
+    }
+    logger.info(
+        f"[INGESTA] {nombre_pdf}: {contadores['hijos']} chunks, {contadores['padres']} padres en {total:.2f}s | "
+        + " | ".join(f"{n}={d['por_segundo']} {d['unidad']}/s" for n, d in stats.items())
+    )
+    return resumen
+
+
+def main():
+    """Ingesta en streaming de uno o varios PDFs, con informe de rendimiento por etapa y memoria máxima."""
+    import argparse
+    import tracemalloc
+    from sentence_transformers import SentenceTransformer
+    from utilidades import funciones_db
+
+    parser = argparse.ArgumentParser(description="Ingesta de PDFs en streaming")
+    parser.add_argument("pdfs", nargs="*", help="Nombres de PDF en data/documentos/pdfs (por defecto, todos)")
+    args = parser.parse_args()
+
+    rutas = [funciones_db.PDFS_DIR / n for n in args.pdfs] or sorted(funciones_db.PDFS_DIR.glob("*.pdf"))
+    metadatos = funciones_metadatos.obtener_almacen()
+
+    model_emb = SentenceTransformer(funciones_db.MODELO_EMBEDDINGS, device="cpu")
+    collection = funciones_db.crear_db(reset=False)["pdfs"]
+    directorio = funciones_db.directorio_version(funciones_db.version_activa())
+
+    informe = {}
+    for ruta in rutas:
+        hash_pdf = utils.hash_fichero(ruta)
+        if not leer_checkpoint(ruta.name, hash_pdf, directorio):
+            # Re-ingesta: los chunks anteriores del PDF pueden ser más o tener otros ids
+            collection.delete(where={"source": ruta.name})
+        tracemalloc.start()
+        resumen = ingerir_pdf(str(ruta), model_emb, collection, metadatos.categoria_pdf(ruta.name, "sin_categoria"),
+                              hash_pdf=hash_pdf, directorio=directorio)
+        resumen["memoria_pico_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+        tracemalloc.stop()
+        informe[ruta.name] = resumen
+    logger.info("\n INFORME INGESTA \n" + json.dumps(informe, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
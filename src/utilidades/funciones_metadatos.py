@@ -0,0 +1,262 @@
+"""
+Almacén de metadatos de PDFs e imágenes.
+
+Sustituye las reescrituras completas de `metadata_pdf.json` y `metadata_imagenes.json`
+por una base SQLite con upserts transaccionales e índices por nombre de fichero y
+categoría. Los JSON siguen siendo el formato de intercambio: se importan si han
+cambiado desde la última importación (p. ej. editados a mano) y se exportan una vez
+por cada lote de escrituras, con la misma estructura de siempre.
+
+Uso:
+    python src/utilidades/funciones_metadatos.py --importar
+    python src/utilidades/funciones_metadatos.py --exportar
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from dotenv import load_dotenv
+from loguru import logger
+from utilidades import utils
+
+load_dotenv()
+
+METADATOS_DB = os.getenv("METADATOS_DB") or str(utils.project_root() / "data" / "metadatos.sqlite3")
+METADATA_PDF_FILE = utils.project_root() / "data" / "metadata_pdf.json"
+METADATA_IMAGENES_FILE = utils.project_root() / "data" / "metadata_imagenes.json"
+MAX_PARAMETROS = 500
+
+
+class AlmacenMetadatos:
+    """
+    Tablas `pdfs(archivo, categoria)` e `imagenes(nombre_archivo, pdf_origen, categoria, pagina, datos)`
+    con acceso seguro entre hilos. `datos` guarda el diccionario completo de la imagen.
+    """
+
+    def __init__(self, ruta: Optional[str] = None, fichero_pdfs: Path = METADATA_PDF_FILE,
+                 fichero_imagenes: Path = METADATA_IMAGENES_FILE):
+        self.ruta = Path(ruta) if ruta else Path(METADATOS_DB)
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        self.ficheros = {"pdfs": Path(fichero_pdfs), "imagenes": Path(fichero_imagenes)}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.ruta), check_same_thread=False)
+        with self._conn:
+            self._conn.executescript(
+                """CREATE TABLE IF NOT EXISTS pdfs (
+                    archivo TEXT PRIMARY KEY,
+                    categoria TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_pdfs_categoria ON pdfs (categoria);
+                CREATE TABLE IF NOT EXISTS imagenes (
+                    nombre_archivo TEXT PRIMARY KEY,
+                    pdf_origen TEXT,
+                    categoria TEXT,
+                    pagina INTEGER,
+                    datos TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_imagenes_categoria ON imagenes (categoria);
+                CREATE INDEX IF NOT EXISTS idx_imagenes_pdf ON imagenes (pdf_origen);
+                CREATE TABLE IF NOT EXISTS estado (
+                    clave TEXT PRIMARY KEY,
+                    valor TEXT
+                );"""
+            )
+        self.sincronizar_desde_json()
+
+    # ---------- Importación / exportación JSON ----------
+
+    def _marca_json(self, tipo: str) -> Optional[str]:
+        ruta = self.ficheros[tipo]
+        if not ruta.exists():
+            return None
+        st = ruta.stat()
+        return f"{st.st_mtime_ns}:{st.st_size}"
+
+    def _guardar_marca(self, tipo: str) -> None:
+        self._conn.execute(
+            "INSERT INTO estado (clave, valor) VALUES (?, ?) ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor",
+            (f"json_{tipo}", self._marca_json(tipo))
+        )
+
+    def sincronizar_desde_json(self) -> None:
+        """Importa los JSON que hayan cambiado desde la última importación o exportación."""
+        for tipo in ("pdfs", "imagenes"):
+            marca = self._marca_json(tipo)
+            if marca is None:
+                continue
+            with self._lock:
+                fila = self._conn.execute("SELECT valor FROM estado WHERE clave = ?", (f"json_{tipo}",)).fetchone()
+            if fila is None or fila[0] != marca:
+                self.importar_json(tipo)
+
+    def importar_json(self, tipo: str) -> int:
+        """
+        Sustituye el contenido de una tabla por el de su JSON.
+
+        Args:
+            tipo (str): "pdfs" o "imagenes".
+
+        Returns:
+            int: Número de filas importadas.
+        """
+        ruta = self.ficheros[tipo]
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except json.JSONDecodeError:
+            logger.error(f"[METADATOS] Error al parsear {ruta}; no se importa.")
+            return 0
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {tipo}")
+            if tipo == "pdfs":
+                self._upsert_pdfs({d["archivo"]: d.get("categoria", "sin_categoria") for d in datos if d.get("archivo")})
+            else:
+                self._upsert_imagenes([d for d in datos if d.get("nombre_archivo")])
+            self._guardar_marca(tipo)
+        logger.info(f"[METADATOS] Importadas {len(datos)} entradas de {ruta.name}")
+        return len(datos)
+
+    def exportar_json(self, tipo: str) -> None:
+        """Vuelca una tabla a su JSON (escritura atómica) con el formato original."""
+        datos = self.pdfs() if tipo == "pdfs" else self.imagenes()
+        with self._lock, self._conn:
+            utils.escribir_json_atomico(self.ficheros[tipo], datos)
+            self._guardar_marca(tipo)
+
+    # ---------- PDFs ----------
+
+    def _upsert_pdfs(self, categorias: Dict[str, str]) -> None:
+        self._conn.executemany(
+            "INSERT INTO pdfs (archivo, categoria) VALUES (?, ?) "
+            "ON CONFLICT(archivo) DO UPDATE SET categoria = excluded.categoria",
+            list(categorias.items())
+        )
+
+    def guardar_pdfs(self, categorias: Dict[str, str], exportar: bool = True) -> None:
+        """
+        Inserta o actualiza la categoría de varios PDFs en una sola transacción.
+
+        Args:
+            categorias (dict): {archivo: categoria}
+            exportar (bool): Si es True, actualiza después metadata_pdf.json.
+        """
+        with self._lock, self._conn:
+            self._upsert_pdfs(categorias)
+        if exportar:
+            self.exportar_json("pdfs")
+
+    def categoria_pdf(self, archivo: str, defecto: Optional[str] = None) -> Optional[str]:
+        with self._lock:
+            fila = self._conn.execute("SELECT categoria FROM pdfs WHERE archivo = ?", (archivo,)).fetchone()
+        return fila[0] if fila else defecto
+
+    def categorias_pdfs(self) -> Dict[str, str]:
+        """{archivo: categoria} de todos los PDFs."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT archivo, categoria FROM pdfs ORDER BY rowid").fetchall())
+
+    def pdfs(self, categoria: Optional[str] = None) -> List[dict]:
+        """Entradas con el formato de metadata_pdf.json, opcionalmente de una categoría."""
+        consulta, parametros = "SELECT archivo, categoria FROM pdfs", ()
+        if categoria is not None:
+            consulta, parametros = consulta + " WHERE categoria = ?", (categoria,)
+        with self._lock:
+            filas = self._conn.execute(consulta + " ORDER BY rowid", parametros).fetchall()
+        return [{"archivo": a, "categoria": c} for a, c in filas]
+
+    # ---------- Imágenes ----------
+
+    def _upsert_imagenes(self, metadatos: Iterable[dict]) -> None:
+        self._conn.executemany(
+            "INSERT INTO imagenes (nombre_archivo, pdf_origen, categoria, pagina, datos) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(nombre_archivo) DO UPDATE SET pdf_origen = excluded.pdf_origen, "
+            "categoria = excluded.categoria, pagina = excluded.pagina, datos = excluded.datos",
+            [
+                (m["nombre_archivo"], m.get("pdf_origen"), m.get("categoria"), m.get("pagina"),
+                 json.dumps(m, ensure_ascii=False))
+                for m in metadatos
+            ]
+        )
+
+    def guardar_imagenes(self, metadatos: List[dict], exportar: bool = True) -> None:
+        """
+        Inserta o actualiza metadatos de imágenes (clave: nombre_archivo) en una sola transacción.
+
+        Args:
+            metadatos (list): Diccionarios con el formato de metadata_imagenes.json.
+            exportar (bool): Si es True, actualiza después metadata_imagenes.json.
+        """
+        with self._lock, self._conn:
+            self._upsert_imagenes(metadatos)
+        if exportar:
+            self.exportar_json("imagenes")
+
+    def imagenes(self, categoria: Optional[str] = None, nombres: Optional[Iterable[str]] = None) -> List[dict]:
+        """Metadatos de imágenes, opcionalmente filtrados por categoría o por nombres de fichero."""
+        base, parametros = "SELECT datos FROM imagenes WHERE 1 = 1", []
+        if categoria is not None:
+            base += " AND categoria = ?"
+            parametros.append(categoria)
+        if nombres is None:
+            consultas = [(base, parametros)]
+        else:
+            # Por tramos, para no superar el límite de parámetros de SQLite
+            nombres = list(dict.fromkeys(nombres))
+            consultas = [
+                (base + f" AND nombre_archivo IN ({','.join('?' * len(tramo))})", parametros + tramo)
+                for tramo in (nombres[i:i + MAX_PARAMETROS] for i in range(0, len(nombres), MAX_PARAMETROS))
+            ]
+        filas = []
+        with self._lock:
+            for consulta, params in consultas:
+                filas.extend(self._conn.execute(consulta + " ORDER BY rowid", params).fetchall())
+        return [json.loads(d) for (d,) in filas]
+
+    def contar(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                tipo: self._conn.execute(f"SELECT COUNT(*) FROM {tipo}").fetchone()[0]
+                for tipo in ("pdfs", "imagenes")
+            }
+
+    def cerrar(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_almacen: Optional[AlmacenMetadatos] = None
+_almacen_lock = threading.Lock()
+
+
+def obtener_almacen() -> AlmacenMetadatos:
+    """Almacén de metadatos compartido por el proceso (se abre, e importa los JSON, en el primer uso)."""
+    global _almacen
+    with _almacen_lock:
+        if _almacen is None:
+            _almacen = AlmacenMetadatos()
+        return _almacen
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Almacén de metadatos de PDFs e imágenes")
+    parser.add_argument("--importar", action="store_true", help="Fuerza la importación de los JSON")
+    parser.add_argument("--exportar", action="store_true", help="Vuelca el almacén a los JSON")
+    args = parser.parse_args()
+
+    almacen = obtener_almacen()
+    for tipo in ("pdfs", "imagenes"):
+        if args.importar:
+            almacen.importar_json(tipo)
+        if args.exportar:
+            almacen.exportar_json(tipo)
+    logger.info(f"[METADATOS] {almacen.ruta}: {almacen.contar()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Almacén de chunks padre.
+Cada texto padre se guarda UNA sola vez en una tabla SQLite junto a la base de datos
+vectorial, con clave (source, parent_id). Los chunks hijo de ChromaDB solo guardan la clave.
+Cada versión de las colecciones tiene su propio almacén en su directorio.
+"""
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+from loguru import logger
+
+load_dotenv()
+
+DB_PATH = os.getenv("DB_PATH", "chromadb/")
+NOMBRE_FICHERO = "padres.sqlite3"
+
+
+class AlmacenPadres:
+    """Tabla `padres(source, parent_id, texto)` con acceso seguro entre hilos."""
+
+    def __init__(self, ruta: Optional[str] = None):
+        self.ruta = Path(ruta) if ruta else Path(DB_PATH) / NOMBRE_FICHERO
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.ruta), check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS padres (
+                source TEXT NOT NULL,
+                parent_id INTEGER NOT NULL,
+                texto TEXT NOT NULL,
+                PRIMARY KEY (source, parent_id)
+            ) WITHOUT ROWID"""
+        )
+        self._conn.commit()
+
+    def guardar(self, source: str, padres: Dict[int, str]) -> None:
+        """
+        Sustituye todos los padres de un documento.
+
+        Args:
+            source (str): Nombre del PDF.
+            padres (dict): {parent_id: texto_padre}
+        """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM padres WHERE source = ?", (source,))
+            self._conn.executemany(
+                "INSERT INTO padres (source, parent_id, texto) VALUES (?, ?, ?)",
+                [(source, int(pid), texto) for pid, texto in padres.items()]
+            )
+
+    def anadir(self, source: str, padres: Dict[int, str]) -> None:
+        """Añade (o sobrescribe) padres de un documento sin borrar los demás (ingesta por segmentos)."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO padres (source, parent_id, texto) VALUES (?, ?, ?)",
+                [(source, int(pid), texto) for pid, texto in padres.items()]
+            )
+
+    def eliminar(self, source: str) -> None:
+        """Borra los padres de un documento."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM padres WHERE source = ?", (source,))
+
+    def vaciar(self) -> None:
+        """Borra todos los padres (reconstrucción completa del índice)."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM padres")
+
+    def obtener(self, claves: Iterable[Tuple[str, int]]) -> Dict[Tuple[str, int], str]:
+        """
+        Recupera en una sola consulta los padres pedidos (sin duplicados).
+
+        Args:
+            claves: Pares (source, parent_id).
+
+        Returns:
+            dict: {(source, parent_id): texto} solo con las claves encontradas.
+        """
+        claves = list(dict.fromkeys((s, int(p)) for s, p in claves))
+        if not claves:
+            return {}
+        condicion = " OR ".join(["(source = ? AND parent_id = ?)"] * len(claves))
+        parametros = [v for clave in claves for v in clave]
+        with self._lock:
+            filas = self._conn.execute(
+                f"SELECT source, parent_id, texto FROM padres WHERE {condicion}", parametros
+            ).fetchall()
+        return {(s, p): t for s, p, t in filas}
+
+    def contar(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM padres").fetchone()[0]
+
+    def cerrar(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_almacenes: Dict[Path, AlmacenPadres] = {}
+_almacen_lock = threading.Lock()
+
+
+def obtener_almacen(directorio: Optional[Path] = None) -> AlmacenPadres:
+    """
+    Almacén de padres compartido por el proceso (se abre en el primer uso).
+
+    Args:
+        directorio (Path): Directorio de la versión de las colecciones (por defecto, DB_PATH).
+    """
+    ruta = Path(directorio or DB_PATH) / NOMBRE_FICHERO
+    with _almacen_lock:
+        if ruta not in _almacenes:
+            _almacenes[ruta] = AlmacenPadres(str(ruta))
+        return _almacenes[ruta]
+
+
+def cerrar_almacen(directorio: Optional[Path] = None) -> None:
+    """Cierra el almacén de un directorio si estaba abierto (antes de borrar una versión)."""
+    with _almacen_lock:
+        almacen = _almacenes.pop(Path(directorio or DB_PATH) / NOMBRE_FICHERO, None)
+    if almacen is not None:
+        almacen.cerrar()
+
+
+def migrar_desde_coleccion(collection, almacen: Optional[AlmacenPadres] = None, limpiar_metadatos: bool = True) -> int:
+    """
+    Migra un índice antiguo (padre copiado en `contexto_expandido` de cada hijo) al almacén.
+
+    Args:
+        collection: Colección de PDFs de ChromaDB.
+        almacen: Almacén destino (por defecto el compartido).
+        limpiar_metadatos (bool): Si es True, elimina `contexto_expandido` de los hijos.
+
+    Returns:
+        int: Número de padres guardados.
+    """
+    almacen = almacen or obtener_almacen()
+    datos = collection.get(include=["metadatas"])
+    por_source: Dict[str, Dict[int, str]] = {}
+    ids_con_copia: List[str] = []
+
+    for id_, meta in zip(datos["ids"], datos["metadatas"]):
+        meta = meta or {}
+        texto = meta.get("contexto_expandido")
+        if not texto or "parent_id" not in meta:
+            continue
+        por_source.setdefault(meta.get("source", "desc"), {})[int(meta["parent_id"])] = texto
+        ids_con_copia.append(id_)
+
+    for source, padres in por_source.items():
+        almacen.guardar(source, padres)
+    total = sum(len(p) for p in por_source.values())
+    logger.info(f"[PADRES] Migrados {total} padres de {len(por_source)} documentos ({len(ids_con_copia)} hijos con copia).")
+
+    if limpiar_metadatos and ids_con_copia:
+        # En ChromaDB, una clave con valor None en `update` se elimina de los metadatos
+        collection.update(ids=ids_con_copia, metadatas=[{"contexto_expandido": None}] * len(ids_con_copia))
+        logger.info("[PADRES] Eliminada la copia del padre de los metadatos de los hijos.")
+    return total
+
+
+def main():
+    """Migra la colección de PDFs existente al almacén de padres."""
+    from utilidades import funciones_db
+    migrar_desde_coleccion(funciones_db.obtener_coleccion("pdfs"), obtener_almacen(funciones_db.registro.directorio()))
+
+
+if __name__ == "__main__":
+    main()
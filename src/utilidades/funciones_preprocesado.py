@@ -1,13 +1,22 @@
 """En este script aparecen la sfunciones relacionadas con el preprocesado de los datos 
 que se van a recoger en la base de datos"""
+import asyncio
+import io
 import json
 import os
+import random
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 from loguru import logger
-from utilidades import utils
+from utilidades import utils, funciones_metadatos
 # import utils
 import glob
 import fitz
-from openai import OpenAI
+from PIL import Image
+from openai import OpenAI, AsyncOpenAI, APIConnectionError
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -27,13 +36,256 @@ PDF_DIR = utils.project_root() /"data"/"documentos"/"pdfs"
 IMAGENES_DIR = utils.project_root() /"data"/"documentos"/"imagenes"
 logger.info(f"Ruta de datos: {DATA_DIR}")
 
+# Caché de extracción (texto + imágenes por hash de contenido del PDF)
+CACHE_EXTRACCION_DIR = Path(os.getenv("CACHE_EXTRACCION_DIR") or utils.project_root() / "data" / "cache_extraccion")
+# Imágenes: lado mínimo en píxeles y distancia Hamming máxima entre dHash para considerarlas la misma
+IMAGENES_MIN_LADO = int(os.getenv("IMAGENES_MIN_LADO", "64"))
+IMAGENES_DHASH_DISTANCIA = int(os.getenv("IMAGENES_DHASH_DISTANCIA", "4"))
+VERSION_EXTRACCION = f"v2_min{IMAGENES_MIN_LADO}_d{IMAGENES_DHASH_DISTANCIA}"
+EXTRACCION_WORKERS = int(os.getenv("EXTRACCION_WORKERS") or os.cpu_count() or 4)
+# Caché de clasificación por hash del PDF (un PDF sin cambios no se vuelve a clasificar)
+CACHE_CLASIFICACION_FILE = utils.project_root() / "data" / "cache_clasificacion.json"
+# Páginas y PDFs en los que aparece cada imagen canónica (tras deduplicar)
+APARICIONES_IMAGENES_FILE = utils.project_root() / "data" / "apariciones_imagenes.json"
+
 # Configuración LLM para clasificación automática
 LLM_API_KEY = os.getenv("LLM_API_KEY", "groq")
 LLM_BASE_URL = os.getenv("LLM_BASE_URL", "http://localhost:11434/v1")
 
+def iterar_paginas(ruta_pdf: str, min_lado: int = 0):
+    """
+    Abre el PDF UNA vez y devuelve, página a página, su texto y sus imágenes.
+
+    Las imágenes cuyo xref ya apareció en una página anterior, o con algún lado menor
+    que `min_lado`, se devuelven sin "bytes" (no se extraen).
+
+    Yields:
+        tuple: (num_pagina, texto, imagenes) con imagenes = [{"indice", "xref", "ancho", "alto", "ext", "bytes"}]
+    """
+    vistos = set()
+    with fitz.open(ruta_pdf) as doc:
+        for num_pag, pagina in enumerate(doc, 1):
+            imagenes = []
+            for i, img in enumerate(pagina.get_images(full=True)):
+                xref, ancho, alto = img[0], img[2], img[3]
+                info = {"indice": i, "xref": xref, "ancho": ancho, "alto": alto}
+                if xref not in vistos and min(ancho, alto) >= min_lado:
+                    vistos.add(xref)
+                    try:
+                        base = doc.extract_image(xref)
+                        info.update(ext=base["ext"], bytes=base["image"])
+                    except Exception:
+                        pass # Ignorar errores puntuales de extracción
+                imagenes.append(info)
+            yield num_pag, pagina.get_text(), imagenes
+
+
+def iterar_textos(ruta_pdf: str):
+    """
+    Como `iterar_paginas` pero solo con el texto: no recorre ni extrae imágenes.
+
+    Yields:
+        tuple: (num_pagina, texto)
+    """
+    with fitz.open(ruta_pdf) as doc:
+        for num_pag, pagina in enumerate(doc, 1):
+            yield num_pag, pagina.get_text()
+
+def dhash(datos: bytes, lado: int = 8) -> Optional[int]:
+    """
+    Hash perceptual por diferencias (dHash) de `lado`x`lado` bits.
+    Imágenes casi iguales (recompresiones, reescalados) dan hashes a poca distancia Hamming.
+    Devuelve None si PIL no puede decodificar la imagen.
+    """
+    try:
+        with Image.open(io.BytesIO(datos)) as imagen:
+            gris = imagen.convert("L").resize((lado + 1, lado), Image.LANCZOS)
+    except Exception:
+        return None
+    px = list(gris.getdata())
+    bits = 0
+    for fila in range(lado):
+        for col in range(lado):
+            i = fila * (lado + 1) + col
+            bits = (bits << 1) | (px[i] > px[i + 1])
+    return bits
+
+def distancia_hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def _buscar_similar(canonicas: list, h: Optional[int], distancia: int) -> Optional[dict]:
+    if h is None:
+        return None
+    return next((c for c in canonicas if c["_dhash"] is not None and distancia_hamming(c["_dhash"], h) <= distancia), None)
+
+def _dir_cache(hash_pdf: str) -> Path:
+    return CACHE_EXTRACCION_DIR / f"{hash_pdf}_{VERSION_EXTRACCION}"
+
+def podar_cache_extraccion(hashes_vigentes) -> List[str]:
+    """
+    Borra de la caché de extracción las entradas de PDFs que ya no existen o han cambiado
+    (hash fuera de `hashes_vigentes`) y las de otras versiones de la extracción.
+
+    Returns:
+        List[str]: Nombres de los directorios borrados.
+    """
+    if not CACHE_EXTRACCION_DIR.exists():
+        return []
+    vigentes = {_dir_cache(h).name for h in hashes_vigentes}
+    borrados = []
+    for directorio in CACHE_EXTRACCION_DIR.iterdir():
+        if directorio.is_dir() and directorio.name not in vigentes:
+            shutil.rmtree(directorio, ignore_errors=True)
+            borrados.append(directorio.name)
+    if borrados:
+        logger.info(f"[EXTRACCION] Caché podada: {len(borrados)} entradas obsoletas borradas")
+    return borrados
+
+def _leer_cache(hash_pdf: str) -> Optional[dict]:
+    """Devuelve la extracción cacheada (índice + texto) o None si no existe o está incompleta."""
+    directorio = _dir_cache(hash_pdf)
+    indice = directorio / "indice.json"
+    if not indice.exists():
+        return None
+    try:
+        with open(indice, "r", encoding="utf-8") as f:
+            extraccion = json.load(f)
+        extraccion["texto"] = (directorio / "texto.txt").read_text(encoding="utf-8")
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"[EXTRACCION] Caché ilegible en {directorio}: {e}")
+        return None
+    extraccion["dir"] = str(directorio)
+    return extraccion
+
+def _extraer_a_cache(ruta_pdf: str, hash_pdf: str) -> dict:
+    """
+    Extrae texto e imágenes de un PDF en una sola pasada y los guarda en la caché.
+    Se ejecuta en los procesos del pool, por eso está a nivel de módulo.
+    """
+    inicio = time.perf_counter()
+    directorio = _dir_cache(hash_pdf)
+    (directorio / "imagenes").mkdir(parents=True, exist_ok=True)
+
+    paginas = []
+    por_xref = {}    # xref -> imagen canónica
+    canonicas = []
+    descartes = {"pequenas": 0, "repetidas_xref": 0, "casi_duplicadas": 0}
+    for num_pag, texto, imgs in iterar_paginas(ruta_pdf, IMAGENES_MIN_LADO):
+        paginas.append(texto)
+        for img in imgs:
+            if min(img["ancho"], img["alto"]) < IMAGENES_MIN_LADO:
+                descartes["pequenas"] += 1
+                continue
+            entrada = por_xref.get(img["xref"])
+            if entrada is not None:
+                descartes["repetidas_xref"] += 1
+            elif "bytes" not in img:
+                continue  # error de extracción
+            else:
+                h = dhash(img["bytes"])
+                entrada = _buscar_similar(canonicas, h, IMAGENES_DHASH_DISTANCIA)
+                if entrada is not None:
+                    descartes["casi_duplicadas"] += 1
+                else:
+                    # En la caché no va el nombre del PDF: dos ficheros con el mismo contenido comparten entrada
+                    fichero = f"{num_pag}-{img['indice']}.{img['ext']}"
+                    with open(directorio / "imagenes" / fichero, "wb") as f:
+                        f.write(img["bytes"])
+                    entrada = {
+                        "fichero": fichero, "pagina": num_pag, "xref": img["xref"],
+                        "ancho": img["ancho"], "alto": img["alto"],
+                        "dhash": f"{h:016x}" if h is not None else None, "paginas": [], "_dhash": h
+                    }
+                    canonicas.append(entrada)
+                por_xref[img["xref"]] = entrada
+            # Una sola entrada por imagen con todas las páginas en las que aparece
+            if num_pag not in entrada["paginas"]:
+                entrada["paginas"].append(num_pag)
+
+    imagenes = [{k: v for k, v in c.items() if k != "_dhash"} for c in canonicas]
+    if any(descartes.values()):
+        logger.info(f"[EXTRACCION] {os.path.basename(ruta_pdf)}: {len(imagenes)} imágenes únicas; descartadas {descartes}")
+
+    # Mismo formato que la lectura original: cada página seguida de un salto de línea
+    texto_completo = "".join(p + "\n" for p in paginas)
+    (directorio / "texto.txt").write_text(texto_completo, encoding="utf-8")
+
+    extraccion = {
+        "hash": hash_pdf,
+        "num_paginas": len(paginas),
+        "imagenes": imagenes,
+        "imagenes_descartadas": descartes,
+        "segundos": round(time.perf_counter() - inicio, 3)
+    }
+    # El índice se escribe el último: su presencia marca la caché como completa
+    utils.escribir_json_atomico(directorio / "indice.json", extraccion)
+
+    extraccion["texto"] = texto_completo
+    extraccion["dir"] = str(directorio)
+    return extraccion
+
+def _asignar_archivo(extraccion: dict, ruta_pdf: str) -> dict:
+    """Pone el nombre del PDF y el nombre final de cada imagen (`<pdf>-<pagina>-<indice>.<ext>`)."""
+    extraccion["archivo"] = os.path.basename(ruta_pdf)
+    nombre_base = extraccion["archivo"].replace('.pdf', '')
+    for img in extraccion["imagenes"]:
+        img["nombre_archivo"] = f"{nombre_base}-{img['fichero']}"
+    return extraccion
+
+def extraer_pdf(ruta_pdf: str) -> dict:
+    """
+    Texto e imágenes de un PDF, desde la caché si ya se extrajo un fichero con el mismo contenido.
+
+    Returns:
+        dict: {"archivo", "hash", "num_paginas", "texto", "imagenes", "dir"}
+    """
+    hash_pdf = utils.hash_fichero(ruta_pdf)
+    extraccion = _leer_cache(hash_pdf)
+    if extraccion is None:
+        extraccion = _extraer_a_cache(str(ruta_pdf), hash_pdf)
+    return _asignar_archivo(extraccion, ruta_pdf)
+
+def extraer_pdfs(rutas_pdf: List[str], workers: Optional[int] = None) -> List[dict]:
+    """
+    Extrae varios PDFs repartiéndolos en un pool de procesos (uno por núcleo por defecto).
+    Los ficheros ya extraídos (mismo hash) se sirven desde la caché sin abrirlos.
+
+    Returns:
+        list: Una extracción por PDF, en el mismo orden que `rutas_pdf`.
+    """
+    inicio = time.perf_counter()
+    hashes = [utils.hash_fichero(r) for r in rutas_pdf]
+    resultados = [_leer_cache(h) for h in hashes]
+    pendientes = [i for i, r in enumerate(resultados) if r is None]
+
+    if pendientes:
+        workers = min(workers or EXTRACCION_WORKERS, len(pendientes))
+        logger.info(f"[EXTRACCION] {len(pendientes)} PDFs por extraer ({len(rutas_pdf) - len(pendientes)} en caché) con {workers} procesos")
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futuros = {i: pool.submit(_extraer_a_cache, str(rutas_pdf[i]), hashes[i]) for i in pendientes}
+                for i, futuro in futuros.items():
+                    try:
+                        resultados[i] = futuro.result()
+                    except Exception as e:
+                        logger.error(f"[EXTRACCION] Error extrayendo {rutas_pdf[i]}: {e}")
+        else:
+            for i in pendientes:
+                try:
+                    resultados[i] = _extraer_a_cache(str(rutas_pdf[i]), hashes[i])
+                except Exception as e:
+                    logger.error(f"[EXTRACCION] Error extrayendo {rutas_pdf[i]}: {e}")
+
+    for ruta, extraccion in zip(rutas_pdf, resultados):
+        if extraccion is not None:
+            _asignar_archivo(extraccion, ruta)
+    total = time.perf_counter() - inicio
+    logger.info(f"[EXTRACCION] {len(rutas_pdf)} PDFs listos en {total:.2f}s ({len(pendientes)} extraídos, {len(rutas_pdf) - len(pendientes)} desde caché)")
+    return resultados
+
 def  leer_pdf(ruta_pdf: str) -> str:
     """
-    Lee todo el texto de un archivo PDF.
+    Lee todo el texto de un archivo PDF (usa la caché de extracción).
     
     Args:
         ruta_pdf: Ruta absoluta o relativa al archivo PDF.
@@ -45,45 +297,68 @@ def  leer_pdf(ruta_pdf: str) -> str:
         logger.error(f"No encuentro el archivo: {ruta_pdf}")
         return ""
 
-    doc = fitz.open(ruta_pdf)
-    texto_completo = ""
-    
-    for pagina in doc:
-        texto_completo += pagina.get_text() + "\n"
-        
-    logger.info(f"Leídas {len(doc)} páginas ({len(texto_completo)} caracteres)")
+    extraccion = extraer_pdf(ruta_pdf)
+    texto_completo = extraccion["texto"]
+    logger.info(f"Leídas {extraccion['num_paginas']} páginas ({len(texto_completo)} caracteres)")
     return texto_completo
 
-def extraer_imagen(ruta_pdf):
+class DeduplicadorImagenes:
     """
-    Extrae todas las imágenes de un PDF y las guarda en disco.
-    Las imágenes heredan la categoría del PDF padre.
+    Deduplicación de imágenes ENTRE PDFs (logos y cabeceras institucionales repetidos).
+    Dentro de cada PDF ya se deduplica al extraer. Registra todas las apariciones
+    (PDF y página) de cada imagen canónica.
     """
-    doc = fitz.open(ruta_pdf)
-    nombre_base = os.path.basename(ruta_pdf).replace('.pdf', '')
 
-    # Recorrer páginas
-    for num_pag, pagina in enumerate(doc, 1):
-        for i, img in enumerate(pagina.get_images(full=True)):
-            xref = img[0]
-            try:
-                base = doc.extract_image(xref)
-                bytes_img = base["image"]
-                ext = base["ext"]
-                
-                nombre_archivo = f"{nombre_base}-{num_pag}-{i}.{ext}"
-                ruta_completa = IMAGENES_DIR / nombre_archivo
-                
-                # Guardar en disco
-                with open(ruta_completa, "wb") as f:
-                    f.write(bytes_img)
-            except Exception as e:
-                pass # Ignorar errores puntuales de extracción
+    def __init__(self, distancia: int = IMAGENES_DHASH_DISTANCIA):
+        self.distancia = distancia
+        self._canonicas = []  # [{"_dhash", "nombre_archivo"}]
+        self.apariciones = {}  # nombre_archivo canónico -> [{"pdf_origen", "pagina"}]
 
-def clasificar_documento(nombre_archivo: str, texto_inicio: str, client_llm) -> str:
+    def registrar(self, img: dict, pdf_origen: str) -> str:
+        """Devuelve el nombre canónico de la imagen (el suyo propio si es nueva)."""
+        h = int(img["dhash"], 16) if img.get("dhash") else None
+        similar = _buscar_similar(self._canonicas, h, self.distancia)
+        nombre = similar["nombre_archivo"] if similar else img["nombre_archivo"]
+        if similar is None:
+            self._canonicas.append({"_dhash": h, "nombre_archivo": nombre})
+        self.apariciones.setdefault(nombre, []).extend(
+            {"pdf_origen": pdf_origen, "pagina": p} for p in img.get("paginas") or [img["pagina"]]
+        )
+        return nombre
+
+    def guardar(self, ruta: Path = APARICIONES_IMAGENES_FILE) -> None:
+        utils.escribir_json_atomico(ruta, self.apariciones)
+
+def guardar_imagenes(extraccion: dict, deduplicador: Optional[DeduplicadorImagenes] = None) -> List[str]:
     """
-    Clasifica un documento usando LLM.
+    Copia a la carpeta de imágenes las imágenes de una extracción ya hecha.
+    Con un deduplicador, las que ya se vieron en otro PDF no se copian (solo se anota su aparición).
+
+    Returns:
+        list: Nombres de archivo escritos.
+    """
+    IMAGENES_DIR.mkdir(parents=True, exist_ok=True)
+    origen = Path(extraccion["dir"]) / "imagenes"
+    escritas = []
+    for img in extraccion["imagenes"]:
+        if deduplicador is not None and deduplicador.registrar(img, extraccion["archivo"]) != img["nombre_archivo"]:
+            continue
+        try:
+            shutil.copyfile(origen / img["fichero"], IMAGENES_DIR / img["nombre_archivo"])
+            escritas.append(img["nombre_archivo"])
+        except OSError as e:
+            logger.warning(f"No se pudo copiar {img['nombre_archivo']}: {e}")
+    return escritas
+
+def extraer_imagen(ruta_pdf):
     """
+    Extrae todas las imágenes de un PDF y las guarda en disco.
+    Las imágenes heredan la categoría del PDF padre.
+    """
+    return guardar_imagenes(extraer_pdf(ruta_pdf))
+
+def _mensajes_clasificacion(nombre_archivo: str, texto_inicio: str) -> list:
+    """Prompt de clasificación de un documento (compartido por la versión síncrona y la asíncrona)."""
     system_prompt = f"""Eres un sistema de clasificación documental para una aplicación RAG legal-administrativa
 dirigida a personas autónomas en Bizkaia.
 Categorías válidas: {', '.join(CATEGORIAS_VALIDAS)}
@@ -104,80 +379,191 @@ TEXTO:
 "{texto_inicio[:1000]}"
 
 CATEGORIA:"""
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def _interpretar_categoria(categoria_raw: str) -> str:
+    for cat in CATEGORIAS_VALIDAS:
+        if cat.lower() in categoria_raw.lower():
+            return cat
+    logger.warning(f"  LLM respondió '{categoria_raw}' (no válida) → Usando 'otros'")
+    return "General"
 
+def clasificar_documento(nombre_archivo: str, texto_inicio: str, client_llm) -> str:
+    """
+    Clasifica un documento usando LLM.
+    """
     try:
         resp = client_llm.chat.completions.create(
             model=MODELO_CLASIFICADOR,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+            messages=_mensajes_clasificacion(nombre_archivo, texto_inicio),
             temperature=0.0
         )
-        categoria_raw = resp.choices[0].message.content.strip()
-        
-        for cat in CATEGORIAS_VALIDAS:
-            if cat.lower() in categoria_raw.lower():
-                return cat
-        
-        logger.warning(f"  LLM respondió '{categoria_raw}' (no válida) → Usando 'otros'")
-        return "General"
+        return _interpretar_categoria(resp.choices[0].message.content.strip())
         
     except Exception as e:
         logger.warning(f"Fallo al clasificar {nombre_archivo}: {e}")
         return "General"
-    
-def cargar_metadata_pdfs(
-    nombre_archivo: str,
-    categoria: str,
-) -> None:
-    metadata_file = utils.project_root() / "data" / "metadata_pdf.json"
-    metadata_file.parent.mkdir(parents=True, exist_ok=True)
 
-    # Si existe, lo cargamos; si no, empezamos lista vacía
-    if metadata_file.exists():
-        with open(metadata_file, "r", encoding="utf-8") as f:
+class LimitadorTasa:
+    """Token bucket asíncrono: como mucho `tasa` peticiones por segundo, con ráfagas de `capacidad`."""
+
+    def __init__(self, tasa: float, capacidad: Optional[float] = None):
+        self.tasa = tasa
+        self.capacidad = capacidad or max(1.0, tasa)
+        self._fichas = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def adquirir(self) -> None:
+        async with self._lock:
+            while True:
+                ahora = time.monotonic()
+                self._fichas = min(self.capacidad, self._fichas + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                await asyncio.sleep((1 - self._fichas) / self.tasa)
+
+def _es_reintentable(error: Exception) -> bool:
+    """429, errores 5xx y fallos de conexión/timeout."""
+    if isinstance(error, APIConnectionError):
+        return True
+    status = getattr(error, "status_code", None)
+    return status == 429 or (status is not None and status >= 500)
+
+def _espera_reintento(error: Exception, intento: int) -> float:
+    """Respeta la cabecera Retry-After si existe; si no, backoff exponencial con jitter."""
+    respuesta = getattr(error, "response", None)
+    retry_after = respuesta.headers.get("retry-after") if respuesta is not None else None
+    try:
+        if retry_after:
+            return float(retry_after)
+    except ValueError:
+        pass
+    return min(60.0, 2 ** intento) * (0.5 + random.random())
+
+async def clasificar_documento_async(nombre_archivo: str, texto_inicio: str, client_async,
+                                     limitador: LimitadorTasa, semaforo: asyncio.Semaphore,
+                                     reintentos: int = 5) -> Tuple[str, bool]:
+    """
+    Clasifica un documento con el cliente asíncrono, respetando la concurrencia y la tasa.
+
+    Returns:
+        tuple: (categoría, True si la respuesta vino del LLM / False si es la de por defecto).
+    """
+    async with semaforo:
+        for intento in range(reintentos + 1):
+            await limitador.adquirir()
             try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                data = []
-    else:
-        data = []
+                resp = await client_async.chat.completions.create(
+                    model=MODELO_CLASIFICADOR,
+                    messages=_mensajes_clasificacion(nombre_archivo, texto_inicio),
+                    temperature=0.0
+                )
+                return _interpretar_categoria(resp.choices[0].message.content.strip()), True
+            except Exception as e:
+                if not _es_reintentable(e) or intento == reintentos:
+                    logger.warning(f"Fallo al clasificar {nombre_archivo}: {e}")
+                    return "General", False
+                espera = _espera_reintento(e, intento)
+                logger.warning(f"  [Clasificación] {nombre_archivo}: {e} → reintento {intento + 1}/{reintentos} en {espera:.1f}s")
+                await asyncio.sleep(espera)
+    return "General", False
 
-    # Evitar duplicados (por nombre de archivo)
-    data = [item for item in data if item.get("archivo") != nombre_archivo]
+def _cargar_cache_clasificacion() -> dict:
+    if not CACHE_CLASIFICACION_FILE.exists():
+        return {}
+    try:
+        with open(CACHE_CLASIFICACION_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        logger.warning(f"Caché de clasificación ilegible en {CACHE_CLASIFICACION_FILE}; se ignora.")
+        return {}
+
+async def clasificar_documentos(extracciones: List[dict], concurrencia: int = None, tasa: float = None,
+                                reintentos: int = None) -> Dict[str, str]:
+    """
+    Clasifica varios PDFs en paralelo (concurrencia y tasa limitadas, con reintentos).
+    Los documentos cuyo hash ya está en la caché de clasificación no se envían al LLM.
+
+    Args:
+        extracciones (list): Resultados de `extraer_pdfs` (con "archivo", "hash" y "texto").
+
+    Returns:
+        dict: {archivo: categoria}
+    """
+    concurrencia = concurrencia or int(os.getenv("CLASIFICACION_CONCURRENCIA", "4"))
+    tasa = tasa or float(os.getenv("CLASIFICACION_RPS", "2"))
+    reintentos = reintentos if reintentos is not None else int(os.getenv("CLASIFICACION_REINTENTOS", "5"))
 
-    # Añadir / actualizar
-    data.append({
-        "archivo": nombre_archivo,
-        "categoria": categoria
-    })
+    cache = _cargar_cache_clasificacion()
+    clave = lambda e: f"{MODELO_CLASIFICADOR}::{e['hash']}"
+    categorias, pendientes = {}, []
+    for e in extracciones:
+        if clave(e) in cache:
+            categorias[e["archivo"]] = cache[clave(e)]
+        else:
+            pendientes.append(e)
+    logger.info(f"[Clasificación] {len(pendientes)} PDFs al LLM ({len(extracciones) - len(pendientes)} en caché), "
+                f"concurrencia={concurrencia}, {tasa} peticiones/s")
 
-    # Guardar
-    with open(metadata_file, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    if pendientes:
+        # Sin reintentos del SDK: el backoff de clasificar_documento_async es la única política
+        client_async = AsyncOpenAI(base_url=LLM_BASE_URL, api_key=LLM_API_KEY, max_retries=0)
+        limitador, semaforo = LimitadorTasa(tasa), asyncio.Semaphore(concurrencia)
+        inicio = time.perf_counter()
+        resultados = await asyncio.gather(*[
+            clasificar_documento_async(e["archivo"], e["texto"], client_async, limitador, semaforo, reintentos)
+            for e in pendientes
+        ])
+        for e, (categoria, del_llm) in zip(pendientes, resultados):
+            categorias[e["archivo"]] = categoria
+            logger.info(f"  [Clasificación] {e['archivo']} → {categoria}")
+            # Solo se cachean las respuestas reales (no el valor por defecto tras un fallo)
+            if del_llm:
+                cache[clave(e)] = categoria
+        utils.escribir_json_atomico(CACHE_CLASIFICACION_FILE, cache)
+        logger.info(f"[Clasificación] {len(pendientes)} PDFs clasificados en {time.perf_counter() - inicio:.2f}s")
+    return categorias
+
+def guardar_metadata_pdfs(categorias: Dict[str, str]) -> None:
+    """
+    Guarda las categorías de todos los PDFs en una sola transacción del almacén de metadatos
+    (y exporta metadata_pdf.json una vez). Conserva las entradas de PDFs que no se han vuelto a clasificar.
+    """
+    funciones_metadatos.obtener_almacen().guardar_pdfs(categorias)
+
+def cargar_metadata_pdfs(
+    nombre_archivo: str,
+    categoria: str,
+) -> None:
+    funciones_metadatos.obtener_almacen().guardar_pdfs({nombre_archivo: categoria})
 
 def generar_metadatos_imagenes_existentes() -> list:
     """
     Genera metadatos SOLO para las imágenes que realmente existen en disco.
-    Lee las categorías directamente del archivo metadata_pdfs.json.
+    Lee las categorías del almacén de metadatos (importado de metadata_pdf.json).
     Esto permite borrar manualmente imágenes no deseadas antes de generar metadatos.
     
     Returns:
         Lista de metadatos solo de imágenes existentes
     """
-    # 1. Cargar categorías desde el JSON de PDFs
-    metadata_pdfs_file = utils.project_root() / "data" / "metadata_pdf.json"
-    
-    if not metadata_pdfs_file.exists():
-        logger.error("No se encontró metadata_pdfs.json. Ejecuta primero el preprocesado de PDFs.")
+    # 1. Cargar categorías {nombre_pdf: categoria} del almacén de metadatos
+    categoria_por_pdf = funciones_metadatos.obtener_almacen().categorias_pdfs()
+
+    if not categoria_por_pdf:
+        logger.error("No hay metadatos de PDFs. Ejecuta primero el preprocesado de PDFs.")
         return []
-    
-    with open(metadata_pdfs_file, "r", encoding="utf-8") as f:
-        pdfs_data = json.load(f)
-    
-    # Crear diccionario {nombre_pdf: categoria}
-    categoria_por_pdf = {item["archivo"]: item["categoria"] for item in pdfs_data}
+
+    # Apariciones de cada imagen canónica (PDFs y páginas), si se extrajo con deduplicación
+    apariciones = {}
+    if APARICIONES_IMAGENES_FILE.exists():
+        with open(APARICIONES_IMAGENES_FILE, "r", encoding="utf-8") as f:
+            apariciones = json.load(f)
     
     # 2. Buscar imágenes en disco
     if not IMAGENES_DIR.exists():
@@ -212,12 +598,15 @@ def generar_metadatos_imagenes_existentes() -> list:
                 logger.warning(f"No se encontró categoría para {pdf_origen}, usando 'Ayudas_y_Subvenciones'")
                 categoria = "Ayudas_y_Subvenciones"
             
+            apariciones_img = apariciones.get(nombre_archivo) or [{"pdf_origen": pdf_origen, "pagina": int(num_pag)}]
             metadatos_imagenes.append({
                 "ruta_imagen": str(ruta_img),
                 "nombre_archivo": nombre_archivo,
                 "pdf_origen": pdf_origen,
                 "categoria": categoria,
-                "pagina": int(num_pag)
+                "pagina": int(num_pag),
+                "paginas": sorted({a["pagina"] for a in apariciones_img if a["pdf_origen"] == pdf_origen}) or [int(num_pag)],
+                "apariciones": apariciones_img
             })
             
             logger.info(f"  ✓ [{categoria}] {nombre_archivo}")
@@ -229,61 +618,48 @@ def generar_metadatos_imagenes_existentes() -> list:
     return metadatos_imagenes
 
 def cargar_metadata_imagenes(metadatos_imagenes: list) -> None:
-    """Guarda metadatos de imágenes en JSON"""
-    metadata_file = utils.project_root() / "data" / "metadata_imagenes.json"
-    metadata_file.parent.mkdir(parents=True, exist_ok=True)
+    """Guarda metadatos de imágenes (upsert por nombre de archivo) y exporta metadata_imagenes.json una vez."""
+    funciones_metadatos.obtener_almacen().guardar_imagenes(metadatos_imagenes)
 
-    if metadata_file.exists():
-        with open(metadata_file, "r", encoding="utf-8") as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                data = []
-    else:
-        data = []
+def main():
+    """
+    Sin argumentos, solo genera los metadatos de las imágenes que hay en disco.
+    Con --extraer, ejecuta además el preprocesado completo de los PDFs: extracción
+    (pool de procesos + caché), clasificación, metadatos y volcado de imágenes.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description="Pre-procesado de PDFs e imágenes")
+    parser.add_argument("--extraer", action="store_true", help="Extrae, clasifica y vuelca las imágenes de todos los PDFs")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos de extracción (por defecto, núcleos de la CPU)")
+    args = parser.parse_args()
 
-    # Añadir nuevas imágenes
-    for img_meta in metadatos_imagenes:
-        # Evitar duplicados por nombre de archivo
-        data = [item for item in data if item.get("nombre_archivo") != img_meta["nombre_archivo"]]
-        data.append(img_meta)
+    if args.extraer:
+        logger.info("Iniciando pre-procesado")
 
-    with open(metadata_file, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+        patron_ruta = os.path.join(PDF_DIR, "*.pdf")
+        archivos = sorted(glob.glob(patron_ruta))
 
-def main():
-    """
-    logger.info("Iniciando pre-procesado")
-    
-    patron_ruta = os.path.join(PDF_DIR, "*.pdf")
-    archivos = glob.glob(patron_ruta)
-    
-    # Setup Cliente LLM
-    client_llm = OpenAI(base_url=LLM_BASE_URL, api_key=LLM_API_KEY)
+        if not archivos:
+            logger.error("No se encontraron archivos PDF en la carpeta.")
+            return
+
+        logger.info(f"Encontrados {len(archivos)} PDFs para procesar\n")
+
+        # 1. Extraer texto e imágenes (cada PDF se abre una sola vez, en paralelo)
+        extracciones = [e for e in extraer_pdfs(archivos, workers=args.workers) if e is not None]
+
+        # 2. Clasificar documentos (concurrente, con límite de tasa y caché por hash)
+        categorias = asyncio.run(clasificar_documentos(extracciones))
+
+        # 3. Guardar metadatos de todos los PDFs de una vez
+        guardar_metadata_pdfs(categorias)
+
+        # 4. Volcar las imágenes únicas (sin metadatos aún) y anotar todas sus apariciones
+        deduplicador = DeduplicadorImagenes()
+        for extraccion in extracciones:
+            guardar_imagenes(extraccion, deduplicador)
+        deduplicador.guardar()
 
-    if not archivos:
-        logger.error("No se encontraron archivos PDF en la carpeta.")
-        return
-    
-    logger.info(f"Encontrados {len(archivos)} PDFs para procesar\n")
-    
-    for archivo in archivos:
-        nombre_archivo = os.path.basename(archivo)
-        logger.info(f"Procesando: {nombre_archivo}")
-        
-        # 1. Leer texto del PDF
-        texto = leer_pdf(archivo)
-        
-        # 2. Clasificar documento
-        categoria = clasificar_documento(nombre_archivo, texto, client_llm)
-        logger.info(f"  [Clasificación] → {categoria}")
-        
-        # 3. Guardar metadatos del PDF
-        cargar_metadata_pdfs(nombre_archivo,categoria)
-        
-        # 4. Extraer TODAS las imágenes (sin metadatos aún)
-        extraer_imagen(archivo)"""
-    
     # Generar metadatos solo de imágenes existentes
     metadatos_imgs = generar_metadatos_imagenes_existentes()
         
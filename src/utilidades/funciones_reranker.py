@@ -0,0 +1,223 @@
+"""
+Backend ONNX cuantizado (int8) para el reranker en CPU.
+Expone la misma interfaz `predict(pairs)` que `sentence_transformers.CrossEncoder`,
+e incluye la exportación del modelo y un benchmark frente al CrossEncoder original.
+
+Uso:
+    python src/utilidades/funciones_reranker.py --exportar
+    python src/utilidades/funciones_reranker.py --benchmark
+"""
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import List, Optional
+import numpy as np
+from dotenv import load_dotenv
+from loguru import logger
+from utilidades import utils
+
+load_dotenv()
+
+MODELO_RERANKER = os.getenv("MODELO_RERANKER", "BAAI/bge-reranker-v2-m3")
+RERANKER_ONNX_PATH = os.getenv("RERANKER_ONNX_PATH", str(utils.project_root() / "modelos" / "reranker_onnx_int8"))
+FICHERO_CUANTIZADO = "model_quantized.onnx"
+
+
+class RerankerONNX:
+    """
+    Reranker sobre ONNX Runtime (CPU) con la interfaz de `CrossEncoder.predict`.
+
+    Igual que el CrossEncoder con una sola salida, aplica una sigmoide a los logits,
+    de modo que los umbrales de `nodo_reranker` siguen siendo válidos.
+    """
+
+    def __init__(self, ruta_modelo: str = RERANKER_ONNX_PATH, max_length: int = 512, batch_size: int = 16,
+                 hilos: Optional[int] = None):
+        """
+        Args:
+            ruta_modelo (str): Carpeta con el modelo exportado y su tokenizer.
+            max_length (int): Longitud máxima (tokens) de cada par pregunta-documento.
+            batch_size (int): Pares por llamada a la sesión ONNX.
+            hilos (int): Hilos intra-op de ONNX Runtime (None = por defecto).
+        """
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        ruta = Path(ruta_modelo)
+        fichero = ruta / FICHERO_CUANTIZADO
+        if not fichero.exists():
+            fichero = ruta / "model.onnx"
+        if not fichero.exists():
+            raise FileNotFoundError(f"No hay modelo ONNX en {ruta}. Ejecuta primero la exportación (--exportar).")
+
+        opciones = ort.SessionOptions()
+        opciones.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if hilos:
+            opciones.intra_op_num_threads = hilos
+
+        self.tokenizer = AutoTokenizer.from_pretrained(str(ruta))
+        self.sesion = ort.InferenceSession(str(fichero), opciones, providers=["CPUExecutionProvider"])
+        self._nombres_entrada = {e.name for e in self.sesion.get_inputs()}
+        self.max_length = max_length
+        self.batch_size = batch_size
+        logger.info(f"[RERANKER] Backend ONNX cargado desde {fichero} (max_length={max_length})")
+
+    def predict(self, pairs: List[list], batch_size: Optional[int] = None) -> np.ndarray:
+        """
+        Puntúa pares (pregunta, documento).
+
+        Args:
+            pairs (list): Lista de pares [pregunta, documento].
+            batch_size (int): Tamaño de lote (por defecto el del constructor).
+
+        Returns:
+            np.ndarray: Una puntuación en [0, 1] por par.
+        """
+        if not pairs:
+            return np.array([], dtype=np.float32)
+        batch_size = batch_size or self.batch_size
+        scores = []
+        for i in range(0, len(pairs), batch_size):
+            lote = pairs[i:i + batch_size]
+            enc = self.tokenizer(
+                [p[0] for p in lote], [p[1] for p in lote],
+                padding=True, truncation="longest_first",
+                max_length=self.max_length, return_tensors="np"
+            )
+            entradas = {k: v.astype(np.int64) for k, v in enc.items() if k in self._nombres_entrada}
+            logits = self.sesion.run(None, entradas)[0]
+            logits = logits[:, 0] if logits.ndim == 2 else logits
+            scores.append(1.0 / (1.0 + np.exp(-logits)))
+        return np.concatenate(scores).astype(np.float32)
+
+
+def exportar_onnx_int8(modelo: str = MODELO_RERANKER, destino: str = RERANKER_ONNX_PATH) -> Path:
+    """
+    Exporta el CrossEncoder a ONNX y lo cuantiza dinámicamente a int8.
+
+    Requiere `optimum[onnxruntime]` (solo para exportar; en producción basta `onnxruntime`).
+
+    Returns:
+        Path: Carpeta con `model_quantized.onnx` y el tokenizer.
+    """
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    destino = Path(destino)
+    destino.mkdir(parents=True, exist_ok=True)
+    logger.info(f"[RERANKER] Exportando {modelo} a ONNX en {destino}...")
+    modelo_ort = ORTModelForSequenceClassification.from_pretrained(modelo, export=True)
+    modelo_ort.save_pretrained(destino)
+    AutoTokenizer.from_pretrained(modelo).save_pretrained(destino)
+
+    logger.info("[RERANKER] Cuantizando a int8 (dinámica)...")
+    quantizer = ORTQuantizer.from_pretrained(destino)
+    quantizer.quantize(
+        save_dir=destino,
+        quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    )
+    logger.info(f"[RERANKER] Modelo cuantizado guardado en {destino / FICHERO_CUANTIZADO}")
+    return destino
+
+
+def cargar_reranker(device: str = "cpu"):
+    """
+    Carga el backend del reranker según RERANKER_BACKEND ("crossencoder" u "onnx").
+    Si el backend ONNX no está disponible, vuelve al CrossEncoder.
+    """
+    backend = os.getenv("RERANKER_BACKEND", "crossencoder").lower()
+    if backend == "onnx":
+        try:
+            return RerankerONNX(
+                RERANKER_ONNX_PATH,
+                max_length=int(os.getenv("RERANKER_MAX_LENGTH", "512"))
+            )
+        except Exception as e:
+            logger.warning(f"[RERANKER] No se pudo cargar el backend ONNX ({e}); usando CrossEncoder.")
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(MODELO_RERANKER, device=device)
+
+
+def _ranking_golden(reranker, collection, model_emb, golden_set: List[dict], candidatos: int = 10, top_k: int = 3) -> dict:
+    """
+    Re-ordena los `candidatos` hijos recuperados por embeddings para cada pregunta del
+    golden set y mide latencia del reranker, hit rate@k y MRR@k sobre el nuevo orden.
+    """
+    latencias, aciertos, mrr_sum = [], 0, 0.0
+    ordenes = []
+    for item in golden_set:
+        pregunta, objetivos = item["query"], item.get("relevant_ids", [])
+        res = collection.query(query_embeddings=utils.generar_embeddings(model_emb, [pregunta]), n_results=candidatos)
+        ids, docs = res["ids"][0], res["documents"][0]
+
+        t0 = time.perf_counter()
+        scores = reranker.predict([[pregunta, d] for d in docs])
+        latencias.append(time.perf_counter() - t0)
+
+        orden = [ids[i] for i in np.argsort(-np.asarray(scores))][:top_k]
+        ordenes.append(orden)
+        for rank, rid in enumerate(orden):
+            if rid in objetivos:
+                aciertos += 1
+                mrr_sum += 1.0 / (rank + 1)
+                break
+
+    total = len(golden_set)
+    return {
+        "latencia_media_ms": 1000 * float(np.mean(latencias)) if latencias else None,
+        "latencia_p95_ms": 1000 * float(np.percentile(latencias, 95)) if latencias else None,
+        "hit_rate": aciertos / total if total else 0.0,
+        "mrr": mrr_sum / total if total else 0.0,
+        "_ordenes": ordenes
+    }
+
+
+def benchmark(candidatos: int = 10, top_k: int = 3) -> dict:
+    """Compara latencia y calidad de ranking (golden set) entre CrossEncoder y ONNX int8."""
+    from sentence_transformers import CrossEncoder, SentenceTransformer
+    from utilidades import funciones_db
+
+    golden_file = os.getenv("GOLDEN_SET_FILE", str(utils.project_root() / "src" / "golden_set_automatico.jsonl"))
+    with open(golden_file, "r", encoding="utf-8") as f:
+        golden_set = [json.loads(line) for line in f if line.strip()]
+
+    model_emb = SentenceTransformer(os.getenv("MODELO_EMBEDDINGS"), device="cpu")
+    collection = funciones_db.obtener_coleccion("pdfs")
+
+    resultados = {}
+    for nombre, reranker in (
+        ("crossencoder", CrossEncoder(MODELO_RERANKER, device="cpu")),
+        ("onnx_int8", RerankerONNX(RERANKER_ONNX_PATH, max_length=int(os.getenv("RERANKER_MAX_LENGTH", "512")))),
+    ):
+        logger.info(f"[BENCHMARK] Evaluando {nombre}...")
+        resultados[nombre] = _ranking_golden(reranker, collection, model_emb, golden_set, candidatos, top_k)
+
+    # Coincidencia del top-1 entre ambos backends
+    o_ce, o_onnx = resultados["crossencoder"].pop("_ordenes"), resultados["onnx_int8"].pop("_ordenes")
+    iguales = sum(1 for a, b in zip(o_ce, o_onnx) if a[:1] == b[:1])
+    resultados["coincidencia_top1"] = iguales / len(o_ce) if o_ce else None
+    logger.info("\n BENCHMARK RERANKER \n" + json.dumps(resultados, indent=2))
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reranker ONNX int8: exportación y benchmark")
+    parser.add_argument("--exportar", action="store_true", help="Exporta y cuantiza el modelo")
+    parser.add_argument("--benchmark", action="store_true", help="Compara con el CrossEncoder en el golden set")
+    parser.add_argument("--candidatos", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.exportar:
+        exportar_onnx_int8()
+    if args.benchmark:
+        benchmark(candidatos=args.candidatos)
+    if not (args.exportar or args.benchmark):
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
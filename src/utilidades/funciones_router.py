@@ -0,0 +1,261 @@
+"""
+Router de intención local basado en embeddings.
+Sustituye la llamada al LLM rápido de `nodo_router` por una comparación con vectores
+prototipo de cada categoría (construidos a partir de los chunks indexados) y de saludos.
+Solo se recurre al LLM cuando el margen de decisión es bajo o la pregunta no se
+parece a ninguna categoría (el LLM puede devolver "otros").
+"""
+
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from loguru import logger
+from utilidades import utils, prompts
+
+load_dotenv()
+
+ETIQUETA_SALUDO = "SALUDO"
+# El saludo solo compite con las categorías si la pregunta es corta y se parece mucho al centroide de saludos
+ROUTER_UMBRAL_SALUDO = float(os.getenv("ROUTER_UMBRAL_SALUDO", "0.6"))
+ROUTER_SALUDO_MAX_PALABRAS = int(os.getenv("ROUTER_SALUDO_MAX_PALABRAS", "6"))
+# Por debajo de esta similitud con la mejor categoría la pregunta no se parece a ninguna: decide el LLM
+ROUTER_SIMILITUD_MINIMA = float(os.getenv("ROUTER_SIMILITUD_MINIMA", "0.25"))
+
+# Ejemplos de mensajes que NO contienen ninguna intención de búsqueda
+SALUDOS_PROTOTIPO = [
+    "hola",
+    "buenas",
+    "buenos días",
+    "buenas tardes",
+    "buenas noches",
+    "hola, ¿qué tal?",
+    "hola, buenas",
+    "gracias",
+    "muchas gracias",
+    "gracias por la ayuda",
+    "adiós",
+    "hasta luego",
+    "agur",
+    "kaixo",
+    "eskerrik asko",
+]
+
+
+class RouterLocal:
+    """
+    Clasificador de intención por similitud con prototipos.
+
+    - Categorías: centroide normalizado de los embeddings de los chunks de cada categoría.
+    - Saludo: centroide normalizado de un conjunto de saludos de ejemplo. Solo compite si la
+      pregunta es corta y su similitud supera `umbral_saludo` (una pregunta real que empieza
+      por "hola" no debe ganar al saludo).
+
+    La confianza es el margen entre la mejor y la segunda mejor puntuación. Si la mejor categoría
+    no llega a `similitud_minima` (la pregunta no se parece a ninguna, p. ej. "otros"), o el margen
+    es bajo, se recurre al LLM.
+    """
+
+    def __init__(self, prototipos: Dict[str, np.ndarray], saludos: np.ndarray, margen_minimo: float = 0.03,
+                 umbral_saludo: float = ROUTER_UMBRAL_SALUDO, similitud_minima: float = ROUTER_SIMILITUD_MINIMA,
+                 saludo_max_palabras: int = ROUTER_SALUDO_MAX_PALABRAS):
+        self.etiquetas = list(prototipos)
+        self._matriz = np.stack([prototipos[e] for e in self.etiquetas]).astype(np.float32)
+        centroide = np.mean(np.asarray(saludos, dtype=np.float32), axis=0)
+        self._saludo = centroide / np.linalg.norm(centroide)
+        self.margen_minimo = margen_minimo
+        self.umbral_saludo = umbral_saludo
+        self.similitud_minima = similitud_minima
+        self.saludo_max_palabras = saludo_max_palabras
+
+    @classmethod
+    def construir(cls, collection, model_emb, categorias: List[str], margen_minimo: float = 0.03):
+        """
+        Construye los prototipos a partir de la colección de PDFs ya indexada.
+
+        Args:
+            collection: Colección de ChromaDB con los chunks hijo (metadato "categoria").
+            model_emb: Modelo de embeddings usado para indexar (SentenceTransformer).
+            categorias (list): Categorías válidas del router.
+            margen_minimo (float): Margen por debajo del cual se recurre al LLM.
+        """
+        t0 = time.perf_counter()
+        datos = collection.get(include=["embeddings", "metadatas"])
+        por_categoria = defaultdict(list)
+        for emb, meta in zip(datos["embeddings"], datos["metadatas"]):
+            cat = (meta or {}).get("categoria") or (meta or {}).get("category")
+            if cat in categorias:
+                por_categoria[cat].append(emb)
+
+        prototipos = {}
+        for cat in categorias:
+            if not por_categoria[cat]:
+                logger.warning(f"[ROUTER LOCAL] Sin chunks para la categoría '{cat}'; no tendrá prototipo.")
+                continue
+            centroide = np.mean(np.asarray(por_categoria[cat], dtype=np.float32), axis=0)
+            prototipos[cat] = centroide / np.linalg.norm(centroide)
+
+        if not prototipos:
+            raise ValueError("No se pudo construir ningún prototipo de categoría a partir de la colección.")
+
+        saludos = np.asarray(utils.generar_embeddings(model_emb, SALUDOS_PROTOTIPO), dtype=np.float32)
+        logger.info(
+            f"[ROUTER LOCAL] Prototipos construidos en {time.perf_counter() - t0:.2f}s: "
+            + ", ".join(f"{c}={len(por_categoria[c])}" for c in prototipos)
+        )
+        return cls(prototipos, saludos, margen_minimo)
+
+    def puntuar(self, embedding: List[float]) -> Dict[str, float]:
+        """Similitud de la pregunta con cada categoría y con el centroide de saludos."""
+        q = np.asarray(embedding, dtype=np.float32)
+        puntuaciones = dict(zip(self.etiquetas, (self._matriz @ q).tolist()))
+        puntuaciones[ETIQUETA_SALUDO] = float(self._saludo @ q)
+        return puntuaciones
+
+    def clasificar(self, embedding: List[float], pregunta: Optional[str] = None) -> Tuple[Optional[str], float, Dict[str, float]]:
+        """
+        Clasifica una pregunta a partir de su embedding.
+
+        Args:
+            embedding (list): Embedding normalizado de la pregunta.
+            pregunta (str, optional): Texto de la pregunta; si se pasa, el saludo solo se
+                considera en preguntas de como mucho `saludo_max_palabras` palabras.
+
+        Returns:
+            tuple: (etiqueta o None si hay que consultar al LLM, margen, puntuaciones).
+        """
+        puntuaciones = self.puntuar(embedding)
+        corta = pregunta is None or len(pregunta.split()) <= self.saludo_max_palabras
+        candidatas = {e: puntuaciones[e] for e in self.etiquetas}
+        if corta and puntuaciones[ETIQUETA_SALUDO] >= self.umbral_saludo:
+            candidatas[ETIQUETA_SALUDO] = puntuaciones[ETIQUETA_SALUDO]
+
+        ordenadas = sorted(candidatas.items(), key=lambda x: x[1], reverse=True)
+        mejor = ordenadas[0]
+        margen = mejor[1] - ordenadas[1][1] if len(ordenadas) > 1 else mejor[1]
+        if mejor[0] != ETIQUETA_SALUDO and mejor[1] < self.similitud_minima:
+            return None, margen, puntuaciones
+        if margen < self.margen_minimo:
+            return None, margen, puntuaciones
+        return mejor[0], margen, puntuaciones
+
+
+def clasificar_con_llm(pregunta: str, client_llm, model_name: str, categorias: List[str]) -> str:
+    """Clasificación con el LLM rápido (cliente OpenAI síncrono), igual que `nodo_router`."""
+    resp = client_llm.chat.completions.create(
+        model=model_name,
+        messages=[
+            {"role": "system", "content": prompts.obtener_prompt_router(categorias)},
+            {"role": "user", "content": f"PREGUNTA DEL USUARIO: '{pregunta}'"}
+        ],
+        temperature=0
+    )
+    clasificacion = resp.choices[0].message.content.strip().replace("'", "").replace('"', "")
+    if clasificacion == ETIQUETA_SALUDO:
+        return ETIQUETA_SALUDO
+    for cat in categorias:
+        if cat.lower() in clasificacion.lower():
+            return cat
+    return "otros"
+
+
+def informe_router(router: RouterLocal, model_emb, golden_set: List[dict], categoria_por_pdf: Dict[str, str],
+                   client_llm=None, model_name: str = None, categorias: List[str] = None) -> dict:
+    """
+    Precisión y latencia del router local frente al golden set.
+
+    La categoría esperada de cada pregunta es la del PDF del que se generó
+    (según el almacén de metadatos). Si se pasa un cliente LLM, también se mide el router LLM.
+
+    Returns:
+        dict: Métricas del informe.
+    """
+    aciertos = decididas = aciertos_decididas = 0
+    latencias_local, latencias_llm = [], []
+    aciertos_llm = 0
+    total = 0
+
+    for item in golden_set:
+        pregunta = item.get("query")
+        source = item.get("metadata", {}).get("source")
+        esperada = categoria_por_pdf.get(source) or item.get("metadata", {}).get("category")
+        if not pregunta or not esperada:
+            continue
+        total += 1
+
+        t0 = time.perf_counter()
+        emb = utils.generar_embeddings(model_emb, [pregunta])[0]
+        etiqueta, margen, _ = router.clasificar(emb, pregunta)
+        latencias_local.append(time.perf_counter() - t0)
+
+        prediccion = etiqueta
+        if client_llm is not None:
+            t0 = time.perf_counter()
+            pred_llm = clasificar_con_llm(pregunta, client_llm, model_name, categorias)
+            latencias_llm.append(time.perf_counter() - t0)
+            aciertos_llm += int(pred_llm == esperada)
+            if etiqueta is None:
+                prediccion = pred_llm
+
+        if etiqueta is not None:
+            decididas += 1
+            aciertos_decididas += int(etiqueta == esperada)
+        aciertos += int(prediccion == esperada)
+        logger.info(f"  [{'OK' if prediccion == esperada else 'KO'}] esperada={esperada} local={etiqueta} margen={margen:.3f} | {pregunta[:60]}")
+
+    informe = {
+        "num_preguntas": total,
+        "precision_local_decididas": aciertos_decididas / decididas if decididas else None,
+        "cobertura_local": decididas / total if total else 0.0,
+        "precision_final": aciertos / total if total else 0.0,
+        "latencia_local_ms": 1000 * float(np.mean(latencias_local)) if latencias_local else None,
+    }
+    if latencias_llm:
+        informe["precision_llm"] = aciertos_llm / total
+        informe["latencia_llm_ms"] = 1000 * float(np.mean(latencias_llm))
+        # Latencia ahorrada: las preguntas decididas localmente no llaman al LLM
+        informe["latencia_ahorrada_ms_por_pregunta"] = informe["latencia_llm_ms"] * informe["cobertura_local"]
+    return informe
+
+
+def main():
+    """Construye el router local y muestra su informe de precisión sobre el golden set."""
+    import argparse
+    from sentence_transformers import SentenceTransformer
+    from utilidades import funciones_db
+
+    parser = argparse.ArgumentParser(description="Informe de precisión del router local")
+    parser.add_argument("--con-llm", action="store_true", help="Compara también con el router LLM")
+    args = parser.parse_args()
+
+    categorias = ["Laboral", "Fiscal", "Ayudas_y_Subvenciones"]
+    model_emb = SentenceTransformer(os.getenv("MODELO_EMBEDDINGS"), device="cpu")
+    router = RouterLocal.construir(
+        funciones_db.obtener_coleccion("pdfs"), model_emb, categorias,
+        margen_minimo=float(os.getenv("ROUTER_MARGEN_MINIMO", "0.03"))
+    )
+
+    golden_file = os.getenv("GOLDEN_SET_FILE", str(utils.project_root() / "src" / "golden_set_automatico.jsonl"))
+    with open(golden_file, "r", encoding="utf-8") as f:
+        golden_set = [json.loads(line) for line in f if line.strip()]
+
+    from utilidades import funciones_metadatos
+    categoria_por_pdf = funciones_metadatos.obtener_almacen().categorias_pdfs()
+
+    client_llm = None
+    if args.con_llm:
+        from openai import OpenAI
+        client_llm = OpenAI(base_url=os.getenv("LLM_BASE_URL"), api_key=os.getenv("LLM_API_KEY"))
+
+    informe = informe_router(
+        router, model_emb, golden_set, categoria_por_pdf,
+        client_llm=client_llm, model_name=os.getenv("MODELO_FAST"), categorias=categorias
+    )
+    logger.info("\n INFORME ROUTER LOCAL \n" + json.dumps(informe, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
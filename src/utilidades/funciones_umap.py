@@ -6,8 +6,8 @@ from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 from loguru import logger
 import os
-import chromadb
 import utils
+import funciones_db
 from dotenv import load_dotenv
 
 # Configuración básica (si se ejecuta directo)
@@ -179,18 +179,18 @@ def visualizar_umap(collections, n_components=3, color_por="categoria"):
         logger.error(f"Error al guardar la visualización: {e}")
 
 def main():
-    DB_DIR = os.getenv("DB_PATH")
-    COLLECTION_NAME_PDFS = os.getenv("COLLECTION_NAME_PDFS")
-    COLLECTION_NAME_IMAGENES = os.getenv("COLLECTION_NAME_IMAGENES")
-    
-    if not os.path.exists(DB_DIR):
+    DB_DIR = funciones_db.DB_PATH
+
+    if not DB_DIR or not os.path.exists(DB_DIR):
         print(f"No existe la base de datos en {DB_DIR}.")
         return
 
+    # Misma resolución que la API: versión activa del alias y fragmentos por categoría
     print("Conectando a ChromaDB...")
-    client_db = chromadb.PersistentClient(path=DB_DIR)
-    collection_pdfs = client_db.get_collection(name=COLLECTION_NAME_PDFS)
-    collection_imagenes = client_db.get_collection(name=COLLECTION_NAME_IMAGENES)
+    funciones_db.registro.abrir()
+    print(f"Versión de las colecciones: {funciones_db.registro.version or 'sin versionar'}")
+    collection_pdfs = funciones_db.obtener_coleccion("pdfs")
+    collection_imagenes = funciones_db.obtener_coleccion("imagenes")
     
     count_pdfs = collection_pdfs.count()
     count_imagenes = collection_imagenes.count()
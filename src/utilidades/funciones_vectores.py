@@ -0,0 +1,608 @@
+"""
+Backends de búsqueda vectorial intercambiables.
+
+`VectorBackend` expone la parte de la interfaz de una colección de Chroma que usan el
+buscador, /buscar-imagenes y la evaluación (`query`, `get`, `count`), con resultados en
+el mismo formato. Hay dos implementaciones:
+
+- `BackendChroma`: delega en la colección (HNSW aproximado).
+- `BackendNumpy`: búsqueda EXACTA por producto escalar sobre una matriz float32 en
+  memmap, con filtrado de metadatos vectorizado (columnas de códigos enteros). Se
+  exporta desde las colecciones de Chroma al directorio de cada versión. Para corpus
+  de unos miles de vectores evita el cliente, los joins de metadatos y la aproximación.
+
+VECTOR_BACKEND=chroma|numpy elige el backend; si no hay exportación se usa Chroma.
+
+Con CUANTIZACION=int8|binary el backend numpy recorre una copia cuantizada residente en
+memoria (int8 por dimensión: 4x menos; binaria por signo: 32x menos) y solo reordena con
+los vectores float32, leídos del memmap bajo demanda, los RESCORING_FACTOR * k mejores
+candidatos (RESCORING_FACTOR_BINARIO * k en binario, que ordena peor). La exportación escribe siempre las tres representaciones.
+
+Uso:
+    python src/utilidades/funciones_vectores.py --exportar
+    python src/utilidades/funciones_vectores.py --benchmark 1000 10000 100000
+    python src/utilidades/funciones_vectores.py --cuantizacion 10000 100000
+    python src/utilidades/funciones_vectores.py --golden
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+from loguru import logger
+
+load_dotenv()
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+NOMBRE_DIRECTORIO = "vectores"
+FICHERO_VECTORES = "vectores.f32"
+FICHERO_DATOS = "datos.json"
+FICHERO_INT8 = "vectores.i8"
+FICHERO_BINARIO = "vectores.b1"
+FICHERO_CUANTIZACION = "cuantizacion.npz"
+CUANTIZACION = os.getenv("CUANTIZACION", "none").lower()
+MODOS_CUANTIZACION = ("none", "int8", "binary")
+RESCORING_FACTOR = int(os.getenv("RESCORING_FACTOR", "4"))
+RESCORING_FACTOR_BINARIO = int(os.getenv("RESCORING_FACTOR_BINARIO", "20"))
+FILAS_POR_BLOQUE = 8192
+SIN_VALOR = -1
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+
+def _contar_bits(x: np.ndarray) -> np.ndarray:
+    """Bits a 1 por fila (np.bitwise_count en NumPy >= 2; tabla por bytes si no)."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).sum(axis=1, dtype=np.uint16)
+    return POPCOUNT[x.view(np.uint8)].sum(axis=1)
+
+
+class VectorBackend:
+    """Interfaz común (subconjunto de `chromadb.Collection`) para buscar vectores."""
+
+    nombre: str = ""
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[dict] = None,
+              include: Optional[List[str]] = None) -> dict:
+        """
+        Returns:
+            dict: {"ids", "documents", "metadatas", "distances"}, una lista por consulta (como Chroma).
+        """
+        raise NotImplementedError
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None,
+            include: Optional[List[str]] = None, limit: Optional[int] = None, offset: Optional[int] = None) -> dict:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+
+class BackendChroma(VectorBackend):
+    """Backend sobre una colección de Chroma (HNSW)."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.nombre = collection.name
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[dict] = None,
+              include: Optional[List[str]] = None) -> dict:
+        kwargs = {"include": include} if include is not None else {}
+        return self.collection.query(query_embeddings=query_embeddings, n_results=n_results, where=where, **kwargs)
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=None) -> dict:
+        kwargs = {"include": include} if include is not None else {}
+        return self.collection.get(ids=ids, where=where, limit=limit, offset=offset, **kwargs)
+
+    def count(self) -> int:
+        return self.collection.count()
+
+
+class BackendNumpy(VectorBackend):
+    """
+    Búsqueda exacta sobre una matriz (N, D) float32 en memmap.
+
+    Las distancias siguen el espacio de la colección de origen ("l2": distancia euclídea
+    al cuadrado, "ip": 1 - producto escalar, "cosine": 1 - coseno), así que los umbrales
+    y el orden son los mismos que con Chroma.
+
+    Con `cuantizacion` "int8" o "binary" la primera pasada usa la copia cuantizada y las
+    distancias devueltas son las exactas de los candidatos reordenados.
+    """
+
+    def __init__(self, directorio: Path, cuantizacion: Optional[str] = None):
+        directorio = Path(directorio)
+        cuantizacion = (cuantizacion or CUANTIZACION).lower()
+        if cuantizacion not in MODOS_CUANTIZACION:
+            raise ValueError(f"Cuantización no soportada: {cuantizacion}")
+        with open(directorio / FICHERO_DATOS, "r", encoding="utf-8") as f:
+            datos = json.load(f)
+        self.nombre = datos.get("nombre", directorio.name)
+        self.espacio = datos.get("espacio", "l2")
+        self._ids: List[str] = datos["ids"]
+        self._documentos: List[Optional[str]] = datos["documentos"]
+        self._metadatos: List[dict] = datos["metadatos"]
+        self._posicion = {id_: i for i, id_ in enumerate(self._ids)}
+        n, dim = len(self._ids), int(datos["dimension"])
+        self._matriz = (
+            np.memmap(directorio / FICHERO_VECTORES, dtype=np.float32, mode="r", shape=(n, dim))
+            if n else np.zeros((0, dim), dtype=np.float32)
+        )
+        self._columnas = self._construir_columnas()
+
+        self.cuantizacion = "none"
+        ruta_params = directorio / FICHERO_CUANTIZACION
+        if ruta_params.exists():
+            with np.load(ruta_params) as params:
+                self._normas2 = params["normas2"]
+                self._minimos, self._escalas, self._medias = params["minimos"], params["escalas"], params["medias"]
+            if cuantizacion == "int8" and n:
+                self._codigos = np.fromfile(directorio / FICHERO_INT8, dtype=np.int8).reshape(n, dim)
+            elif cuantizacion == "binary" and n:
+                self._codigos = np.fromfile(directorio / FICHERO_BINARIO, dtype=np.uint8).reshape(n, -1)
+                if self._codigos.shape[1] % 8 == 0:
+                    self._codigos = self._codigos.view(np.uint64)  # XOR/popcount de 64 bits en 64 bits
+            self.cuantizacion = cuantizacion if n else "none"
+        else:
+            if cuantizacion != "none":
+                logger.warning(f"[VECTORES] {directorio} no tiene copia cuantizada; búsqueda exacta.")
+            self._normas2 = _normas2(self._matriz)
+
+    def _construir_columnas(self) -> Dict[str, tuple]:
+        """Por clave de metadatos: (códigos int32 por fila, {valor: código})."""
+        columnas = {}
+        claves = {k for meta in self._metadatos for k in (meta or {})}
+        for clave in claves:
+            codigos, valores = np.full(len(self._ids), SIN_VALOR, dtype=np.int32), {}
+            for i, meta in enumerate(self._metadatos):
+                if meta and clave in meta:
+                    codigos[i] = valores.setdefault(meta[clave], len(valores))
+            columnas[clave] = (codigos, valores)
+        return columnas
+
+    # ---------- Filtrado ----------
+
+    def _condicion(self, clave: str, condicion) -> np.ndarray:
+        codigos, valores = self._columnas.get(clave, (np.full(len(self._ids), SIN_VALOR, dtype=np.int32), {}))
+        operador, valor = next(iter(condicion.items())) if isinstance(condicion, dict) else ("$eq", condicion)
+        if operador in ("$eq", "$ne"):
+            iguales = codigos == valores.get(valor, -2)
+            return iguales if operador == "$eq" else (codigos != SIN_VALOR) & ~iguales
+        if operador in ("$in", "$nin"):
+            dentro = np.isin(codigos, [valores[v] for v in valor if v in valores])
+            return dentro if operador == "$in" else (codigos != SIN_VALOR) & ~dentro
+        raise ValueError(f"Operador de filtro no soportado: {operador}")
+
+    def mascara(self, where: Optional[dict]) -> Optional[np.ndarray]:
+        """Máscara booleana de filas que cumplen un `where` de Chroma ($eq, $ne, $in, $nin, $and, $or)."""
+        if not where:
+            return None
+        mascara = np.ones(len(self._ids), dtype=bool)
+        for clave, condicion in where.items():
+            if clave == "$and":
+                for sub in condicion:
+                    mascara &= self.mascara(sub)
+            elif clave == "$or":
+                alguna = np.zeros(len(self._ids), dtype=bool)
+                for sub in condicion:
+                    alguna |= self.mascara(sub)
+                mascara &= alguna
+            else:
+                mascara &= self._condicion(clave, condicion)
+        return mascara
+
+    # ---------- Búsqueda ----------
+
+    def _distancias(self, filas: Optional[np.ndarray], consultas: np.ndarray) -> np.ndarray:
+        if filas is None:
+            productos = self._matriz @ consultas.T  # (n, m)
+        elif len(filas) * 4 < len(self._ids):
+            productos = self._matriz[filas] @ consultas.T  # filtro selectivo: copiar pocas filas
+        else:
+            productos = (self._matriz @ consultas.T)[filas]  # filtro amplio: evitar copiar la submatriz
+        if self.espacio == "ip":
+            return 1.0 - productos
+        normas2 = self._normas2 if filas is None else self._normas2[filas]
+        if self.espacio == "cosine":
+            normas_q = np.linalg.norm(consultas, axis=1)
+            return 1.0 - productos / (np.sqrt(normas2)[:, None] * normas_q[None, :] + 1e-12)
+        return np.maximum(normas2[:, None] + np.einsum("ij,ij->i", consultas, consultas)[None, :] - 2 * productos, 0.0)
+
+    def _distancias_aproximadas(self, filas: Optional[np.ndarray], consultas: np.ndarray) -> np.ndarray:
+        """
+        Distancias sobre la copia cuantizada, recorrida por bloques (solo se convierte a
+        float32 un bloque cada vez). En binario son distancias de Hamming: solo sirven para ordenar.
+        """
+        codigos = self._codigos if filas is None else self._codigos[filas]
+        salida = np.empty((len(codigos), len(consultas)), dtype=np.float32)
+        if self.cuantizacion == "binary":
+            bits = np.packbits(consultas > self._medias, axis=1).view(codigos.dtype)
+            for desde in range(0, len(codigos), FILAS_POR_BLOQUE):
+                bloque = codigos[desde:desde + FILAS_POR_BLOQUE]
+                for j, b in enumerate(bits):
+                    salida[desde:desde + len(bloque), j] = _contar_bits(np.bitwise_xor(bloque, b))
+            return salida
+
+        # int8: x ~ minimos + escalas * (c + 128)  =>  x·y = minimos·y + 128 escalas·y + c·(escalas * y)
+        ponderadas = (consultas * self._escalas).T  # (d, m)
+        constante = consultas @ self._minimos + 128.0 * ponderadas.sum(axis=0)
+        for desde in range(0, len(codigos), FILAS_POR_BLOQUE):
+            bloque = codigos[desde:desde + FILAS_POR_BLOQUE]
+            salida[desde:desde + len(bloque)] = bloque.astype(np.float32) @ ponderadas + constante
+        if self.espacio == "ip":
+            return 1.0 - salida
+        normas2 = self._normas2 if filas is None else self._normas2[filas]
+        if self.espacio == "cosine":
+            return 1.0 - salida / (np.sqrt(normas2)[:, None] * np.linalg.norm(consultas, axis=1)[None, :] + 1e-12)
+        return normas2[:, None] + np.einsum("ij,ij->i", consultas, consultas)[None, :] - 2 * salida
+
+    @staticmethod
+    def _mejores(distancias: np.ndarray, k: int) -> np.ndarray:
+        """Posiciones de las k menores distancias, ordenadas."""
+        top = np.argpartition(distancias, k - 1)[:k] if k < len(distancias) else np.arange(len(distancias))
+        return top[np.argsort(distancias[top], kind="stable")]
+
+    def _resultado(self, listas: List[List[int]], distancias: Optional[List[List[float]]], include: List[str]) -> dict:
+        res = {"ids": [[self._ids[i] for i in filas] for filas in listas]}
+        res["documents"] = [[self._documentos[i] for i in filas] for filas in listas] if "documents" in include else None
+        res["metadatas"] = [[self._metadatos[i] for i in filas] for filas in listas] if "metadatas" in include else None
+        res["distances"] = distancias if "distances" in include else None
+        return res
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[dict] = None,
+              include: Optional[List[str]] = None) -> dict:
+        include = include if include is not None else ["documents", "metadatas", "distances"]
+        consultas = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self._matriz.shape[1])
+        mascara = self.mascara(where)
+        filas = None if mascara is None else np.flatnonzero(mascara)
+        n = len(self._ids) if filas is None else len(filas)
+        k = min(n_results, n)
+        if k == 0:
+            return self._resultado([[] for _ in consultas], [[] for _ in consultas], include)
+
+        listas, dists = [], []
+        if self.cuantizacion == "none":
+            distancias = self._distancias(filas, consultas)
+            for j in range(distancias.shape[1]):
+                top = self._mejores(distancias[:, j], k)
+                listas.append((top if filas is None else filas[top]).tolist())
+                dists.append(distancias[top, j].astype(float).tolist())
+            return self._resultado(listas, dists, include)
+
+        # Primera pasada cuantizada; reordenación exacta de los candidatos (filas en orden para el memmap)
+        aproximadas = self._distancias_aproximadas(filas, consultas)
+        c = min(n, k * (RESCORING_FACTOR_BINARIO if self.cuantizacion == "binary" else RESCORING_FACTOR))
+        for j in range(aproximadas.shape[1]):
+            candidatos = self._mejores(aproximadas[:, j], c)
+            candidatos = np.sort(candidatos if filas is None else filas[candidatos])
+            exactas = self._distancias(candidatos, consultas[j:j + 1])[:, 0]
+            top = self._mejores(exactas, k)
+            listas.append(candidatos[top].tolist())
+            dists.append(exactas[top].astype(float).tolist())
+        return self._resultado(listas, dists, include)
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=None) -> dict:
+        include = include if include is not None else ["documents", "metadatas"]
+        if ids is not None:
+            filas = [self._posicion[i] for i in ids if i in self._posicion]
+            mascara = self.mascara(where)
+            if mascara is not None:
+                filas = [i for i in filas if mascara[i]]
+        else:
+            mascara = self.mascara(where)
+            filas = list(range(len(self._ids))) if mascara is None else np.flatnonzero(mascara).tolist()
+        filas = filas[offset or 0:][:limit] if limit is not None else filas[offset or 0:]
+        res = self._resultado([filas], None, include)
+        res = {k: (v[0] if isinstance(v, list) else v) for k, v in res.items()}
+        if "embeddings" in include:
+            res["embeddings"] = np.asarray(self._matriz[filas])
+        return res
+
+    def count(self) -> int:
+        return len(self._ids)
+
+    def memoria_mb(self) -> float:
+        """Memoria que recorre cada búsqueda: la matriz float32 o la copia cuantizada (más las normas)."""
+        recorrida = self._matriz.nbytes if self.cuantizacion == "none" else self._codigos.nbytes
+        return round((recorrida + self._normas2.nbytes) / 2**20, 2)
+
+
+# ==========================================
+# EXPORTACIÓN DESDE CHROMA
+# ==========================================
+
+def _normas2(matriz: np.ndarray) -> np.ndarray:
+    normas = np.empty(len(matriz), dtype=np.float32)
+    for desde in range(0, len(matriz), FILAS_POR_BLOQUE):
+        bloque = matriz[desde:desde + FILAS_POR_BLOQUE]
+        normas[desde:desde + len(bloque)] = np.einsum("ij,ij->i", bloque, bloque)
+    return normas
+
+
+def cuantizar(directorio: Path, n: int, dimension: int) -> None:
+    """
+    Escribe junto a `vectores.f32` las copias int8 (escala y mínimo por dimensión) y binaria
+    (signo respecto a la media de cada dimensión) y los parámetros para consultarlas.
+    """
+    directorio = Path(directorio)
+    matriz = (
+        np.memmap(directorio / FICHERO_VECTORES, dtype=np.float32, mode="r", shape=(n, dimension))
+        if n else np.zeros((0, dimension), dtype=np.float32)
+    )
+    minimos = np.full(dimension, np.inf, dtype=np.float32)
+    maximos = np.full(dimension, -np.inf, dtype=np.float32)
+    sumas = np.zeros(dimension, dtype=np.float64)
+    for desde in range(0, n, FILAS_POR_BLOQUE):
+        bloque = matriz[desde:desde + FILAS_POR_BLOQUE]
+        minimos, maximos = np.minimum(minimos, bloque.min(axis=0)), np.maximum(maximos, bloque.max(axis=0))
+        sumas += bloque.sum(axis=0, dtype=np.float64)
+    if not n:
+        minimos, maximos = np.zeros(dimension, dtype=np.float32), np.zeros(dimension, dtype=np.float32)
+    escalas = (maximos - minimos) / 255.0
+    escalas[escalas == 0] = 1.0
+    medias = (sumas / max(n, 1)).astype(np.float32)
+
+    with open(directorio / FICHERO_INT8, "wb") as f_int8, open(directorio / FICHERO_BINARIO, "wb") as f_bin:
+        for desde in range(0, n, FILAS_POR_BLOQUE):
+            bloque = matriz[desde:desde + FILAS_POR_BLOQUE]
+            codigos = np.clip(np.rint((bloque - minimos) / escalas) - 128, -128, 127).astype(np.int8)
+            f_int8.write(codigos.tobytes())
+            f_bin.write(np.packbits(bloque > medias, axis=1).tobytes())
+    np.savez(directorio / FICHERO_CUANTIZACION, normas2=_normas2(matriz), minimos=minimos,
+             escalas=escalas.astype(np.float32), medias=medias)
+
+def directorio_backend(directorio_version: Path, tipo: str) -> Path:
+    return Path(directorio_version) / NOMBRE_DIRECTORIO / tipo
+
+
+def exportar_desde_chroma(collection, destino: Path, lote: int = 5000) -> dict:
+    """
+    Vuelca vectores, documentos y metadatos de una colección a `destino` (memmap + JSON).
+    Se escribe en un directorio temporal y se renombra al final: los lectores nunca ven una exportación a medias.
+
+    Returns:
+        dict: {"vectores", "dimension", "segundos"}
+    """
+    import shutil
+
+    inicio = time.perf_counter()
+    destino = Path(destino)
+    tmp = destino.with_name(destino.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    total = collection.count()
+    ids, documentos, metadatos, dimension = [], [], [], 0
+    with open(tmp / FICHERO_VECTORES, "wb") as f:
+        for desde in range(0, total, lote):
+            datos = collection.get(include=["embeddings", "documents", "metadatas"], limit=lote, offset=desde)
+            embs = np.asarray(datos["embeddings"], dtype=np.float32)
+            if len(embs):
+                dimension = embs.shape[1]
+                f.write(embs.tobytes())
+            ids.extend(datos["ids"])
+            documentos.extend(datos["documents"] or [None] * len(datos["ids"]))
+            metadatos.extend(datos["metadatas"] or [{}] * len(datos["ids"]))
+
+    cuantizar(tmp, len(ids), dimension)
+    espacio = (collection.metadata or {}).get("hnsw:space", "l2")
+    with open(tmp / FICHERO_DATOS, "w", encoding="utf-8") as f:
+        json.dump({"nombre": collection.name, "espacio": espacio, "dimension": dimension, "ids": ids,
+                   "documentos": documentos, "metadatos": metadatos}, f, ensure_ascii=False)
+
+    viejo = destino.with_name(destino.name + ".old")
+    shutil.rmtree(viejo, ignore_errors=True)
+    if destino.exists():
+        os.replace(destino, viejo)
+    os.replace(tmp, destino)
+    shutil.rmtree(viejo, ignore_errors=True)
+    resumen = {"vectores": len(ids), "dimension": dimension, "segundos": round(time.perf_counter() - inicio, 3)}
+    logger.info(f"[VECTORES] Exportada '{collection.name}' a {destino}: {resumen}")
+    return resumen
+
+
+def exportar_version(directorio_version: Path, colecciones: dict) -> None:
+    """Exporta las colecciones {"pdfs": col, "imagenes": col} de una versión (si el backend numpy está activo)."""
+    if VECTOR_BACKEND != "numpy":
+        return
+    for tipo, collection in colecciones.items():
+        exportar_desde_chroma(collection, directorio_backend(directorio_version, tipo))
+
+
+# ==========================================
+# SELECCIÓN DEL BACKEND
+# ==========================================
+
+_backends: Dict[Path, tuple] = {}
+_backends_lock = threading.Lock()
+
+
+def _marca(directorio: Path):
+    try:
+        return (directorio / FICHERO_DATOS).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def obtener_backend(tipo: str = "pdfs") -> VectorBackend:
+    """
+    Backend de la versión de las colecciones que sirve el registro.
+    Con VECTOR_BACKEND=numpy usa la exportación de esa versión (recargándola si se ha
+    vuelto a exportar); si no existe, cae a Chroma.
+    """
+    from utilidades import funciones_db
+
+    collection = funciones_db.obtener_coleccion(tipo)
+    if VECTOR_BACKEND != "numpy":
+        return BackendChroma(collection)
+    directorio = directorio_backend(funciones_db.registro.directorio(), tipo)
+    marca = _marca(directorio)
+    if marca is None:
+        logger.warning(f"[VECTORES] No hay exportación en {directorio}; usando Chroma.")
+        return BackendChroma(collection)
+    with _backends_lock:
+        actual = _backends.get(directorio)
+        if actual is None or actual[0] != marca:
+            actual = (marca, BackendNumpy(directorio))
+            _backends[directorio] = actual
+            logger.info(f"[VECTORES] Backend numpy '{tipo}' cargado: {actual[1].count()} vectores ({actual[1].memoria_mb()} MB)")
+        return actual[1]
+
+
+# ==========================================
+# BENCHMARK
+# ==========================================
+
+def _vectores_sinteticos(n: int, dim: int, semilla: int = 0) -> np.ndarray:
+    """Vectores normalizados agrupados en "temas" (más realista que ruido uniforme para HNSW)."""
+    rng = np.random.default_rng(semilla)
+    centros = rng.standard_normal((max(n // 200, 8), dim)).astype(np.float32)
+    x = centros[rng.integers(0, len(centros), n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def benchmark(tamanos: List[int], dim: int = 768, consultas: int = 200, k: int = 10) -> dict:
+    """
+    Latencia (p50/p95 por consulta) y recall@k frente a la búsqueda exacta para Chroma (HNSW)
+    y el backend numpy, con un filtro de categoría y sin él.
+    """
+    import tempfile
+    import chromadb
+
+    categorias = ["Laboral", "Fiscal", "Ayudas_y_Subvenciones"]
+    resultados = {}
+    for n in tamanos:
+        x = _vectores_sinteticos(n, dim)
+        q = _vectores_sinteticos(consultas, dim, semilla=1)
+        ids = [f"v{i}" for i in range(n)]
+        metas = [{"categoria": categorias[i % 3], "source": f"doc{i % 50}.pdf"} for i in range(n)]
+        resultados[n] = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            cliente = chromadb.PersistentClient(path=str(Path(tmp) / "chroma"))
+            col = cliente.create_collection(f"bench_{n}")
+            t0 = time.perf_counter()
+            for i in range(0, n, 5000):
+                col.add(ids=ids[i:i + 5000], embeddings=x[i:i + 5000].tolist(), metadatas=metas[i:i + 5000])
+            carga_chroma = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            exportar_desde_chroma(col, Path(tmp) / "numpy")
+            exportacion = time.perf_counter() - t0
+            backends = {"chroma": BackendChroma(col), "numpy": BackendNumpy(Path(tmp) / "numpy")}
+
+            for filtro in (None, {"categoria": "Fiscal"}):
+                etiqueta = "filtrado" if filtro else "sin_filtro"
+                exactos = backends["numpy"].query(q, n_results=k, where=filtro, include=[])["ids"]
+                for nombre, backend in backends.items():
+                    latencias, aciertos = [], 0
+                    for j in range(consultas):
+                        t0 = time.perf_counter()
+                        res = backend.query(q[j:j + 1].tolist(), n_results=k, where=filtro, include=["distances"])
+                        latencias.append(time.perf_counter() - t0)
+                        aciertos += len(set(res["ids"][0]) & set(exactos[j]))
+                    resultados[n].setdefault(nombre, {})[etiqueta] = {
+                        "p50_ms": round(1000 * float(np.percentile(latencias, 50)), 3),
+                        "p95_ms": round(1000 * float(np.percentile(latencias, 95)), 3),
+                        f"recall@{k}": round(aciertos / (consultas * k), 4)
+                    }
+            resultados[n]["chroma"]["carga_s"] = round(carga_chroma, 2)
+            resultados[n]["numpy"]["exportacion_s"] = round(exportacion, 2)
+            resultados[n]["numpy"]["memoria_mb"] = backends["numpy"].memoria_mb()
+            cliente.clear_system_cache()
+        logger.info(f"[BENCHMARK] {n} vectores: {json.dumps(resultados[n])}")
+    return resultados
+
+
+def benchmark_cuantizacion(tamanos: List[int], dim: int = 768, consultas: int = 200, k: int = 10) -> dict:
+    """
+    Memoria recorrida por búsqueda, latencia (p50/p95) y recall@k frente a la búsqueda exacta
+    del backend numpy sin cuantizar, con int8 y con binario (+ reordenación exacta).
+    """
+    import tempfile
+
+    resultados = {}
+    for n in tamanos:
+        x = _vectores_sinteticos(n, dim)
+        q = _vectores_sinteticos(consultas, dim, semilla=1)
+        resultados[n] = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            destino = Path(tmp)
+            x.tofile(destino / FICHERO_VECTORES)
+            with open(destino / FICHERO_DATOS, "w", encoding="utf-8") as f:
+                json.dump({"nombre": f"bench_{n}", "espacio": "l2", "dimension": dim, "ids": [f"v{i}" for i in range(n)],
+                           "documentos": [None] * n, "metadatos": [{}] * n}, f)
+            t0 = time.perf_counter()
+            cuantizar(destino, n, dim)
+            resultados[n]["cuantizacion_s"] = round(time.perf_counter() - t0, 2)
+
+            exactos = None
+            for modo in MODOS_CUANTIZACION:
+                backend = BackendNumpy(destino, cuantizacion=modo)
+                latencias, ids = [], []
+                for j in range(consultas):
+                    t0 = time.perf_counter()
+                    ids.append(backend.query(q[j:j + 1], n_results=k, include=[])["ids"][0])
+                    latencias.append(time.perf_counter() - t0)
+                exactos = exactos or ids
+                aciertos = sum(len(set(a) & set(b)) for a, b in zip(ids, exactos))
+                resultados[n][modo] = {
+                    "memoria_mb": backend.memoria_mb(),
+                    "p50_ms": round(1000 * float(np.percentile(latencias, 50)), 3),
+                    "p95_ms": round(1000 * float(np.percentile(latencias, 95)), 3),
+                    f"recall@{k}": round(aciertos / (consultas * k), 4)
+                }
+                del backend
+        logger.info(f"[BENCHMARK] Cuantización, {n} vectores: {json.dumps(resultados[n])}")
+    return resultados
+
+
+def evaluar_golden(tipo: str = "pdfs", top_k: int = 3) -> dict:
+    """Hit rate, MRR, latencia y memoria en el golden set de la exportación activa, por modo de cuantización."""
+    from sentence_transformers import SentenceTransformer
+    from utilidades import funciones_db, funciones_evaluacion
+
+    with open(funciones_evaluacion.GOLDEN_SET_FILE, "r", encoding="utf-8") as f:
+        golden_set = [json.loads(line) for line in f if line.strip()]
+    directorio = directorio_backend(funciones_db.registro.directorio(), tipo)
+    backends = {modo: BackendNumpy(directorio, cuantizacion=modo) for modo in MODOS_CUANTIZACION}
+    model_emb = SentenceTransformer(funciones_db.MODELO_EMBEDDINGS, device="cpu")
+    informe = funciones_evaluacion.evaluar_retrieval_backends(backends, model_emb, golden_set, top_k=top_k)
+    for modo, backend in backends.items():
+        informe[modo]["memoria_mb"] = backend.memoria_mb()
+    return informe
+
+
+def main():
+    import argparse
+    from utilidades import funciones_db
+
+    parser = argparse.ArgumentParser(description="Backends vectoriales: exportación a numpy, cuantización y benchmarks")
+    parser.add_argument("--exportar", action="store_true", help="Exporta las colecciones de la versión activa")
+    parser.add_argument("--benchmark", type=int, nargs="*", metavar="N", help="Tamaños a comparar (por defecto 1k 10k 100k)")
+    parser.add_argument("--cuantizacion", type=int, nargs="*", metavar="N",
+                        help="Compara exacto / int8 / binario en vectores sintéticos (por defecto 10k 100k)")
+    parser.add_argument("--golden", action="store_true", help="Compara exacto / int8 / binario en el golden set")
+    parser.add_argument("--dim", type=int, default=768)
+    args = parser.parse_args()
+
+    if args.exportar:
+        for tipo in ("pdfs", "imagenes"):
+            exportar_desde_chroma(
+                funciones_db.obtener_coleccion(tipo), directorio_backend(funciones_db.registro.directorio(), tipo)
+            )
+    if args.benchmark is not None:
+        informe = benchmark(args.benchmark or [1000, 10000, 100000], dim=args.dim)
+        logger.info("\n BENCHMARK BACKENDS VECTORIALES \n" + json.dumps(informe, indent=2))
+    if args.cuantizacion is not None:
+        informe = benchmark_cuantizacion(args.cuantizacion or [10000, 100000], dim=args.dim)
+        logger.info("\n BENCHMARK CUANTIZACIÓN \n" + json.dumps(informe, indent=2))
+    if args.golden:
+        logger.info("\n CUANTIZACIÓN EN EL GOLDEN SET \n" + json.dumps(evaluar_golden(), indent=2))
+    if not (args.exportar or args.golden) and args.benchmark is None and args.cuantizacion is None:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
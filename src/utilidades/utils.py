@@ -1,52 +1,147 @@
 from pathlib import Path 
+import hashlib
+import json
+import os
 import re
 from loguru import logger
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from typing import List
-
-def generar_embeddings(model, textos: List[str], batch_size: int = 64) -> List[List[float]]:
+from utilidades import funciones_chunking
+from typing import List, Optional
+
+# Versión de la limpieza + chunking. Cambiarla fuerza a re-indexar todos los PDFs
+# en la ingesta incremental (ver funciones_indexado).
+VERSION_CHUNKER = "limpieza-v1_padre2000-200_hijo400-50"
+
+_caches_embeddings = {}
+_usar_cache_embeddings = None  # None: se decide con EMBEDDINGS_CACHE en el primer uso
+
+def usar_cache_embeddings(activa: bool) -> None:
+    """Activa o desactiva la caché de embeddings en disco para este proceso."""
+    global _usar_cache_embeddings
+    _usar_cache_embeddings = activa
+
+def _nombre_modelo(model) -> Optional[str]:
+    """Identificador del modelo para separar las cachés (None si no se puede determinar)."""
+    nombre = getattr(getattr(model, "model_card_data", None), "base_model", None)
+    if not nombre:
+        try:
+            nombre = model[0].auto_model.config._name_or_path
+        except Exception:
+            return None
+    return nombre
+
+def cache_embeddings(model):
+    """Caché de embeddings en disco del modelo dado (una por modelo y proceso), o None."""
+    global _usar_cache_embeddings
+    if _usar_cache_embeddings is None:
+        _usar_cache_embeddings = os.getenv("EMBEDDINGS_CACHE", "true").lower() == "true"
+    if not _usar_cache_embeddings:
+        return None
+    nombre = _nombre_modelo(model)
+    if nombre is None:
+        return None
+    if nombre not in _caches_embeddings:
+        from utilidades import funciones_cache
+        directorio = Path(os.getenv("EMBEDDINGS_CACHE_DIR") or project_root() / "data" / "cache_embeddings")
+        _caches_embeddings[nombre] = funciones_cache.CacheEmbeddings(
+            directorio / re.sub(r"[^\w.-]", "_", nombre), nombre,
+            max_mb=float(os.getenv("EMBEDDINGS_CACHE_MAX_MB", "1024"))
+        )
+    return _caches_embeddings[nombre]
+
+def generar_embeddings(model, textos: List[str], batch_size: int = 64, usar_cache: bool = True) -> List[List[float]]:
     """Genera embeddings usando el modelo SentenceTransformer dado.
 
+    Antes de codificar consulta la caché de embeddings en disco y solo codifica los textos
+    que no estén en ella.
+
     Args:
         model: SentenceTransformer instance.
         textos: lista de strings a convertir.
         batch_size: tamaño de batch para `model.encode`.
+        usar_cache: si es False, codifica siempre (p. ej. preguntas de usuario en la API).
 
     Returns:
         Lista de vectores (listas de floats).
     """
-    return model.encode(textos, batch_size=batch_size, normalize_embeddings=True).tolist()
+    cache = cache_embeddings(model) if usar_cache and textos else None
+    if cache is None:
+        return model.encode(textos, batch_size=batch_size, normalize_embeddings=True).tolist()
+
+    encontrados = cache.obtener(textos)
+    faltan = [i for i in range(len(textos)) if i not in encontrados]
+    if faltan:
+        nuevos = model.encode([textos[i] for i in faltan], batch_size=batch_size, normalize_embeddings=True)
+        cache.guardar([textos[i] for i in faltan], nuevos)
+        encontrados.update(zip(faltan, nuevos))
+    return [encontrados[i].tolist() for i in range(len(textos))]
 
 def project_root() -> Path:
     return Path(__file__).resolve().parents[2]
 
-def limpiar_texto(texto: str) -> str:
+def escribir_json_atomico(ruta: Path, datos, indent: Optional[int] = 2) -> None:
+    """
+    Escribe un JSON de forma atómica (temporal + rename): quien lo lea ve el anterior o el nuevo, nunca uno a medias.
+    Con indent=None se escribe compacto (cachés grandes que nadie lee a mano).
+    """
+    ruta = Path(ruta)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    tmp = ruta.with_suffix(ruta.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(datos, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp, ruta)
+
+def hash_fichero(ruta: Path, bloque: int = 1 << 20) -> str:
+    """SHA-256 del contenido de un fichero (lectura por bloques)."""
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for trozo in iter(lambda: f.read(bloque), b""):
+            h.update(trozo)
+    return h.hexdigest()
+
+# Expresiones de limpieza precompiladas (limpiar_texto se llama una vez por segmento/documento)
+_TABLA_LIMPIEZA = str.maketrans({"\r": "\n", "\t": " ", "\u00A0": " "})
+_RE_GUION_FIN_LINEA = re.compile(r"(\w)-\n(\w)")
+_RE_SALTO_SUELTO = re.compile(r"(?<!\n)\n(?!\n)")
+_RE_ESPACIOS = re.compile(r"[ ]{2,}")
+_RE_CORTE_LIMPIEZA = re.compile(r"[\r\n]{2}(?=[^\r\n])")
+
+def corte_limpieza(texto: str) -> int:
+    """
+    Última posición (tras un salto de párrafo) en la que `limpiar_texto(..., recortar=False)`
+    da lo mismo aplicada a cada lado por separado que al texto entero; 0 si no hay ninguna.
+    """
+    corte = 0
+    for m in _RE_CORTE_LIMPIEZA.finditer(texto):
+        corte = m.end()
+    return corte
+
+def limpiar_texto(texto: str, recortar: bool = True) -> str:
     """
     Limpieza SUAVE para texto extraído de PDF, pensada para embeddings.
     Objetivo: quitar ruido de extracción SIN perder información técnica.
 
     Limpieza suave para PDFs (quitar ruido sin destruir semántica, los embeddings (Qwen) entienden tildes, mayúsculas y contexto)
     No queremos destruir esa información. Solo queremos quitar el "ruido de PDF" (guiones partidos, espacios raros).
+
+    Con `recortar=False` no quita los espacios de los extremos (limpieza por fragmentos, ver `corte_limpieza`).
     """
     if not texto:
         return ""
 
-    #Convertir todos los retornos de carro (\r) en saltos de línea (\n) y los tabs (\t) en espacios.
-    t = texto.replace("\r", "\n").replace("\t", " ")
+    # Retornos de carro (\r) -> saltos de línea, tabs (\t) y espacios no separables (\u00A0) -> espacios
+    t = texto.translate(_TABLA_LIMPIEZA)
 
     # Unir palabras cortadas por guion al final de línea:
-    t = re.sub(r"(\w)-\n(\w)", r"\1\2", t)
+    t = _RE_GUION_FIN_LINEA.sub(r"\1\2", t)
 
     # Convertir saltos de línea “sueltos” en espacios (sin cargarse párrafos)
-    t = re.sub(r"(?<!\n)\n(?!\n)", " ", t)
-
-    # Sustituir caracteres como el espacio no separable (\u00A0) por espacios normales.
-    t = t.replace("\u00A0", " ")
+    t = _RE_SALTO_SUELTO.sub(" ", t)
 
     #Compactar espacios
-    t = re.sub(r"[ ]{2,}", " ", t).strip()
+    t = _RE_ESPACIOS.sub(" ", t)
 
-    return t
+    return t.strip() if recortar else t
 
 def hacer_chunking(texto: str, chunk_size, overlap) -> list:
     """
@@ -84,26 +179,25 @@ def chunk_padre_hijo(texto: str) -> list:
     
     Al final, guardamos el HIJO en la base de datos, pero le metemos una nota 
     en su mochila (metadatos) que contiene el texto del PADRE entero.
-    """
-    chunks_procesados = []
-
-    chunks_padre = hacer_chunking(texto, chunk_size=2000, overlap=200) #4000 y 200
-    
-    logger.info(f"Generados {len(chunks_padre)} Chunks padre.")
-    
-    total_hijos = 0
 
-    for i, texto_padre in enumerate(chunks_padre):
-        chunks_hijo = hacer_chunking(texto_padre, chunk_size=400, overlap=50) #1000 y 100
-        total_hijos += len(chunks_hijo)
-
-        for texto_hijo in chunks_hijo:
-            chunks_procesados.append({
-                "texto_vectorizable": texto_hijo,     
-                "texto_completo_padre": texto_padre,  
-                "padre_id": i
-            })
-
-    logger.info(f"Generados {total_hijos} Chunks hijo.")
-
-    return chunks_procesados
\ No newline at end of file
+    El troceo lo hace `funciones_chunking` sobre offsets (mismos cortes que
+    `hacer_chunking`/RecursiveCharacterTextSplitter); cada hijo lleva además su
+    posición (inicio, fin) en el texto limpio.
+    """
+    padres, hijos = funciones_chunking.trocear_padre_hijo(texto, 2000, 200, 400, 50) #4000 y 200 / 1000 y 100
+
+    logger.info(f"Generados {len(padres)} Chunks padre.")
+    logger.info(f"Generados {len(hijos)} Chunks hijo.")
+
+    # Cada texto padre se materializa una sola vez y lo comparten sus hijos
+    textos_padre = [texto[a:b] for a, b in padres]
+    return [
+        {
+            "texto_vectorizable": texto[inicio:fin],
+            "texto_completo_padre": textos_padre[padre_id],
+            "padre_id": padre_id,
+            "inicio": inicio,
+            "fin": fin
+        }
+        for inicio, fin, padre_id in hijos
+    ]